@@ -0,0 +1,83 @@
+"""滾動分析：由本地價格歷史與持股時間軸向量化計算報酬、波動、回撤、相關性與 Beta"""
+import numpy as np
+import pandas as pd
+
+TRADING_DAYS = 252
+BENCHMARK = 'VOO'
+
+
+def holdings_timeline(df_stock, dates):
+    """每日持有股數（日期 × 代碼），以交易累計後向前補齊"""
+    if df_stock is None or df_stock.empty:
+        return pd.DataFrame(index=dates)
+    ledger = df_stock.copy()
+    ledger['日期'] = pd.to_datetime(ledger['交易日期'], errors='coerce').dt.normalize()
+    ledger['股票代碼'] = ledger['股票代碼'].astype(str).str.upper()
+    shares = pd.to_numeric(ledger['股數'], errors='coerce').fillna(0).abs()
+    ledger['變動'] = shares.where(ledger['交易類型'] == '買進', -shares)
+    changes = ledger.pivot_table(index='日期', columns='股票代碼', values='變動', aggfunc='sum').fillna(0)
+    # 非交易日的交易併入下一個交易日
+    position = changes.cumsum().reindex(changes.index.union(dates)).ffill().fillna(0)
+    return position.reindex(dates).clip(lower=0)
+
+
+def portfolio_returns(prices, shares):
+    """時間加權每日報酬：扣除當日買賣造成的資金流入流出"""
+    common = [c for c in shares.columns if c in prices.columns]
+    if not common:
+        return pd.Series(dtype=float), pd.Series(dtype=float)
+    px = prices[common].ffill()
+    sh = shares[common]
+    value = (px * sh).sum(axis=1, min_count=1)
+    flow = (sh.diff().fillna(sh) * px).sum(axis=1)
+    prev = value.shift(1)
+    returns = ((value - flow) / prev - 1).where(prev > 0)
+    return returns.dropna(), value
+
+
+def max_drawdown(returns):
+    """最大回撤與回撤序列"""
+    if returns.empty:
+        return 0.0, pd.Series(dtype=float)
+    wealth = (1 + returns).cumprod()
+    drawdown = wealth / wealth.cummax() - 1
+    return float(drawdown.min()), drawdown
+
+
+def compute_analytics(prices, df_stock, window=30, benchmark=BENCHMARK):
+    """計算分析頁所需的所有指標，回傳 dict"""
+    if prices is None or prices.empty:
+        return None
+    prices = prices.sort_index()
+    shares = holdings_timeline(df_stock, prices.index)
+    returns, value = portfolio_returns(prices, shares)
+    if returns.empty:
+        return None
+
+    asset_returns = prices.ffill().pct_change(fill_method=None)
+    held = [c for c in shares.columns if c in prices.columns and shares[c].iloc[-1] > 0]
+
+    daily_mean = returns.mean()
+    result = {
+        'returns': returns,
+        'value': value.dropna(),
+        'daily_return': float(daily_mean),
+        'annual_return': float((1 + returns).prod() ** (TRADING_DAYS / len(returns)) - 1),
+        'annual_volatility': float(returns.std() * np.sqrt(TRADING_DAYS)),
+        'rolling_volatility': returns.rolling(window).std() * np.sqrt(TRADING_DAYS),
+        'rolling_return': (1 + returns).rolling(window).apply(np.prod, raw=True) - 1,
+    }
+    result['max_drawdown'], result['drawdown'] = max_drawdown(returns)
+    result['correlation'] = asset_returns[held].corr() if len(held) > 1 else pd.DataFrame()
+
+    # 組合與各持股對 VOO 的 Beta
+    beta = {}
+    if benchmark in asset_returns.columns:
+        bench = asset_returns[benchmark]
+        aligned = pd.concat([returns.rename('組合'), asset_returns[held]], axis=1).loc[returns.index]
+        bench = bench.reindex(aligned.index)
+        var = bench.var()
+        if var and var > 0:
+            beta = (aligned.apply(lambda col: col.cov(bench)) / var).to_dict()
+    result['beta'] = beta
+    return result
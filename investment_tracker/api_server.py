@@ -0,0 +1,227 @@
+"""本地 HTTP API：由記憶體快取提供投資組合快照、持股、損益與價格警示（JSON，支援 ETag 條件請求）
+
+回應內容只在資料檔或警示記錄變更、報價更新時重新計算，請求本身只回傳預先序列化好的位元組。
+
+命令列:
+    python api_server.py <資料夾路徑> [--port 8765] [--quote-interval 300] [--bench 2000]
+
+端點:
+    GET /api/snapshot   總計、資金配置、持股與合規警示
+    GET /api/holdings   分類 × 代碼持股、市值與損益
+    GET /api/pnl        總損益與各配置項目損益
+    GET /api/alerts     安全邊際檔位狀態與最近的警示記錄
+    GET /api/health     快取狀態
+"""
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+import market_data
+import overview
+import portfolio_core
+import price_ladder
+
+DEFAULT_PORT = 8765
+QUOTE_INTERVAL = 300
+RECENT_ALERTS = 50
+RELOAD_RETRY = 5.0
+# 資料檔之外也監看警示記錄，price_ladder 或規劃頁附加的警示才會出現在 /api/alerts
+WATCHED_FILES = [*portfolio_core.FILE_MAPPING, price_ladder.ALERT_LOG_FILE]
+
+
+def _records(df):
+    """DataFrame → list of dict（NaN 轉為 null）"""
+    if df is None or df.empty:
+        return []
+    return json.loads(df.to_json(orient='records', force_ascii=False, date_format='iso'))
+
+
+def build_payloads(tables, quotes, alert_log, as_of=None):
+    """計算所有端點的回應內容 {路徑: dict}"""
+    summary = overview.summarize(tables, quotes, as_of)
+    holdings = summary['holdings'].copy()
+    if not holdings.empty:
+        holdings['損益(USD)'] = holdings['市值(USD)'] - holdings['持有成本(USD)']
+        holdings['報酬率(%)'] = holdings['損益(USD)'] / holdings['持有成本(USD)'].where(holdings['持有成本(USD)'] > 0) * 100
+
+    df_allocation = tables.get('df_allocation')
+    ladder = pd.DataFrame()
+    if df_allocation is not None and not df_allocation.empty:
+        planned = portfolio_core.planned_by_ticker(tables.get('df_plan'), df_allocation)
+        invested = portfolio_core.buy_cost(tables.get('df_stock'), '進攻型')
+        ladder = price_ladder.evaluate_ladder(df_allocation, quotes, planned, invested)
+
+    allocation = _records(summary['allocation'])
+    return {
+        '/api/snapshot': {'as_of': summary['as_of'], 'totals': summary['totals'], 'allocation': allocation,
+                          'holdings': _records(holdings), 'compliance': summary['compliance']},
+        '/api/holdings': {'as_of': summary['as_of'], 'holdings': _records(holdings)},
+        '/api/pnl': {'as_of': summary['as_of'], 'totals': summary['totals'],
+                     'items': [{k: row[k] for k in ['名稱', '類型', '實際買入(USD)', '市值(USD)', '損益(USD)', '報酬率(%)']}
+                               for row in allocation],
+                     'dividends': _records(summary['dividends'])},
+        '/api/alerts': {'as_of': summary['as_of'], 'ladder': _records(ladder),
+                        'recent': _records(alert_log.tail(RECENT_ALERTS))},
+    }
+
+
+class PortfolioCache:
+    """序列化後的回應快取；資料檔或報價改變時才重建"""
+
+    def __init__(self, folder_path, quote_interval=QUOTE_INTERVAL, fetch_quotes=market_data.fetch_quotes):
+        self.folder_path = folder_path
+        self.quote_interval = quote_interval
+        self.fetch_quotes = fetch_quotes
+        self.watcher = portfolio_core.FolderWatcher(folder_path, interval=1.0, filenames=WATCHED_FILES).start()
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._signatures = None
+        self._tables = {}
+        self._quotes = {}
+        self._responses = {}
+        self.updated_at = None
+        self.rebuilds = 0
+        self.last_error = None
+        self._retry_at = 0.0
+        self.reload(fetch=True)
+        threading.Thread(target=self._quote_loop, name='QuoteRefresh', daemon=True).start()
+
+    def reload(self, fetch=False):
+        """重新讀取資料夾（必要時批次更新報價）並重建回應"""
+        signatures = portfolio_core.folder_signatures(self.folder_path, WATCHED_FILES)
+        tables, _ = portfolio_core.read_folder(self.folder_path)
+        quotes = self.fetch_quotes(overview.quote_tickers(tables)) if fetch else self._quotes
+        self._rebuild(tables, quotes, signatures)
+
+    def _rebuild(self, tables, quotes, signatures):
+        alert_log = price_ladder.load_alert_log(self.folder_path)
+        payloads = build_payloads(tables, quotes, alert_log)
+        updated_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        responses = {}
+        for path, payload in payloads.items():
+            payload['updated_at'] = updated_at
+            body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+            responses[path] = (body, '"' + hashlib.sha1(body).hexdigest()[:16] + '"')
+        with self._lock:
+            self._tables, self._quotes, self._signatures = tables, quotes, signatures
+            self._responses = responses
+            self.updated_at = updated_at
+            self.rebuilds += 1
+
+    def _quote_loop(self):
+        while True:
+            time.sleep(self.quote_interval)
+            try:
+                quotes = self.fetch_quotes(overview.quote_tickers(self._tables))
+            except Exception:
+                continue
+            if quotes and quotes != self._quotes:
+                self._rebuild(self._tables, {**self._quotes, **quotes}, self._signatures)
+
+    def get(self, path):
+        """取得回應 (內容, ETag)；資料檔有變時先重新載入，載入失敗時繼續提供上一份成功的內容"""
+        if self.watcher.changed_since(self._signatures) and time.monotonic() >= self._retry_at:
+            # 同時到達的請求只由一個執行緒重新載入
+            with self._reload_lock:
+                if self.watcher.changed_since(self._signatures) and time.monotonic() >= self._retry_at:
+                    try:
+                        self.reload()
+                        self.last_error = None
+                    except Exception as e:
+                        # 失敗後隔一段時間再重試，避免每個請求都重讀資料夾
+                        self.last_error = str(e)
+                        self._retry_at = time.monotonic() + RELOAD_RETRY
+        if path == '/api/health':
+            body = json.dumps({'folder': self.folder_path, 'updated_at': self.updated_at, 'rebuilds': self.rebuilds,
+                               'quotes': len(self._quotes), 'error': self.last_error}, ensure_ascii=False).encode('utf-8')
+            return body, '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+        return self._responses.get(path)
+
+
+def make_handler(cache):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # 標頭與內容分兩次寫出，關閉 Nagle 以免 keep-alive 連線每次多等一個延遲 ACK
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            response = cache.get(self.path.split('?', 1)[0].rstrip('/'))
+            if response is None:
+                self._send(404, json.dumps({'error': 'not found'}).encode('utf-8'))
+                return
+            body, etag = response
+            if etag in [t.strip() for t in self.headers.get('If-None-Match', '').split(',')]:
+                self._send(304, b'', etag)
+            else:
+                self._send(200, body, etag)
+
+        def _send(self, status, body, etag=None):
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', 'no-cache')
+            if etag:
+                self.send_header('ETag', etag)
+            self.end_headers()
+            if body:
+                self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(folder_path, port=DEFAULT_PORT, quote_interval=QUOTE_INTERVAL, host='127.0.0.1'):
+    cache = PortfolioCache(folder_path, quote_interval)
+    server = ThreadingHTTPServer((host, port), make_handler(cache))
+    server.daemon_threads = True
+    return server, cache
+
+
+def benchmark(port, n_requests=2000, path='/api/snapshot'):
+    """以單一 keep-alive 連線連續請求，回傳 (每秒請求數, 304 比例)"""
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    etag = None
+    not_modified = 0
+    start = time.perf_counter()
+    for i in range(n_requests):
+        headers = {'If-None-Match': etag} if etag and i % 2 else {}
+        conn.request('GET', path, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        etag = response.getheader('ETag') or etag
+        not_modified += response.status == 304
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return n_requests / elapsed, not_modified / n_requests
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='投資組合本地 API')
+    parser.add_argument('folder', nargs='?', default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--quote-interval', type=int, default=QUOTE_INTERVAL)
+    parser.add_argument('--bench', type=int, default=0, help='啟動後自我測試的請求數')
+    args = parser.parse_args()
+
+    server, cache = serve(args.folder, args.port, args.quote_interval)
+    if args.bench:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        rps, ratio = benchmark(args.port, args.bench)
+        print(f"{args.bench} 次請求: {rps:,.0f} req/s（304 比例 {ratio:.0%}）")
+        server.shutdown()
+    else:
+        print(f"API 服務中: http://127.0.0.1:{args.port}/api/snapshot （資料夾 {args.folder}）")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.shutdown()
@@ -0,0 +1,245 @@
+"""Plotly 圖表建構：總覽頁的資金分配長條圖與恐懼貪婪儀表板（網頁與報表共用）"""
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+# 時間序列最多畫的點數，超過時降採樣
+MAX_POINTS = 1500
+
+GAUGE_STEPS = [
+    {'range': [0, 25], 'color': '#e74c3c'},    # 極度恐懼 - 紅色
+    {'range': [25, 45], 'color': '#e67e22'},   # 恐懼 - 橘色
+    {'range': [45, 55], 'color': '#f1c40f'},   # 中性 - 黃色
+    {'range': [55, 75], 'color': '#2ecc71'},   # 貪婪 - 綠色
+    {'range': [75, 100], 'color': '#27ae60'}   # 極度貪婪 - 深綠
+]
+
+
+def fear_greed_gauge(value, description='', last_update=''):
+    fig = go.Figure(go.Indicator(
+        mode="gauge+number",
+        value=value,
+        title={'text': f"恐懼貪婪指數<br><span style='font-size:14px;color:gray'>{description}</span>"},
+        gauge={
+            'axis': {'range': [0, 100], 'tickwidth': 1, 'tickmode': 'array',
+                     'tickvals': [0, 25, 50, 75, 100], 'ticktext': ['0', '25', '50', '75', '100']},
+            'bar': {'color': "darkblue"},
+            'bgcolor': "white",
+            'steps': GAUGE_STEPS,
+            'threshold': {'line': {'color': "black", 'width': 4}, 'thickness': 0.75, 'value': value}
+        }
+    ))
+    fig.update_layout(
+        height=300,
+        margin=dict(l=30, r=30, t=60, b=30),
+        annotations=[dict(text=f"更新: {last_update}", x=0.5, y=-0.1, showarrow=False,
+                          font=dict(size=10, color='gray'))] if last_update else []
+    )
+    return fig
+
+
+def _money_labels(values):
+    return np.where(values > 0, pd.Series(values).map('${:,.0f}'.format).to_numpy(), '')
+
+
+def _margin_hover(names, margin, margin_details):
+    """保證金長條的 hover 文字：有明細的代碼列出各標的，一次組好"""
+    lines = {code: '<br>'.join(f"{t}: ${v:,.0f}" for t, v in items)
+             for code, items in (margin_details or {}).items() if items}
+    detail = pd.Series(names).map(lines)
+    total = pd.Series(margin).map('${:,.0f}'.format)
+    hover = np.where(detail.notna(), '<b>選擇權保證金</b><br>' + detail.fillna('') + '<br><b>合計: ' + total + '</b>',
+                     '<b>選擇權保證金</b><br>' + total)
+    return np.where(margin > 0, hover, '')
+
+
+def margin_price_marks(allocation, df_allocation):
+    """進攻型預計投入長條上的安全邊際價格標記（名稱, 高度, 價格），以表格運算一次算完"""
+    if df_allocation is None or df_allocation.empty:
+        return pd.DataFrame(columns=['名稱', '高度', '價格'])
+    alloc = df_allocation.assign(名稱=df_allocation['股票代碼'].astype(str).str.upper()).drop_duplicates('名稱')
+    planned = allocation.loc[allocation['類型'] == '進攻型', ['名稱', '預計投入(USD)']]
+    merged = planned.merge(alloc, on='名稱')
+    levels = []
+    for j in range(1, 6):
+        if f'邊際{j}(%)' not in merged.columns or f'邊際{j}比重(%)' not in merged.columns:
+            continue
+        levels.append(pd.DataFrame({'名稱': merged['名稱'], '層': j,
+                                    '預計': merged['預計投入(USD)'],
+                                    '公允值': pd.to_numeric(merged['公允值(USD)'], errors='coerce').fillna(0),
+                                    '邊際': pd.to_numeric(merged[f'邊際{j}(%)'], errors='coerce').fillna(0),
+                                    '比重': pd.to_numeric(merged[f'邊際{j}比重(%)'], errors='coerce').fillna(0)}))
+    if not levels:
+        return pd.DataFrame(columns=['名稱', '高度', '價格'])
+    marks = pd.concat(levels, ignore_index=True).sort_values(['名稱', '層'], kind='stable')
+    marks = marks[(marks['公允值'] > 0) & (marks['預計'] > 0) & (marks['邊際'] > 0) & (marks['比重'] > 0)]
+    marks['高度'] = marks['預計'] * marks.groupby('名稱')['比重'].cumsum() / 100
+    marks['價格'] = marks['公允值'] * marks['邊際'] / 100
+    return marks[['名稱', '高度', '價格']]
+
+
+def allocation_figure(allocation, df_allocation=None, margin_details=None):
+    """預計投入 vs 實際買入（含保證金堆疊）vs 目前市值
+
+    allocation: overview.allocation_rows 的結果；margin_details: {代碼: [(標的, 保證金), ...]}
+    數值型 hover 交給 hovertemplate 在瀏覽器端格式化，Python 端只組保證金明細
+    """
+    names = allocation['名稱'].astype(str).to_numpy()
+    planned = allocation['預計投入(USD)'].to_numpy(dtype=float)
+    actual = allocation['實際買入(USD)'].to_numpy(dtype=float)
+    margin = allocation['保證金(USD)'].to_numpy(dtype=float)
+    market = allocation['市值(USD)'].to_numpy(dtype=float)
+    cost_price = allocation['成本價'].to_numpy(dtype=float)
+    spot = np.nan_to_num(allocation['現價'].to_numpy(dtype=float))
+
+    planned_template = '<b>%{x}</b><br>預計投入: $%{y:,.0f}<br>剩餘金額: $%{customdata:,.0f}<extra></extra>'
+    actual_template = np.where(actual > 0, '<b>%{x}</b><br>成本價: $%{customdata:,.2f}<br>總成本: $%{y:,.0f}<extra></extra>',
+                               '<b>%{x}</b><br>尚未買入<extra></extra>')
+    market_template = np.where(market > 0, '<b>%{x}</b><br>現在股價: $%{customdata:,.2f}<br>目前市值: $%{y:,.0f}<extra></extra>',
+                               '<b>%{x}</b><br>無持股<extra></extra>')
+
+    fig = go.Figure()
+    fig.add_trace(go.Bar(name='預計投入', x=names, y=planned, marker_color='#64748b', text=_money_labels(planned),
+                         textposition='outside', textangle=-45, hovertemplate=planned_template,
+                         customdata=planned - actual - margin, offsetgroup='planned'))
+    fig.add_trace(go.Bar(name='實際買入', x=names, y=actual, marker_color='#3b82f6', text=_money_labels(actual),
+                         textposition='inside', textangle=0, hovertemplate=actual_template,
+                         customdata=cost_price, offsetgroup='actual'))
+    fig.add_trace(go.Bar(name='選擇權保證金', x=names, y=margin, marker_color='#f59e0b', text=_money_labels(margin),
+                         textposition='outside', textangle=-45, hovertemplate='%{customdata}<extra></extra>',
+                         customdata=_margin_hover(names, margin, margin_details), offsetgroup='actual', base=actual))
+    fig.add_trace(go.Bar(name='目前市值', x=names, y=market, marker_color='#22c55e', text=_money_labels(market),
+                         textposition='outside', textangle=-45, hovertemplate=market_template,
+                         customdata=spot, offsetgroup='market'))
+
+    # 進攻型股票的預計投入長條上標出安全邊際價格（一次設定全部標記）
+    marks = margin_price_marks(allocation, df_allocation)
+    annotations = [dict(x=name, y=height, text=f'${price:.0f}', showarrow=False,
+                        font=dict(size=10, color='#ff6a00', family='Arial Black'),
+                        bgcolor='rgba(255,255,255,0.8)', xshift=-40)
+                   for name, height, price in zip(marks['名稱'], marks['高度'], marks['價格'])]
+
+    # Y 軸上方保留空間顯示數字
+    max_value = max(np.max(planned, initial=0), np.max(actual + margin, initial=0), np.max(market, initial=0))
+    fig.update_layout(
+        title='預計投入 vs 實際買入 vs 目前市值',
+        xaxis_title='投資類型/股票',
+        yaxis_title='金額 (USD)',
+        barmode='group',
+        xaxis_tickangle=-45,
+        legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=1),
+        height=500,
+        margin=dict(t=80, b=80),
+        yaxis=dict(range=[0, max_value * 1.25]),
+        annotations=annotations
+    )
+    fig.update_yaxes(gridcolor='rgba(0,0,0,0.1)')
+    return fig
+
+
+def lttb(x, y, n_out):
+    """Largest-Triangle-Three-Buckets 降採樣，回傳保留點的索引（保留首尾與每桶最突出的點）"""
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # 中間 n-2 點分成 n_out-2 桶，每桶至少一點
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    edges = np.append(edges, n)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        avg_x = x[end:edges[i + 2]].mean()
+        avg_y = y[end:edges[i + 2]].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
+def downsample(series, max_points=MAX_POINTS):
+    """時間序列超過 max_points 點時以 LTTB 降採樣（x 為日期或數值索引）"""
+    series = series.dropna()
+    if len(series) <= max_points:
+        return series
+    index = series.index
+    x = index.asi8 if isinstance(index, pd.DatetimeIndex) else np.arange(len(series))
+    return series.iloc[lttb(x, series.to_numpy(dtype=float), max_points)]
+
+
+def rolling_figure(stats, window):
+    """滾動報酬 / 波動 / 回撤（長時間序列自動降採樣）"""
+    fig = go.Figure()
+    for key, name, line, extra in [('rolling_volatility', f'{window}日年化波動(%)', dict(color='#f59e0b'), {}),
+                                   ('rolling_return', f'{window}日報酬(%)', dict(color='#3b82f6'), {}),
+                                   ('drawdown', '回撤(%)', dict(color='#ef4444', width=1), {'fill': 'tozeroy'})]:
+        series = downsample(stats[key] * 100)
+        fig.add_trace(go.Scatter(x=series.index, y=series.values, name=name, line=line, **extra))
+    fig.update_layout(title='滾動報酬 / 波動 / 回撤', yaxis_title='%', height=400,
+                      legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=1))
+    return fig
+
+
+def fear_greed_history_figure(history, nav=None, contributions=None):
+    """恐懼貪婪指數歷史 vs 組合市值，並在指數線上標出每次買進的時點與金額
+
+    history: sentiment.load_history 的結果；nav: 每日市值 Series；contributions: 每日買進金額 Series
+    """
+    fig = make_subplots(specs=[[{'secondary_y': True}]])
+    for step in GAUGE_STEPS:
+        fig.add_hrect(y0=step['range'][0], y1=step['range'][1], fillcolor=step['color'], opacity=0.08,
+                      line_width=0, secondary_y=False)
+    index = history.set_index('日期')['指數'] if not history.empty else pd.Series(dtype=float)
+    shown = downsample(index)
+    fig.add_trace(go.Scatter(x=shown.index, y=shown.values, name='恐懼貪婪指數', line=dict(color='#334155', width=1.5),
+                             hovertemplate='%{x|%Y-%m-%d}<br>指數: %{y:.0f}<extra></extra>'), secondary_y=False)
+
+    if nav is not None and not nav.empty:
+        nav = downsample(nav)
+        fig.add_trace(go.Scatter(x=nav.index, y=nav.values, name='組合市值', line=dict(color='#22c55e', width=2),
+                                 hovertemplate='%{x|%Y-%m-%d}<br>市值: $%{y:,.0f}<extra></extra>'), secondary_y=True)
+
+    if contributions is not None and not contributions.empty and not index.empty:
+        # 買進日當天（或之前最近一天）的指數
+        at = index.dropna().sort_index().reindex(index.index.union(contributions.index)).ffill().reindex(contributions.index)
+        size = 8 + 22 * np.sqrt(contributions.to_numpy(dtype=float) / contributions.max())
+        fig.add_trace(go.Scatter(x=contributions.index, y=at.values, mode='markers', name='買進',
+                                 marker=dict(size=size, color='#3b82f6', opacity=0.7, line=dict(color='white', width=1)),
+                                 customdata=contributions.values,
+                                 hovertemplate='%{x|%Y-%m-%d}<br>買進: $%{customdata:,.0f}<br>指數: %{y:.0f}<extra></extra>'),
+                      secondary_y=False)
+
+    fig.update_layout(title='恐懼貪婪指數 vs 組合市值與投入時點', height=420, hovermode='x unified',
+                      legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=1))
+    fig.update_yaxes(title_text='指數', range=[0, 100], secondary_y=False)
+    fig.update_yaxes(title_text='市值 (USD)', showgrid=False, secondary_y=True)
+    return fig
+
+
+def contribution_timeline_figure(timeline, title='計畫 vs 實際投入'):
+    """每月買進/賣出長條、累計計畫與累計淨投入折線、當月被壓住的保證金（rollups.timeline 的結果）"""
+    months = timeline['月份']
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=months, y=timeline['買進(USD)'], name='當月買進', marker_color='#93c5fd',
+                         hovertemplate='%{x}<br>買進: $%{y:,.0f}<extra></extra>'))
+    fig.add_trace(go.Bar(x=months, y=-timeline['賣出(USD)'], name='當月賣出', marker_color='#fca5a5',
+                         customdata=timeline['賣出(USD)'], hovertemplate='%{x}<br>賣出: $%{customdata:,.0f}<extra></extra>'))
+    fig.add_trace(go.Scatter(x=months, y=timeline['累計計畫(USD)'], name='累計計畫', mode='lines',
+                             line=dict(color='#64748b', dash='dash', shape='hv'),
+                             hovertemplate='%{x}<br>累計計畫: $%{y:,.0f}<extra></extra>'))
+    fig.add_trace(go.Scatter(x=months, y=timeline['累計淨投入(USD)'], name='累計淨投入', mode='lines',
+                             line=dict(color='#3b82f6', width=2, shape='hv'),
+                             hovertemplate='%{x}<br>累計淨投入: $%{y:,.0f}<extra></extra>'))
+    if timeline['保證金(USD)'].any():
+        fig.add_trace(go.Scatter(x=months, y=timeline['保證金(USD)'], name='被壓住保證金', mode='lines',
+                                 line=dict(color='#f59e0b', width=1, shape='hv'), fill='tozeroy',
+                                 fillcolor='rgba(245,158,11,0.15)',
+                                 hovertemplate='%{x}<br>保證金: $%{y:,.0f}<extra></extra>'))
+    fig.update_layout(title=title, barmode='relative', height=420, yaxis_title='金額 (USD)', hovermode='x unified',
+                      legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=1))
+    fig.update_yaxes(gridcolor='rgba(0,0,0,0.1)')
+    return fig
@@ -0,0 +1,135 @@
+"""公司行動：股票分割與現金股利表，向量化調整交易帳本的股數、成本與股利收入"""
+import pandas as pd
+
+import market_data
+
+ACTION_COLUMNS = ['日期', '股票代碼', '類型', '分割比例', '每股股利(USD)', '來源']
+SPLIT = '分割'
+DIVIDEND = '現金股利'
+
+
+def empty_actions():
+    return pd.DataFrame({
+        '日期': pd.Series(dtype=str), '股票代碼': pd.Series(dtype=str), '類型': pd.Series(dtype=str),
+        '分割比例': pd.Series(dtype=float), '每股股利(USD)': pd.Series(dtype=float), '來源': pd.Series(dtype=str)
+    })
+
+
+def fetch_actions(tickers, start=None):
+    """資料來源替代：由 yfinance 取得分割與股利（無法使用時回傳空表）"""
+    if not market_data.YFINANCE_AVAILABLE:
+        return empty_actions()
+    rows = []
+    for ticker in sorted({str(t).upper() for t in tickers if isinstance(t, str) and t.strip()}):
+        if ticker in market_data.CRYPTO_MAP:
+            continue
+        try:
+            actions = market_data.yfinance().Ticker(market_data.to_yf_symbol(ticker)).actions
+        except Exception:
+            continue
+        if actions is None or actions.empty:
+            continue
+        actions = actions.copy()
+        actions.index = pd.to_datetime(actions.index).tz_localize(None).normalize()
+        if start is not None:
+            actions = actions[actions.index >= pd.Timestamp(start)]
+        for date, row in actions.iterrows():
+            if row.get('Stock Splits', 0):
+                rows.append([date.strftime('%Y-%m-%d'), ticker, SPLIT, float(row['Stock Splits']), 0.0, 'yfinance'])
+            if row.get('Dividends', 0):
+                rows.append([date.strftime('%Y-%m-%d'), ticker, DIVIDEND, 1.0, float(row['Dividends']), 'yfinance'])
+    return pd.DataFrame(rows, columns=ACTION_COLUMNS)
+
+
+def merge_actions(current, fetched):
+    """合併新取得的資料：手動輸入的記錄優先保留"""
+    if current is None or current.empty:
+        return fetched.reset_index(drop=True)
+    if fetched is None or fetched.empty:
+        return current
+    combined = pd.concat([current, fetched], ignore_index=True)
+    combined['_手動'] = combined['來源'].fillna('') != 'yfinance'
+    combined = combined.sort_values('_手動').drop_duplicates(subset=['日期', '股票代碼', '類型'], keep='last')
+    return combined.drop(columns='_手動').sort_values(['股票代碼', '日期']).reset_index(drop=True)
+
+
+def _normalized(actions, kind):
+    if actions is None or actions.empty:
+        return pd.DataFrame(columns=['日期', '股票代碼', '分割比例', '每股股利(USD)'])
+    selected = actions[actions['類型'] == kind].copy()
+    selected['日期'] = pd.to_datetime(selected['日期'], errors='coerce')
+    selected['股票代碼'] = selected['股票代碼'].astype(str).str.upper()
+    selected['分割比例'] = pd.to_numeric(selected['分割比例'], errors='coerce').fillna(1.0)
+    selected['每股股利(USD)'] = pd.to_numeric(selected['每股股利(USD)'], errors='coerce').fillna(0.0)
+    return selected.dropna(subset=['日期'])
+
+
+def split_factors(df_stock, actions):
+    """每筆交易之後所有分割的累積倍數（同代碼，分割日晚於交易日）"""
+    factors = pd.Series(1.0, index=df_stock.index)
+    splits = _normalized(actions, SPLIT)
+    splits = splits[splits['分割比例'] > 0]
+    if df_stock.empty or splits.empty:
+        return factors
+
+    # 由後往前累乘：某次分割之後（含）的總倍數
+    splits = splits.sort_values(['股票代碼', '日期'])
+    splits['累積倍數'] = splits.iloc[::-1].groupby('股票代碼')['分割比例'].cumprod().iloc[::-1]
+
+    trades = pd.DataFrame({
+        '_row': df_stock.index,
+        '日期': pd.to_datetime(df_stock['交易日期'], errors='coerce'),
+        '股票代碼': df_stock['股票代碼'].astype(str).str.upper(),
+    }).dropna(subset=['日期']).sort_values('日期')
+    matched = pd.merge_asof(trades, splits[['日期', '股票代碼', '累積倍數']].sort_values('日期'),
+                            on='日期', by='股票代碼', direction='forward', allow_exact_matches=False)
+    factors.loc[matched['_row'].to_numpy()] = matched['累積倍數'].fillna(1.0).to_numpy()
+    return factors
+
+
+def apply_splits(df_stock, actions):
+    """回傳依分割調整後的帳本：股數 × 倍數、價格 ÷ 倍數，交易金額不變"""
+    if df_stock is None or df_stock.empty:
+        return df_stock
+    adjusted = df_stock.copy()
+    factor = split_factors(df_stock, actions)
+    adjusted['分割倍數'] = factor
+    adjusted['股數'] = pd.to_numeric(adjusted['股數'], errors='coerce') * factor
+    adjusted['成交價格(USD)'] = pd.to_numeric(adjusted['成交價格(USD)'], errors='coerce') / factor
+    return adjusted
+
+
+def dividend_events(adjusted_stock, actions):
+    """每次除息日各 分類 × 代碼 的持股與股利現金流（持股以除息日前一天為準）"""
+    columns = ['日期', '所屬分類', '股票代碼', '持有股數', '每股股利(USD)', '股利收入(USD)']
+    dividends = _normalized(actions, DIVIDEND)
+    if adjusted_stock is None or adjusted_stock.empty or dividends.empty:
+        return pd.DataFrame(columns=columns)
+
+    ledger = adjusted_stock.copy()
+    ledger['日期'] = pd.to_datetime(ledger['交易日期'], errors='coerce')
+    ledger['股票代碼'] = ledger['股票代碼'].astype(str).str.upper()
+    shares = pd.to_numeric(ledger['股數'], errors='coerce').fillna(0).abs()
+    ledger['變動'] = shares.where(ledger['交易類型'] == '買進', -shares)
+    ledger = ledger.dropna(subset=['日期']).sort_values('日期')
+    ledger['持有股數'] = ledger.groupby(['所屬分類', '股票代碼'])['變動'].cumsum()
+
+    # 每個股利事件對應到持有該代碼的每個分類
+    pairs = ledger[['所屬分類', '股票代碼']].drop_duplicates()
+    events = dividends.merge(pairs, on='股票代碼').sort_values('日期')
+    if events.empty:
+        return pd.DataFrame(columns=columns)
+    events = pd.merge_asof(events, ledger[['日期', '所屬分類', '股票代碼', '持有股數']],
+                           on='日期', by=['所屬分類', '股票代碼'], direction='backward', allow_exact_matches=False)
+    events['持有股數'] = events['持有股數'].fillna(0).clip(lower=0)
+    events['股利收入(USD)'] = events['持有股數'] * events['每股股利(USD)']
+    events = events[events['股利收入(USD)'] > 0]
+    return events[columns].reset_index(drop=True)
+
+
+def dividend_income(adjusted_stock, actions, category=None):
+    """各代碼累計股利收入"""
+    events = dividend_events(adjusted_stock, actions)
+    if category:
+        events = events[events['所屬分類'] == category]
+    return events.groupby('股票代碼')['股利收入(USD)'].sum()
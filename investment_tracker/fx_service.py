@@ -0,0 +1,237 @@
+"""匯率服務：批次下載多幣別匯率、本地快取每日匯率歷史、依交易日向量化換算"""
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import market_data
+import portfolio_core
+
+YFINANCE_AVAILABLE = market_data.YFINANCE_AVAILABLE
+
+FX_HISTORY_FILE = 'fx_history.csv'
+BASE_CURRENCY = 'TWD'
+USD_RATE = 31.5
+# 無法取得匯率時的預設值（對 TWD）
+DEFAULT_RATES = {'USD': USD_RATE, 'TWD': 1.0}
+
+
+def fx_symbol(from_currency, to_currency=BASE_CURRENCY):
+    """Yahoo Finance 匯率代碼，例如 USDTWD=X"""
+    return f"{from_currency.upper()}{to_currency.upper()}=X"
+
+
+def load_fx_history(folder_path):
+    """讀取本地匯率歷史（欄位: 日期, 幣別, 匯率，皆為對 TWD）"""
+    file_path = os.path.join(folder_path, FX_HISTORY_FILE) if folder_path else None
+    if file_path and os.path.exists(file_path):
+        try:
+            history = pd.read_csv(file_path, encoding='utf-8-sig')
+            history['日期'] = pd.to_datetime(history['日期'])
+            return history
+        except Exception:
+            pass
+    return pd.DataFrame({'日期': pd.Series(dtype='datetime64[ns]'),
+                         '幣別': pd.Series(dtype=str),
+                         '匯率': pd.Series(dtype=float)})
+
+
+def save_fx_history(folder_path, history):
+    """寫回本地匯率歷史；資料夾不可寫入時（雲端模式）直接略過"""
+    if not folder_path or not os.path.isdir(folder_path):
+        return False
+    try:
+        out = history.copy()
+        out['日期'] = out['日期'].dt.strftime('%Y-%m-%d')
+        portfolio_core.atomic_write_csv(out, os.path.join(folder_path, FX_HISTORY_FILE), index=False)
+        return True
+    except Exception:
+        return False
+
+
+def fetch_fx_history(currencies, start, end=None):
+    """一次批次請求所有幣別對 TWD 的每日收盤匯率"""
+    currencies = [c.upper() for c in currencies if c and c.upper() != BASE_CURRENCY]
+    if not YFINANCE_AVAILABLE or not currencies:
+        return load_fx_history(None)
+
+    symbols = {fx_symbol(c): c for c in currencies}
+    end = end or (datetime.now() + timedelta(days=1)).date()
+    try:
+        data = market_data.yfinance().download(list(symbols), start=pd.Timestamp(start).strftime('%Y-%m-%d'),
+                           end=pd.Timestamp(end).strftime('%Y-%m-%d'),
+                           progress=False, auto_adjust=False, threads=True)
+    except Exception:
+        return load_fx_history(None)
+    if data is None or data.empty:
+        return load_fx_history(None)
+
+    close = data['Close']
+    if isinstance(close, pd.Series):
+        close = close.to_frame(name=next(iter(symbols)))
+
+    history = close.rename(columns=symbols).rename_axis('日期').reset_index()
+    history = history.melt(id_vars='日期', var_name='幣別', value_name='匯率').dropna(subset=['匯率'])
+    history['日期'] = pd.to_datetime(history['日期']).dt.tz_localize(None).dt.normalize()
+    return history[['日期', '幣別', '匯率']]
+
+
+def update_fx_history(folder_path, currencies, start):
+    """補齊本地快取缺少的日期：所有過期的幣別合併成一次下載"""
+    history = load_fx_history(folder_path)
+    currencies = sorted({c.upper() for c in currencies if c and c.upper() != BASE_CURRENCY})
+    if not currencies:
+        return history
+
+    start = pd.Timestamp(start).normalize()
+    today = pd.Timestamp(datetime.now().date())
+    last_cached = history.groupby('幣別')['日期'].agg(['min', 'max'])
+
+    # 找出每個幣別需要補抓的起始日，取最早者一次下載
+    fetch_from = []
+    for cur in currencies:
+        if cur not in last_cached.index or last_cached.at[cur, 'min'] > start:
+            fetch_from.append(start)
+        elif last_cached.at[cur, 'max'] < today - pd.Timedelta(days=1):
+            fetch_from.append(last_cached.at[cur, 'max'] + pd.Timedelta(days=1))
+    if not fetch_from:
+        return history
+
+    fetched = fetch_fx_history(currencies, min(fetch_from))
+    if fetched.empty:
+        return history
+
+    history = pd.concat([history, fetched], ignore_index=True)
+    history = history.drop_duplicates(subset=['日期', '幣別'], keep='last').sort_values(['幣別', '日期'])
+    history = history.reset_index(drop=True)
+    save_fx_history(folder_path, history)
+    return history
+
+
+def rate_matrix(history):
+    """日期 × 幣別 的匯率矩陣（對 TWD），假日以前一交易日補齊"""
+    if history.empty:
+        return pd.DataFrame(columns=[BASE_CURRENCY], dtype=float)
+    matrix = history.pivot_table(index='日期', columns='幣別', values='匯率', aggfunc='last')
+    full_index = pd.date_range(matrix.index.min(), max(matrix.index.max(), pd.Timestamp(datetime.now().date())))
+    matrix = matrix.reindex(full_index).ffill()
+    matrix[BASE_CURRENCY] = 1.0
+    return matrix
+
+
+def latest_rates(history):
+    """各幣別最新匯率（對 TWD）"""
+    rates = dict(DEFAULT_RATES)
+    if not history.empty:
+        latest = history.sort_values('日期').groupby('幣別')['匯率'].last()
+        rates.update(latest.to_dict())
+    return rates
+
+
+def cross_rate(rates, from_currency, to_currency):
+    """透過 TWD 計算任兩幣別的交叉匯率"""
+    src = rates.get(from_currency.upper())
+    dst = rates.get(to_currency.upper())
+    if not src or not dst:
+        return None
+    return src / dst
+
+
+def lookup_rates(matrix, dates, currencies, to_currency=BASE_CURRENCY, fallback=None):
+    """向量化查詢每列交易日的匯率（交易日無報價時取前一個可用日期）"""
+    dates = pd.to_datetime(pd.Series(dates)).dt.normalize().to_numpy()
+    currencies = pd.Series(currencies).fillna('USD').astype(str).str.upper().to_numpy()
+    n = len(dates)
+    rates = np.full(n, np.nan)
+
+    if not matrix.empty and n:
+        row_idx = matrix.index.get_indexer(dates, method='ffill')
+        # 交易日早於快取起點時改用最早一筆
+        row_idx = np.where((row_idx < 0) & ~pd.isna(dates), 0, row_idx)
+        col_idx = matrix.columns.get_indexer(currencies)
+        valid = (row_idx >= 0) & (col_idx >= 0)
+        values = matrix.to_numpy(dtype=float)
+        rates[valid] = values[row_idx[valid], col_idx[valid]]
+
+        if to_currency.upper() != BASE_CURRENCY:
+            to_idx = matrix.columns.get_loc(to_currency.upper()) if to_currency.upper() in matrix.columns else -1
+            if to_idx >= 0:
+                rates[valid] = rates[valid] / values[row_idx[valid], to_idx]
+            else:
+                rates[:] = np.nan
+
+    # 缺值依序以該列自帶匯率、預設匯率補上
+    if fallback is not None:
+        fallback = pd.to_numeric(pd.Series(fallback), errors='coerce').to_numpy()
+        rates = np.where(np.isnan(rates), fallback, rates)
+    if to_currency.upper() == BASE_CURRENCY:
+        defaults = np.array([DEFAULT_RATES.get(c, np.nan) for c in currencies]) if n else rates
+        rates = np.where(np.isnan(rates), defaults, rates)
+    return rates
+
+
+def convert_columns(df, date_col, amount_cols, history, currency_col='幣別', default_currency='USD',
+                    to_currency=BASE_CURRENCY, fallback_col=None, suffix=None):
+    """將整欄金額依各列交易日匯率換算，回傳新增換算欄位的複本"""
+    out = df.copy()
+    if out.empty:
+        return out
+    currencies = out[currency_col] if currency_col in out.columns else pd.Series(default_currency, index=out.index)
+    fallback = out[fallback_col] if fallback_col and fallback_col in out.columns else None
+    rates = lookup_rates(rate_matrix(history), out[date_col], currencies, to_currency, fallback)
+
+    suffix = suffix or f"({to_currency.upper()})"
+    out[f'交易日匯率{suffix}'] = rates
+    for col in amount_cols:
+        base = col.split('(')[0]
+        out[f'{base}{suffix}'] = pd.to_numeric(out[col], errors='coerce').fillna(0).to_numpy() * rates
+    return out
+
+
+def stock_cost_basis_twd(df_stock, history):
+    """以交易日匯率計算每檔持股的 TWD 成本、現值與匯差損益"""
+    columns = ['股票代碼', '持有股數', '總成本(USD)', '總成本(TWD)', '平均匯率', '現值匯率', '匯差損益(TWD)']
+    if df_stock.empty:
+        return pd.DataFrame(columns=columns)
+
+    ledger = df_stock.copy()
+    ledger['股數'] = pd.to_numeric(ledger['股數'], errors='coerce').fillna(0).abs()
+    price = pd.to_numeric(ledger['成交價格(USD)'], errors='coerce').fillna(0)
+    fee = pd.to_numeric(ledger['手續費(USD)'], errors='coerce').fillna(0).clip(lower=0)
+    is_buy = ledger['交易類型'] == '買進'
+    ledger['成本(USD)'] = np.where(is_buy, ledger['股數'] * price + fee, 0.0)
+    ledger['持股變動'] = np.where(is_buy, ledger['股數'], -ledger['股數'])
+    ledger['買入股數'] = np.where(is_buy, ledger['股數'], 0.0)
+    ledger = convert_columns(ledger, '交易日期', ['成本(USD)'], history, suffix='(TWD)')
+
+    summary = ledger.groupby('股票代碼').agg(
+        持有股數=('持股變動', 'sum'),
+        買入股數=('買入股數', 'sum'),
+        **{'總成本(USD)': ('成本(USD)', 'sum'), '總成本(TWD)': ('成本(TWD)', 'sum')}
+    ).reset_index()
+    summary = summary[summary['持有股數'] > 0]
+    if summary.empty:
+        return pd.DataFrame(columns=columns)
+
+    # 持有部位按比例攤提成本（賣出部分不計入）
+    held_ratio = (summary['持有股數'] / summary['買入股數'].replace(0, np.nan)).fillna(0).clip(upper=1)
+    summary['總成本(USD)'] = summary['總成本(USD)'] * held_ratio
+    summary['總成本(TWD)'] = summary['總成本(TWD)'] * held_ratio
+    summary['平均匯率'] = summary['總成本(TWD)'] / summary['總成本(USD)'].replace(0, np.nan)
+    summary['現值匯率'] = latest_rates(history).get('USD', USD_RATE)
+    summary['匯差損益(TWD)'] = summary['總成本(USD)'] * (summary['現值匯率'] - summary['平均匯率'])
+    return summary[columns]
+
+
+def plan_amount_twd(df_plan, history):
+    """投資計畫換算 TWD：優先使用每列填寫的匯率，空白時取該日市場匯率"""
+    if df_plan.empty:
+        return df_plan.copy()
+    plan = df_plan.copy()
+    market = lookup_rates(rate_matrix(history), plan['時間'], pd.Series('USD', index=plan.index))
+    own = pd.to_numeric(plan['匯率'], errors='coerce') if '匯率' in plan.columns else pd.Series(np.nan, index=plan.index)
+    own = own.where(own > 0)
+    plan['適用匯率'] = own.fillna(pd.Series(market, index=plan.index))
+    plan['預計投入(TWD)'] = pd.to_numeric(plan['預計投入(USD)'], errors='coerce').fillna(0) * plan['適用匯率']
+    return plan
@@ -1,62 +1,70 @@
+import time
+SCRIPT_STARTED = time.perf_counter()
+
 import streamlit as st
 import pandas as pd
-import plotly.graph_objects as go
+import numpy as np
 from datetime import datetime
 import os
 import io
 import zipfile
 
-# 嘗試導入 yfinance
-try:
-    import yfinance as yf
-    YFINANCE_AVAILABLE = True
-except ImportError:
-    YFINANCE_AVAILABLE = False
+# plotly、yfinance、fear_and_greed 匯入較慢：plotly 只在有圖表的頁面載入，行情套件在第一次連網時才載入
+import analytics
+import corporate_actions
+import fx_service
+import market_data
+import monte_carlo
+import multi_portfolio
+import option_analytics
+import option_expiry
+import overview
+import portfolio_core
+import price_ladder
+import rebalance
+import rollups
+import sentiment
+import snapshots
+import stress_test
+import tax_lots
 
-# 嘗試導入 fear_and_greed
-try:
-    import fear_and_greed
-    FEAR_GREED_AVAILABLE = True
-except ImportError:
-    FEAR_GREED_AVAILABLE = False
 
 
 st.set_page_config(page_title="投資理財追蹤系統", layout="wide")
 st.title("💰 投資理財資金分配追蹤系統 (USD)")
 
 # 檔案名稱對應
-FILE_MAPPING = {
-    'investment_plan.csv': 'df_plan',
-    'aggressive_allocation.csv': 'df_allocation',
-    'conservative_allocation.csv': 'df_conservative',
-    'lottery_allocation.csv': 'df_lottery',
-    'stock_transactions.csv': 'df_stock',
-    'options_transactions.csv': 'df_option'
+FILE_MAPPING = portfolio_core.FILE_MAPPING
+USD_RATE = fx_service.USD_RATE
+
+# 各表格的預設空表；只建立目前頁面用到的表格
+TABLE_DEFAULTS = {
+    'df_plan': lambda: pd.DataFrame(columns=['時間', '投資類型', '預計投入(USD)', '匯率']),
+    'df_allocation': lambda: pd.DataFrame(columns=['股票代碼', '比重', '公允值(USD)', '邊際1(%)', '邊際2(%)', '邊際3(%)', '邊際4(%)', '邊際5(%)', '邊際1比重(%)', '邊際2比重(%)', '邊際3比重(%)', '邊際4比重(%)', '邊際5比重(%)']),
+    'df_conservative': lambda: pd.DataFrame({
+        '股票代碼': ['VOO'],
+        '比重': [100.0],
+        '說明': ['S&P 500 ETF']
+    }),
+    'df_lottery': lambda: pd.DataFrame({
+        '股票代碼': ['BTC'],
+        '比重': [100.0],
+        '說明': ['比特幣']
+    }),
+    'df_stock': lambda: pd.DataFrame(columns=['交易日期', '交易類型', '所屬分類', '股票代碼', '股數', '成交價格(USD)', '手續費(USD)', '交易稅(USD)', '用途說明', '備註']),
+    'df_option': lambda: pd.DataFrame(columns=['交易日期', '商品類型', '標的', '履約價', '到期日', '買賣權', '買賣方向', '口數', '權利金', '交易金額(USD)', '手續費(USD)', '保證金(USD)', '總成本(USD)', '資金來源', '策略說明']),
+    'df_option_archive': lambda: pd.DataFrame(columns=portfolio_core.OPTION_ARCHIVE_COLUMNS),
+    'df_actions': corporate_actions.empty_actions,
 }
-USD_RATE = 31.5
 
-# 初始化 session_state
+def ensure_tables(*state_keys):
+    """建立尚未存在的表格（預設空表）"""
+    for state_key in state_keys:
+        if state_key not in st.session_state:
+            st.session_state[state_key] = TABLE_DEFAULTS[state_key]()
+
+# 初始化 session_state（表格改由各頁面需要時建立）
 def init_session_state():
-    if 'df_plan' not in st.session_state:
-        st.session_state.df_plan = pd.DataFrame(columns=['時間', '投資類型', '預計投入(USD)', '匯率'])
-    if 'df_allocation' not in st.session_state:
-        st.session_state.df_allocation = pd.DataFrame(columns=['股票代碼', '比重', '公允值(USD)', '邊際1(%)', '邊際2(%)', '邊際3(%)', '邊際4(%)', '邊際5(%)', '邊際1比重(%)', '邊際2比重(%)', '邊際3比重(%)', '邊際4比重(%)', '邊際5比重(%)'])
-    if 'df_conservative' not in st.session_state:
-        st.session_state.df_conservative = pd.DataFrame({
-            '股票代碼': ['VOO'],
-            '比重': [100.0],
-            '說明': ['S&P 500 ETF']
-        })
-    if 'df_lottery' not in st.session_state:
-        st.session_state.df_lottery = pd.DataFrame({
-            '股票代碼': ['BTC'],
-            '比重': [100.0],
-            '說明': ['比特幣']
-        })
-    if 'df_stock' not in st.session_state:
-        st.session_state.df_stock = pd.DataFrame(columns=['交易日期', '交易類型', '所屬分類', '股票代碼', '股數', '成交價格(USD)', '手續費(USD)', '交易稅(USD)', '用途說明', '備註'])
-    if 'df_option' not in st.session_state:
-        st.session_state.df_option = pd.DataFrame(columns=['交易日期', '商品類型', '標的', '履約價', '到期日', '買賣權', '買賣方向', '口數', '權利金', '交易金額(USD)', '手續費(USD)', '保證金(USD)', '總成本(USD)', '資金來源', '策略說明'])
     if 'data_folder' not in st.session_state:
         # 預設為程式所在的資料夾
         st.session_state.data_folder = os.path.dirname(os.path.abspath(__file__))
@@ -70,16 +78,13 @@ def load_from_folder(folder_path):
     if not os.path.isdir(folder_path):
         return False, "資料夾不存在"
 
-    loaded_files = []
-    for filename, state_key in FILE_MAPPING.items():
-        file_path = os.path.join(folder_path, filename)
-        if os.path.exists(file_path):
-            try:
-                df = pd.read_csv(file_path, encoding='utf-8-sig')
-                st.session_state[state_key] = df
-                loaded_files.append(filename)
-            except Exception as e:
-                pass
+    tables, loaded_files, versions = portfolio_core.load_folder(folder_path)
+    for state_key, df in tables.items():
+        st.session_state[state_key] = df
+    # 記錄載入時的檔案版本與內容，儲存時用來偵測其他工作階段的修改
+    st.session_state.file_versions = versions
+    st.session_state.file_signatures = portfolio_core.folder_signatures(folder_path)
+    st.session_state.base_tables = {k: df.copy() for k, df in tables.items()}
 
     if loaded_files:
         st.session_state.data_loaded = True
@@ -109,51 +114,131 @@ def load_from_uploaded_files(uploaded_files):
 
     if loaded_files:
         st.session_state.data_loaded = True
+        # 上傳的資料與資料夾無關，儲存時不做版本檢查
+        st.session_state.file_versions = None
+        st.session_state.base_tables = {}
         return True, f"已載入: {', '.join(loaded_files)}"
     return False, "找不到符合的 CSV 檔案"
 
 # 匯出所有資料為 ZIP
-def export_all_to_zip():
+# 依各表資料版本快取，資料沒變時不必每次重新執行都重新壓縮
+@st.cache_data(show_spinner=False, max_entries=4)
+def build_export_zip(versions, _tables):
     zip_buffer = io.BytesIO()
     with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
         for filename, state_key in FILE_MAPPING.items():
-            if state_key in st.session_state and not st.session_state[state_key].empty:
+            df = _tables.get(state_key)
+            if df is not None and not df.empty:
                 csv_buffer = io.StringIO()
-                st.session_state[state_key].to_csv(csv_buffer, index=False, encoding='utf-8-sig')
+                df.to_csv(csv_buffer, index=False, encoding='utf-8-sig')
                 zip_file.writestr(filename, csv_buffer.getvalue().encode('utf-8-sig'))
-    zip_buffer.seek(0)
-    return zip_buffer
+    return zip_buffer.getvalue()
+
+def export_all_to_zip():
+    tables = {state_key: st.session_state[state_key] for state_key in FILE_MAPPING.values() if state_key in st.session_state}
+    versions = tuple((key, portfolio_core.data_version(df)) for key, df in tables.items())
+    return build_export_zip(versions, tables)
 
 # 儲存到本地資料夾
 def save_to_folder(folder_path):
     if not os.path.isdir(folder_path):
         return False, "資料夾不存在"
 
-    saved_files = []
-    for filename, state_key in FILE_MAPPING.items():
-        if state_key in st.session_state and not st.session_state[state_key].empty:
-            file_path = os.path.join(folder_path, filename)
-            st.session_state[state_key].to_csv(file_path, index=False, encoding='utf-8-sig')
-            saved_files.append(filename)
-
+    tables = {state_key: st.session_state[state_key] for state_key in FILE_MAPPING.values()
+              if state_key in st.session_state}
+    # 已有封存紀錄時，選擇權表清空是正常狀態，需一併寫入
+    archive = st.session_state.get('df_option_archive')
+    allow_empty = ('df_option',) if archive is not None and not archive.empty else ()
+    try:
+        saved_files, merged_files, conflicts, versions = portfolio_core.save_folder(
+            folder_path, tables, st.session_state.get('base_tables'), st.session_state.get('file_versions'), allow_empty)
+    except TimeoutError as e:
+        return False, str(e)
+
+    # 只有實際寫入的檔案更新基準版本；衝突或被略過的檔案維持舊基準，下次儲存仍會被偵測
+    base_versions = dict(st.session_state.get('file_versions') or {})
+    base_tables = dict(st.session_state.get('base_tables') or {})
+    for filename in saved_files:
+        base_versions[filename] = versions[filename]
+        base_tables[FILE_MAPPING[filename]] = tables[FILE_MAPPING[filename]].copy()
+    if st.session_state.get('file_versions') is not None:
+        st.session_state.file_versions = base_versions
+        st.session_state.base_tables = base_tables
+    if merged_files:
+        # 合併後的內容以磁碟為準，只重新載入合併過的表，其他未儲存的編輯不受影響
+        fresh, _, fresh_versions = portfolio_core.load_folder(folder_path)
+        for filename in merged_files:
+            state_key = FILE_MAPPING[filename]
+            if state_key in fresh:
+                st.session_state[state_key] = fresh[state_key]
+                st.session_state.base_tables[state_key] = fresh[state_key].copy()
+                st.session_state.file_versions[filename] = fresh_versions[filename]
     if saved_files:
-        return True, f"已儲存: {', '.join(saved_files)}"
+        # 每次儲存建立版本快照，可於「版本記錄」比較、還原或復原
+        snapshots.create_snapshot(folder_path, message='儲存')
+    messages = []
+    if saved_files:
+        messages.append(f"已儲存: {', '.join(saved_files)}")
+    if merged_files:
+        messages.append(f"已與其他工作階段的修改合併: {', '.join(merged_files)}")
+    if conflicts:
+        messages.append(f"檔案已被其他工作階段修改，未儲存: {', '.join(conflicts)}（請重新載入後再編輯）")
+        return False, "；".join(messages)
+    if saved_files:
+        return True, "；".join(messages)
     return False, "沒有資料可儲存"
 
-# 取得恐懼貪婪指數
+# 偵測資料夾中被其他工作階段或排程修改的檔案
+def sync_folder_changes(folder_path):
+    """只重新載入有變更的表格；本頁已編輯但尚未儲存的表格保留，儲存時再合併或提示衝突
+
+    快取皆以表格內容版本為鍵，因此只有依賴變更表格的快取會重新計算
+    """
+    versions = st.session_state.get('file_versions')
+    if versions is None or not os.path.isdir(folder_path):
+        return [], []
+    changed, _, new_versions, signatures = portfolio_core.reload_changed(
+        folder_path, versions, st.session_state.get('file_signatures'))
+    st.session_state.file_signatures = signatures
+
+    file_of = {state_key: filename for filename, state_key in FILE_MAPPING.items()}
+    reloaded, kept = [], []
+    for state_key, df in changed.items():
+        filename = file_of[state_key]
+        base = st.session_state.base_tables.get(state_key)
+        if base is not None and portfolio_core.data_version(base) != portfolio_core.data_version(st.session_state.get(state_key)):
+            kept.append(filename)
+            continue
+        st.session_state[state_key] = df
+        st.session_state.base_tables[state_key] = df.copy()
+        st.session_state.file_versions[filename] = new_versions[filename]
+        reloaded.append(filename)
+    return reloaded, kept
+
+def store_page_table(state_key, edited, unedited):
+    """頁面表格寫回 session_state；本次未編輯且尚無未儲存修改時，基準表也換成頁面整理後的內容
+
+    頁面會整理型別（日期轉字串、空值補值、股數轉浮點數），若只比對原始基準，
+    瀏覽頁面就會被 sync_folder_changes 視為未儲存的編輯而不再自動重新載入
+    """
+    base_tables = st.session_state.get('base_tables')
+    if unedited and base_tables is not None and state_key in base_tables and \
+            portfolio_core.data_version(base_tables[state_key]) == portfolio_core.data_version(st.session_state.get(state_key)):
+        base_tables[state_key] = edited.copy()
+    st.session_state[state_key] = edited
+
+@st.cache_resource
+def get_folder_watcher(folder_path):
+    return portfolio_core.FolderWatcher(folder_path).start()
+
+# 恐懼貪婪指數：背景執行緒定期更新本地歷史，頁面只讀記憶體中的最新值
+@st.cache_resource
+def get_fear_greed_updater(folder_path):
+    return sentiment.FearGreedUpdater(folder_path).start()
+
 def get_fear_greed_index():
-    """取得 CNN 恐懼貪婪指數"""
-    if not FEAR_GREED_AVAILABLE:
-        return None
-    try:
-        fgi = fear_and_greed.get()
-        return {
-            'value': fgi.value,
-            'description': fgi.description,
-            'last_update': fgi.last_update.strftime('%Y-%m-%d %H:%M') if fgi.last_update else ''
-        }
-    except:
-        return None
+    """取得 CNN 恐懼貪婪指數（不等待網路；尚未取得時為 None）"""
+    return get_fear_greed_updater(st.session_state.data_folder).latest()
 
 # 計算實際投入金額（僅股票成本，不含保證金）
 def calculate_actual_investment(df_stock, category, stock_code=None):
@@ -205,242 +290,137 @@ def calculate_sell_proceeds(df_stock, category=None, stock_code=None):
 
     return total
 
-# 計算選擇權被壓住的保證金（資金來源對應到特定股票的未到期賣方部位）
-def calculate_option_margin(df_option, stock_code, return_details=False):
-    if df_option is None or df_option.empty:
-        return (0, []) if return_details else 0
-    if '保證金(USD)' not in df_option.columns or '資金來源' not in df_option.columns:
-        return (0, []) if return_details else 0
-
-    df_opt_calc = df_option.copy()
-    df_opt_calc['到期日'] = pd.to_datetime(df_opt_calc['到期日'])
-    df_opt_calc['資金來源'] = df_opt_calc['資金來源'].fillna('').astype(str)
-    today = pd.Timestamp(datetime.now().date())
-    # 篩選: 資金來源為此股票、未到期、賣方部位
-    active_margin = df_opt_calc[
-        (df_opt_calc['資金來源'].str.upper() == stock_code.upper()) &
-        (df_opt_calc['到期日'] >= today) &
-        (df_opt_calc['買賣方向'] == '賣出')
-    ]
-    if not active_margin.empty:
-        total = active_margin['保證金(USD)'].sum()
-        if return_details:
-            # 取得標的股票清單和對應保證金
-            details = []
-            if '標的' in active_margin.columns:
-                for _, row in active_margin.iterrows():
-                    details.append({
-                        'ticker': row['標的'],
-                        'margin': row['保證金(USD)']
-                    })
-            return (total, details)
-        return total
-    return (0, []) if return_details else 0
-
-# 取得股票現價
+# 批次取得多檔現價
 @st.cache_data(ttl=300)  # 快取5分鐘
-def get_current_price(ticker):
-    """使用 yfinance 取得股票/加密貨幣現價"""
-    if not YFINANCE_AVAILABLE:
-        return None
-    try:
-        # 加密貨幣代碼轉換 (BTC -> BTC-USD)
-        crypto_map = {'BTC': 'BTC-USD', 'ETH': 'ETH-USD', 'SOL': 'SOL-USD',
-                      'XRP': 'XRP-USD', 'ADA': 'ADA-USD', 'DOGE': 'DOGE-USD'}
-        yf_ticker = crypto_map.get(ticker.upper(), ticker)
-
-        stock = yf.Ticker(yf_ticker)
-
-        # 方法1: 使用 fast_info (較不容易被限速)
-        try:
-            price = stock.fast_info.get('lastPrice') or stock.fast_info.get('previousClose')
-            if price:
-                return float(price)
-        except:
-            pass
-
-        # 方法2: 使用 history 取得最近收盤價
-        try:
-            hist = stock.history(period='1d')
-            if not hist.empty:
-                return float(hist['Close'].iloc[-1])
-        except:
-            pass
-
-        # 方法3: 使用 info (可能被限速)
-        try:
-            info = stock.info
-            price = info.get('currentPrice') or info.get('regularMarketPrice') or info.get('previousClose')
-            if price:
-                return float(price)
-        except:
-            pass
-
-        return None
-    except:
-        return None
-
-# 取得即時匯率
-@st.cache_data(ttl=300)  # 快取5分鐘
-def get_exchange_rate(from_currency="USD", to_currency="TWD"):
-    """使用 yfinance 取得匯率"""
-    if not YFINANCE_AVAILABLE:
-        return None
-    try:
-        ticker = yf.Ticker(f"{from_currency}{to_currency}=X")
-
-        # 方法1: 使用 fast_info
-        try:
-            rate = ticker.fast_info.get('lastPrice') or ticker.fast_info.get('previousClose')
-            if rate:
-                return float(rate)
-        except:
-            pass
-
-        # 方法2: 使用 history
-        try:
-            hist = ticker.history(period='1d')
-            if not hist.empty:
-                return float(hist['Close'].iloc[-1])
-        except:
-            pass
-
-        return None
-    except:
+def get_batch_quotes(tickers):
+    """一次請求取得多檔股票/加密貨幣現價"""
+    return market_data.fetch_quotes(tickers)
+
+# 多組合：依各資料夾的檔案簽章快取，檔案沒變就不重新讀取與計算
+@st.cache_data(show_spinner=False)
+def load_portfolios(folders, signatures):
+    return multi_portfolio.load_portfolios(list(folders), os.cpu_count())
+
+@st.cache_data(show_spinner=False)
+def summarize_portfolios(signatures, quotes, as_of, _portfolios):
+    return multi_portfolio.summarize_portfolios(_portfolios, quotes, as_of, os.cpu_count())
+
+# 取得每日收盤價歷史（本地快取，僅補抓缺少的日期）
+@st.cache_data(ttl=3600)  # 快取1小時
+def get_price_history(folder_path, tickers, start):
+    """批次更新並回傳本地收盤價歷史"""
+    return market_data.update_price_history(folder_path, tickers, start)
+
+# 執行蒙地卡羅模擬（相同參數不重算）
+@st.cache_data(show_spinner=False)
+def run_monte_carlo(start_values, contributions, returns, months, n_paths, workers):
+    totals = monte_carlo.simulate(start_values, contributions, returns, months, n_paths, seed=42, workers=workers)
+    summary, drawdowns, loss_prob = monte_carlo.summarize(totals, float(contributions.sum()) * months)
+    return monte_carlo.percentile_bands(totals), summary, drawdowns, loss_prob
+
+# 分割調整後的帳本與股利事件（依交易與公司行動的資料版本快取，所有檢視共用）
+@st.cache_data(show_spinner=False)
+def adjust_stock_ledger(stock_version, actions_version, _df_stock, _df_actions):
+    adjusted = corporate_actions.apply_splits(_df_stock, _df_actions)
+    return adjusted, corporate_actions.dividend_events(adjusted, _df_actions)
+
+def get_adjusted_stock():
+    """回傳 (分割調整後的股票帳本, 股利事件)"""
+    df_stock = st.session_state.df_stock
+    df_actions = st.session_state.df_actions
+    return adjust_stock_ledger(portfolio_core.data_version(df_stock), portfolio_core.data_version(df_actions),
+                               df_stock, df_actions)
+
+# 年度已實現損益（逐批配對），依帳本版本快取
+@st.cache_data(show_spinner=False, max_entries=8)
+def get_realized_lots(version, fx_version, year, method, _df_stock, _fx_history):
+    chunks = list(tax_lots.realized_lot_chunks(_df_stock, _fx_history, method, year))
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=tax_lots.COLUMNS)
+
+# 每月彙總：各來源表只有追加時只彙總新列，並存於資料夾的 .rollups/
+@st.cache_data(show_spinner=False, max_entries=4)
+def get_monthly_rollups(versions, folder_path, _tables):
+    monthly, _ = rollups.update_rollups(_tables, folder_path)
+    return monthly
+
+# 總覽資金分配與圖表（依各表資料版本、日期與報價快取，重新執行時不重算也不重建圖表）
+@st.cache_data(show_spinner=False, max_entries=8)
+def get_allocation_rows(versions, quotes, _tables):
+    return overview.allocation_rows(_tables, quotes)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def get_allocation_figure(versions, quotes, _allocation, _df_allocation, _df_option):
+    import charts
+    return charts.allocation_figure(_allocation, _df_allocation, overview.margin_details(_df_option)).to_dict()
+
+# 滾動分析（依交易資料版本與日期快取，切換頁面不重算）
+@st.cache_data(show_spinner=False)
+def get_rolling_analytics(version, as_of, folder_path, _df_stock, window):
+    tickers = set(_df_stock['股票代碼'].astype(str).str.upper()) | {analytics.BENCHMARK}
+    start = pd.to_datetime(_df_stock['交易日期'], errors='coerce').min()
+    if pd.isna(start):
         return None
+    prices = get_price_history(folder_path, tuple(sorted(tickers)), (start - pd.Timedelta(days=7)).strftime('%Y-%m-%d'))
+    return analytics.compute_analytics(prices, _df_stock, window)
 
-# 計算持股數量
-def calculate_holdings(df_stock, category, stock_code=None):
-    """計算某分類或特定股票的持有股數"""
-    if df_stock.empty:
-        return {}
+@st.cache_data(show_spinner=False, max_entries=8)
+def get_rolling_figure(version, as_of, window, _stats):
+    import charts
+    return charts.rolling_figure(_stats, window).to_dict()
 
-    if stock_code:
-        # 有指定股票代碼時，篩選該分類下的特定股票
-        filtered = df_stock[(df_stock['所屬分類'] == category) &
-                           (df_stock['股票代碼'] == stock_code)]
-    else:
-        filtered = df_stock[df_stock['所屬分類'] == category]
-
-    if filtered.empty:
-        return {}
+@st.cache_data(show_spinner=False, max_entries=4)
+def get_fear_greed_history_figure(history_version, stock_version, as_of, _history, _nav, _contributions):
+    import charts
+    return charts.fear_greed_history_figure(_history, _nav, _contributions).to_dict()
 
-    holdings = {}
-    for _, row in filtered.iterrows():
-        code = row['股票代碼']
-        shares = row['股數']
-        t_type = row['交易類型']
-
-        if code not in holdings:
-            holdings[code] = 0
-
-        if t_type == '買進':
-            holdings[code] += abs(shares)
-        else:
-            holdings[code] -= abs(shares)
-
-    # 移除持股為0或負的
-    return {k: v for k, v in holdings.items() if v > 0}
-
-# 計算目前市值
-def calculate_market_value(df_stock, category, stock_code=None):
-    """計算某分類或特定股票的目前市值"""
-    holdings = calculate_holdings(df_stock, category, stock_code)
-
-    if not holdings:
-        return 0
-
-    total_value = 0
-    for code, shares in holdings.items():
-        current_price = get_current_price(code)
-        if current_price:
-            total_value += shares * current_price
-
-    return total_value
-
-# 檢查保守型月度投資計畫
-def check_monthly_conservative_plan(df_plan):
-    """檢查從2026/1開始每個月是否有保守型投資計畫"""
-    if df_plan.empty:
-        return []
-
-    # 轉換時間欄位
-    df_plan['時間'] = pd.to_datetime(df_plan['時間'])
-
-    # 篩選保守型
-    conservative = df_plan[df_plan['投資類型'] == '保守型']
-
-    if conservative.empty:
-        return []
-
-    # 取得已有的月份
-    existing_months = conservative['時間'].dt.to_period('M').unique()
-
-    # 檢查從2026/1到現在的每個月
-    start_date = pd.Period('2026-01', 'M')
-    current_date = pd.Period(datetime.now(), 'M')
-
-    missing_months = []
-    period = start_date
-    while period <= current_date:
-        if period not in existing_months:
-            missing_months.append(period.strftime('%Y年%m月'))
-        period += 1
-
-    return missing_months
-
-# 檢查保守型每月投資是否低於下限
-def check_conservative_monthly_limit(df_plan, minimum=300):
-    """檢查保守型每月投資是否低於下限"""
-    if df_plan.empty:
-        return []
-
-    df_plan = df_plan.copy()
-    df_plan['時間'] = pd.to_datetime(df_plan['時間'])
-
-    conservative = df_plan[df_plan['投資類型'] == '保守型']
-    if conservative.empty:
-        return []
-
-    # 按月份加總
-    conservative['月份'] = conservative['時間'].dt.to_period('M')
-    monthly_sum = conservative.groupby('月份')['預計投入(USD)'].sum()
-
-    below_minimum = []
-    for month, amount in monthly_sum.items():
-        if amount < minimum:
-            below_minimum.append({
-                'month': month.strftime('%Y年%m月'),
-                'amount': amount,
-                'minimum': minimum
-            })
-
-    return below_minimum
-
-# 檢查樂透型是否超過總投資比例
-def check_lottery_ratio(df_plan, max_ratio=10):
-    """檢查樂透型是否超過總投資金額的比例上限"""
-    if df_plan.empty:
+# 取得匯率歷史（所有幣別一次批次下載，每日匯率快取於資料夾）
+@st.cache_data(ttl=300)  # 快取5分鐘
+def get_fx_history(folder_path, currencies, start):
+    """批次更新並回傳本地匯率歷史"""
+    return fx_service.update_fx_history(folder_path, currencies, start)
+
+def get_ledger_fx_history():
+    """依目前帳本用到的幣別與最早日期取得匯率歷史"""
+    currencies = {'USD'}
+    dates = []
+    for state_key, date_col in [('df_stock', '交易日期'), ('df_option', '交易日期'), ('df_plan', '時間')]:
+        df = st.session_state.get(state_key)
+        if df is None or df.empty:
+            continue
+        if date_col in df.columns:
+            dates.append(pd.to_datetime(df[date_col], errors='coerce').min())
+        if '幣別' in df.columns:
+            currencies.update(df['幣別'].dropna().astype(str).str.upper())
+    dates = [d for d in dates if pd.notna(d)]
+    start = min(dates) if dates else pd.Timestamp(datetime.now().date()) - pd.Timedelta(days=30)
+    return get_fx_history(st.session_state.data_folder, tuple(sorted(currencies)), start.strftime('%Y-%m-%d'))
+
+# 本地匯率歷史（不連網，總覽以外的頁面使用；需要補抓時由使用者手動更新）
+@st.cache_data(ttl=300)
+def get_local_fx_history(folder_path):
+    return fx_service.load_fx_history(folder_path)
+
+# 本地匯率歷史的最新匯率（不連網，供每個頁面的側邊欄與說明文字顯示）
+@st.cache_data(ttl=300)
+def get_local_exchange_rate(folder_path, from_currency="USD", to_currency="TWD"):
+    history = fx_service.load_fx_history(folder_path)
+    if history.empty:
         return None
+    return fx_service.cross_rate(fx_service.latest_rates(history), from_currency, to_currency)
 
-    total_investment = df_plan['預計投入(USD)'].sum()
-    if total_investment == 0:
+# 取得即時匯率
+def get_exchange_rate(from_currency="USD", to_currency="TWD"):
+    """由批次匯率歷史取得最新匯率"""
+    history = get_ledger_fx_history()
+    if history.empty:
         return None
+    return fx_service.cross_rate(fx_service.latest_rates(history), from_currency, to_currency)
 
-    lottery = df_plan[df_plan['投資類型'] == '樂透型']
-    lottery_amount = lottery['預計投入(USD)'].sum() if not lottery.empty else 0
-
-    lottery_ratio = (lottery_amount / total_investment) * 100
-
-    if lottery_ratio > max_ratio:
-        return {
-            'ratio': lottery_ratio,
-            'amount': lottery_amount,
-            'total': total_investment,
-            'max_ratio': max_ratio
-        }
+# 計畫合規檢查（與 API、報表共用同一份邏輯）
+check_monthly_conservative_plan = overview.check_monthly_conservative_plan
+check_conservative_monthly_limit = overview.check_conservative_monthly_limit
+check_lottery_ratio = overview.check_lottery_ratio
 
-    return None
 def get_planned_amount(df_plan, df_allocation, category, stock_code=None):
     if df_plan.empty:
         return 0
@@ -460,8 +440,20 @@ def get_planned_amount(df_plan, df_allocation, category, stock_code=None):
         return float(filtered['預計投入(USD)'].sum()) if not filtered.empty else 0
 
 # 側邊欄選單
+PAGE_TABLES = {
+    "📊 投資總覽": ['df_plan', 'df_allocation', 'df_conservative', 'df_lottery', 'df_stock', 'df_option', 'df_option_archive', 'df_actions'],
+    "💵 投資計畫管理": ['df_plan', 'df_allocation', 'df_conservative', 'df_lottery', 'df_stock', 'df_option', 'df_option_archive'],
+    "📈 股票交易記錄": ['df_stock'],
+    "🎯 選擇權交易記錄": ['df_option', 'df_option_archive', 'df_stock'],
+    "📉 數據分析": ['df_stock', 'df_actions'],
+    "🎲 蒙地卡羅模擬": ['df_plan', 'df_allocation', 'df_conservative', 'df_lottery', 'df_stock', 'df_actions'],
+    "⚖️ 再平衡試算": ['df_plan', 'df_allocation', 'df_conservative', 'df_lottery', 'df_stock', 'df_actions'],
+    "⚡ 壓力測試": ['df_plan', 'df_option', 'df_stock', 'df_actions'],
+    "🗂️ 多組合總覽": [],
+}
 page = st.sidebar.radio("選擇功能",
-    ["📊 投資總覽", "💵 投資計畫管理", "📈 股票交易記錄", "🎯 選擇權交易記錄", "📉 數據分析"])
+    ["📊 投資總覽", "💵 投資計畫管理", "📈 股票交易記錄", "🎯 選擇權交易記錄", "📉 數據分析", "🎲 蒙地卡羅模擬", "⚖️ 再平衡試算", "⚡ 壓力測試", "🗂️ 多組合總覽"])
+ensure_tables(*PAGE_TABLES[page])
 
 # 側邊欄 - 資料載入/匯出
 st.sidebar.divider()
@@ -498,6 +490,60 @@ with col2:
         else:
             st.sidebar.warning("請輸入資料夾路徑")
 
+# 版本記錄：每次儲存的快照
+if st.session_state.get('file_versions') is not None and os.path.isdir(st.session_state.data_folder):
+    with st.sidebar.expander("🕘 版本記錄"):
+        history = snapshots.list_snapshots(st.session_state.data_folder)
+        if history.empty:
+            st.caption("尚無快照，儲存後會自動建立")
+        else:
+            st.dataframe(history[['時間', '說明', '快照']], hide_index=True, use_container_width=True, height=180)
+            st.caption(f"存放區大小: {snapshots.store_size(st.session_state.data_folder) / 1024:,.1f} KB")
+            selected = st.selectbox("選擇快照", history['快照'].tolist(),
+                format_func=lambda s: f"{s} ({history.set_index('快照').loc[s, '時間']})", key="snapshot_select")
+            diff = snapshots.diff_snapshots(st.session_state.data_folder, selected, history['快照'].iloc[0])
+            if diff.empty:
+                st.caption("與最新快照相同")
+            else:
+                st.caption("與最新快照的差異")
+                st.dataframe(diff, hide_index=True, use_container_width=True)
+            col_restore, col_undo = st.columns(2)
+            with col_restore:
+                if st.button("還原", use_container_width=True, key="snapshot_restore_btn"):
+                    snapshots.restore_snapshot(st.session_state.data_folder, selected)
+                    load_from_folder(st.session_state.data_folder)
+                    st.rerun()
+            with col_undo:
+                if st.button("↩️ 復原上次儲存", use_container_width=True, key="snapshot_undo_btn"):
+                    if snapshots.undo(st.session_state.data_folder) is None:
+                        st.info("沒有可復原的變更")
+                    else:
+                        load_from_folder(st.session_state.data_folder)
+                        st.rerun()
+
+# 自動偵測其他工作階段或排程對資料夾的修改
+auto_reload = st.sidebar.checkbox("🔄 自動重新載入變更的檔案", value=True, key="auto_reload",
+    help="以檔案修改時間與大小偵測變更，只重新載入有變動的表格")
+if auto_reload and st.session_state.get('file_versions') is not None:
+    reloaded, kept = sync_folder_changes(st.session_state.data_folder)
+    if reloaded:
+        st.sidebar.info(f"已重新載入: {', '.join(reloaded)}")
+    if kept:
+        st.sidebar.warning(f"檔案已被修改，但本頁有未儲存的編輯: {', '.join(kept)}")
+
+    fragment = getattr(st, 'fragment', None)
+    if fragment is not None:
+        watcher = get_folder_watcher(st.session_state.data_folder)
+
+        @fragment(run_every=5)
+        def watch_folder():
+            # 背景執行緒已更新簽章，這裡只做記憶體比對
+            if watcher.changed_since(st.session_state.get('file_signatures')):
+                st.rerun()
+
+        with st.sidebar:
+            watch_folder()
+
 # 雲端模式：上傳檔案
 st.sidebar.markdown("---")
 uploaded_files = st.sidebar.file_uploader(
@@ -535,10 +581,12 @@ else:
 
 # ==================== 投資總覽 ====================
 if page == "📊 投資總覽":
+    import charts
+    import plotly.graph_objects as go
     st.header("投資資金配置總覽")
 
     df_plan = st.session_state.df_plan
-    df_stock = st.session_state.df_stock
+    df_stock, dividend_events = get_adjusted_stock()
     df_option = st.session_state.df_option
     df_allocation = st.session_state.df_allocation
     df_conservative = st.session_state.df_conservative
@@ -547,169 +595,34 @@ if page == "📊 投資總覽":
     # 顯示恐懼貪婪指數（儀表板樣式）
     fgi = get_fear_greed_index()
     if fgi:
-        value = fgi['value']
-
-        # 建立儀表板圖表
-        fig_gauge = go.Figure(go.Indicator(
-            mode="gauge+number",
-            value=value,
-            title={'text': f"恐懼貪婪指數<br><span style='font-size:14px;color:gray'>{fgi['description']}</span>"},
-            gauge={
-                'axis': {
-                    'range': [0, 100],
-                    'tickwidth': 1,
-                    'tickmode': 'array',
-                    'tickvals': [0, 25, 50, 75, 100],
-                    'ticktext': ['0', '25', '50', '75', '100']
-                },
-                'bar': {'color': "darkblue"},
-                'bgcolor': "white",
-                'steps': [
-                    {'range': [0, 25], 'color': '#e74c3c'},    # 極度恐懼 - 紅色
-                    {'range': [25, 45], 'color': '#e67e22'},   # 恐懼 - 橘色
-                    {'range': [45, 55], 'color': '#f1c40f'},   # 中性 - 黃色
-                    {'range': [55, 75], 'color': '#2ecc71'},   # 貪婪 - 綠色
-                    {'range': [75, 100], 'color': '#27ae60'}   # 極度貪婪 - 深綠
-                ],
-                'threshold': {
-                    'line': {'color': "black", 'width': 4},
-                    'thickness': 0.75,
-                    'value': value
-                }
-            }
-        ))
-
-        fig_gauge.update_layout(
-            height=300,
-            margin=dict(l=30, r=30, t=60, b=30),
-            annotations=[
-                dict(
-                    text=f"更新: {fgi['last_update']}",
-                    x=0.5, y=-0.1,
-                    showarrow=False,
-                    font=dict(size=10, color='gray')
-                )
-            ]
-        )
-
         # 使用較窄的欄位顯示
         col_gauge, col_empty = st.columns([1, 2])
         with col_gauge:
-            st.plotly_chart(fig_gauge, use_container_width=True)
+            st.plotly_chart(charts.fear_greed_gauge(fgi['value'], fgi['description'], fgi['last_update']),
+                            use_container_width=True)
 
-    elif FEAR_GREED_AVAILABLE:
+    elif not get_fear_greed_updater(st.session_state.data_folder).ready:
+        st.caption("⏳ 恐懼貪婪指數背景更新中…")
+    elif sentiment.REQUESTS_AVAILABLE or sentiment.FEAR_GREED_AVAILABLE:
         st.warning("⚠️ 無法取得恐懼貪婪指數")
 
     rate_display = get_exchange_rate("USD", "TWD") or USD_RATE
     st.info(f"💡 預計金額來自投資計畫CSV，實際金額來自交易記錄CSV | 即時匯率: USD 1 = TWD {rate_display:.2f}")
-    
-    # 準備圖表數據
-    chart_data = []
-    
-    # 從 investment_plan.csv 讀取投資類型
     if not df_plan.empty:
-        # 按投資類型分組,取最新的預計投入
-        plan_summary = df_plan.groupby('投資類型').agg({
-            '預計投入(USD)': 'sum',
-            '匯率': 'last'
-        }).reset_index()
-        
-        for _, row in plan_summary.iterrows():
-            inv_type = row['投資類型']
-            planned = row['預計投入(USD)']
-            
-            if inv_type == '進攻型':
-                # 進攻型需要拆分成各股票
-                if not df_allocation.empty:
-                    for _, stock_row in df_allocation.iterrows():
-                        stock_code = stock_row['股票代碼']
-                        weight = float(stock_row['比重'])
-
-                        # 預計金額 = 進攻型總額 × 比重
-                        stock_planned = planned * (weight / 100)
-
-                        # 實際金額從交易記錄計算（僅股票成本）
-                        stock_actual = calculate_actual_investment(df_stock, '進攻型', stock_code)
-                        # 選擇權保證金（資金來源為此股票）
-                        stock_margin, margin_details = calculate_option_margin(df_option, stock_code, return_details=True)
-
-                        # 已全部賣出的股票不顯示在圖表中
-                        holdings = calculate_holdings(df_stock, '進攻型', stock_code)
-                        if stock_actual > 0 and not holdings:
-                            continue
-
-                        chart_data.append({
-                            'name': stock_code,
-                            'type': '進攻型',
-                            'planned': stock_planned,
-                            'actual': stock_actual,
-                            'margin': stock_margin,
-                            'margin_details': margin_details
-                        })
-            elif inv_type == '保守型':
-                # 保守型拆分成各股票
-                if not df_conservative.empty:
-                    for _, stock_row in df_conservative.iterrows():
-                        stock_code = stock_row['股票代碼']
-                        weight = float(stock_row['比重'])
-
-                        stock_planned = planned * (weight / 100)
-                        stock_actual = calculate_actual_investment(df_stock, '保守型', stock_code)
-
-                        # 已全部賣出的股票不顯示在圖表中
-                        holdings = calculate_holdings(df_stock, '保守型', stock_code)
-                        if stock_actual > 0 and not holdings:
-                            continue
-
-                        chart_data.append({
-                            'name': stock_code,
-                            'type': '保守型',
-                            'planned': stock_planned,
-                            'actual': stock_actual,
-                            'margin': 0
-                        })
-                else:
-                    # 沒有配置時顯示整體
-                    actual = calculate_actual_investment(df_stock, inv_type)
-                    chart_data.append({
-                        'name': inv_type,
-                        'type': inv_type,
-                        'planned': planned,
-                        'actual': actual,
-                        'margin': 0
-                    })
-            elif inv_type == '樂透型':
-                # 樂透型拆分成各股票
-                if not df_lottery.empty:
-                    for _, stock_row in df_lottery.iterrows():
-                        stock_code = stock_row['股票代碼']
-                        weight = float(stock_row['比重'])
-
-                        stock_planned = planned * (weight / 100)
-                        stock_actual = calculate_actual_investment(df_stock, '樂透型', stock_code)
-
-                        # 已全部賣出的股票不顯示在圖表中
-                        holdings = calculate_holdings(df_stock, '樂透型', stock_code)
-                        if stock_actual > 0 and not holdings:
-                            continue
-
-                        chart_data.append({
-                            'name': stock_code,
-                            'type': '樂透型',
-                            'planned': stock_planned,
-                            'actual': stock_actual,
-                            'margin': 0
-                        })
-                else:
-                    # 沒有配置時顯示整體
-                    actual = calculate_actual_investment(df_stock, inv_type)
-                    chart_data.append({
-                        'name': inv_type,
-                        'type': inv_type,
-                        'planned': planned,
-                        'actual': actual,
-                        'margin': 0
-                    })
+        plan_twd = fx_service.plan_amount_twd(df_plan, get_ledger_fx_history())
+        st.caption(f"💱 計畫投入折合台幣（依各列匯率）: NT${plan_twd['預計投入(TWD)'].sum():,.0f}")
+    
+    # 資金分配（與 API、報表共用 overview.allocation_rows；報價一次批次取得，結果與圖表依資料版本快取）
+    tables = {'df_plan': df_plan, 'df_stock': df_stock, 'df_option': df_option, 'df_allocation': df_allocation,
+              'df_conservative': df_conservative, 'df_lottery': df_lottery}
+    versions = (datetime.now().strftime('%Y-%m-%d'),) + tuple(portfolio_core.data_version(df) for df in tables.values())
+    quotes = get_batch_quotes(tuple(overview.quote_tickers(tables)))
+    allocation = get_allocation_rows(versions, quotes, tables)
+    chart_data = [{'name': name, 'type': kind, 'planned': planned, 'actual': actual, 'margin': margin}
+                  for name, kind, planned, actual, margin in zip(
+                      allocation['名稱'], allocation['類型'], allocation['預計投入(USD)'],
+                      allocation['實際買入(USD)'], allocation['保證金(USD)'])]
+    market_values = allocation['市值(USD)'].tolist()
 
     # 顯示長條圖
     if chart_data:
@@ -719,239 +632,24 @@ if page == "📊 投資總覽":
             st.subheader("📊 資金分配圖表")
         with col_btn:
             if st.button("🔄 重新查詢現價"):
-                st.cache_data.clear()
+                # 只清除報價快取，歷史價格與模擬結果不受影響
+                get_batch_quotes.clear()
                 st.rerun()
 
-        # 計算目前市值
-        market_values = []
-        price_fetch_failed = False
-        for d in chart_data:
-            # 如果 name 不等於 type，表示是個別股票
-            if d['name'] != d['type']:
-                mv = calculate_market_value(df_stock, d['type'], d['name'])
-            else:
-                mv = calculate_market_value(df_stock, d['type'])
-            market_values.append(mv)
-            if mv == 0 and d['name'] != d['type']:
-                # 檢查是否有持股但市值為0（可能是取價失敗）
-                holdings = calculate_holdings(df_stock, d['type'], d['name'])
-                if holdings and sum(holdings.values()) > 0:
-                    price_fetch_failed = True
-
-        if price_fetch_failed:
+        # 有持股但查不到現價（可能被限速）
+        missing_price = (allocation['名稱'] != allocation['類型']) & (allocation['持有股數'] > 0) & allocation['現價'].isna()
+        if missing_price.any():
             st.warning("⚠️ 部分股票現價查詢失敗（Yahoo Finance 可能被限速），請稍後點擊「重新查詢現價」")
 
-        # 準備圖表
-        categories = [d['name'] for d in chart_data]
-        planned_values = [d['planned'] for d in chart_data]
-        actual_values = [d['actual'] for d in chart_data]
-
-        # 計算每個項目的成本價、現價、持股數
-        actual_hover_texts = []
-        market_hover_texts = []
-
-        for i, d in enumerate(chart_data):
-            stock_code = d['name']
-            category = d['type']
-
-            # 計算成本價 (實際買入金額 / 持股數)
-            # 如果 name 不等於 type，表示是個別股票
-            is_individual_stock = (stock_code != category)
-            holdings = calculate_holdings(df_stock, category, stock_code if is_individual_stock else None)
-            total_shares = sum(holdings.values()) if holdings else 0
-            cost_price = actual_values[i] / total_shares if total_shares > 0 else 0
-
-            # 取得現價
-            if is_individual_stock:
-                current_price = get_current_price(stock_code) or 0
-            else:
-                # 未配置時可能有多檔股票，取最後一檔的價格
-                current_price = 0
-                if holdings:
-                    for code in holdings:
-                        p = get_current_price(code)
-                        if p:
-                            current_price = p
-
-            # 實際買入 hover 文字
-            if actual_values[i] > 0:
-                actual_hover_texts.append(
-                    f"<b>{stock_code}</b><br>"
-                    f"成本價: ${cost_price:,.2f}<br>"
-                    f"總成本: ${actual_values[i]:,.0f}"
-                )
-            else:
-                actual_hover_texts.append(f"<b>{stock_code}</b><br>尚未買入")
-
-            # 目前市值 hover 文字
-            if market_values[i] > 0:
-                market_hover_texts.append(
-                    f"<b>{stock_code}</b><br>"
-                    f"現在股價: ${current_price:,.2f}<br>"
-                    f"目前市值: ${market_values[i]:,.0f}"
-                )
-            else:
-                market_hover_texts.append(f"<b>{stock_code}</b><br>無持股")
-
-        # 取得保證金數據
-        margin_values = [d.get('margin', 0) for d in chart_data]
-
-        # 建立選擇權保證金 hover 文字
-        margin_hover_texts = []
-        for d in chart_data:
-            margin_details = d.get('margin_details', [])
-            margin_total = d.get('margin', 0)
-            if margin_total > 0 and margin_details:
-                # 顯示標的股票和保證金
-                hover_lines = [f"<b>選擇權保證金</b>"]
-                for detail in margin_details:
-                    hover_lines.append(f"{detail['ticker']}: ${detail['margin']:,.0f}")
-                hover_lines.append(f"<b>合計: ${margin_total:,.0f}</b>")
-                margin_hover_texts.append("<br>".join(hover_lines))
-            elif margin_total > 0:
-                margin_hover_texts.append(f"<b>選擇權保證金</b><br>${margin_total:,.0f}")
-            else:
-                margin_hover_texts.append("")
-
-        # 建立預計投入 hover 文字（含剩餘金額）
-        planned_hover_texts = []
-        for i, d in enumerate(chart_data):
-            planned = d['planned']
-            actual = d['actual']
-            margin = d.get('margin', 0)
-            remaining = planned - actual - margin
-            planned_hover_texts.append(
-                f"<b>{d['name']}</b><br>"
-                f"預計投入: ${planned:,.0f}<br>"
-                f"剩餘金額: ${remaining:,.0f}"
-            )
-
-        # 使用 Plotly 建立圖表
-        fig = go.Figure()
-
-        # 預計投入
-        fig.add_trace(go.Bar(
-            name='預計投入',
-            x=categories,
-            y=planned_values,
-            marker_color='#64748b',
-            text=[f'${int(v):,}' if v > 0 else '' for v in planned_values],
-            textposition='outside',
-            textangle=-45,
-            hovertemplate='%{customdata}<extra></extra>',
-            customdata=planned_hover_texts,
-            offsetgroup='planned'
-        ))
-
-        # 實際買入（股票成本）- 與保證金堆疊
-        fig.add_trace(go.Bar(
-            name='實際買入',
-            x=categories,
-            y=actual_values,
-            marker_color='#3b82f6',
-            text=[f'${int(v):,}' if v > 0 else '' for v in actual_values],
-            textposition='inside',
-            textangle=0,
-            hovertemplate='%{customdata}<extra></extra>',
-            customdata=actual_hover_texts,
-            offsetgroup='actual'
-        ))
-
-        # 選擇權保證金（堆疊在實際買入上方）
-        fig.add_trace(go.Bar(
-            name='選擇權保證金',
-            x=categories,
-            y=margin_values,
-            marker_color='#f59e0b',
-            text=[f'${int(v):,}' if v > 0 else '' for v in margin_values],
-            textposition='outside',
-            textangle=-45,
-            hovertemplate='%{customdata}<extra></extra>',
-            customdata=margin_hover_texts,
-            offsetgroup='actual',
-            base=actual_values
-        ))
-
-        # 目前市值
-        fig.add_trace(go.Bar(
-            name='目前市值',
-            x=categories,
-            y=market_values,
-            marker_color='#22c55e',
-            text=[f'${int(v):,}' if v > 0 else '' for v in market_values],
-            textposition='outside',
-            textangle=-45,
-            hovertemplate='%{customdata}<extra></extra>',
-            customdata=market_hover_texts,
-            offsetgroup='market'
-        ))
-
-        # 在進攻型股票的預計投入長條上加入安全邊際標記
-        if not df_allocation.empty:
-            for i, d in enumerate(chart_data):
-                if d['type'] == '進攻型':
-                    stock_code = d['name']
-                    alloc_row = df_allocation[df_allocation['股票代碼'] == stock_code]
-                    if not alloc_row.empty:
-                        fair_value = alloc_row.iloc[0]['公允值(USD)']
-                        planned_amt = d['planned']
-
-                        if fair_value > 0 and planned_amt > 0:
-                            cumulative_weight = 0
-
-                            for j in range(1, 6):
-                                margin_pct = alloc_row.iloc[0].get(f'邊際{j}(%)', 0) or 0
-                                margin_weight = alloc_row.iloc[0].get(f'邊際{j}比重(%)', 0) or 0
-
-                                if margin_pct > 0 and margin_weight > 0:
-                                    cumulative_weight += margin_weight
-                                    height_at_margin = planned_amt * (cumulative_weight / 100)
-                                    margin_price = fair_value * margin_pct / 100
-
-                                    fig.add_annotation(
-                                        x=stock_code,
-                                        y=height_at_margin,
-                                        text=f'${margin_price:.0f}',
-                                        showarrow=False,
-                                        font=dict(size=10, color='#ff6a00', family='Arial Black'),
-                                        bgcolor='rgba(255,255,255,0.8)',
-                                        xshift=-40  # 往左偏移到預計投入長條上
-                                    )
-
-        # 計算 Y 軸最大值，加上 20% 空間顯示數字
-        all_values = planned_values + actual_values + market_values + [a + m for a, m in zip(actual_values, margin_values)]
-        max_value = max(all_values) if all_values else 0
-        y_max = max_value * 1.25  # 增加 25% 空間
-
-        fig.update_layout(
-            title='預計投入 vs 實際買入 vs 目前市值',
-            xaxis_title='投資類型/股票',
-            yaxis_title='金額 (USD)',
-            barmode='group',
-            xaxis_tickangle=-45,
-            legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=1),
-            height=500,
-            margin=dict(t=80, b=80),
-            yaxis=dict(range=[0, y_max])
-        )
-
-        fig.update_yaxes(gridcolor='rgba(0,0,0,0.1)')
-
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(get_allocation_figure(versions, quotes, allocation, df_allocation, df_option),
+                        use_container_width=True)
         
         # 詳細數據表格
         st.subheader("📋 詳細數據")
 
-        # 計算選擇權收入（提前計算用於佔比）
-        if not df_option.empty:
-            if '收支金額(USD)' in df_option.columns:
-                opt_total = df_option['收支金額(USD)'].sum()
-            elif '總成本(USD)' in df_option.columns:
-                opt_total = df_option['總成本(USD)'].sum()
-            else:
-                opt_total = 0
-        else:
-            opt_total = 0
+        # 計算選擇權收入（含已封存的到期部位，提前計算用於佔比）
+        opt_total = overview.option_income({'df_option': df_option,
+                                            'df_option_archive': st.session_state.df_option_archive})
 
         # 計算全部資金（預計投入 + 選擇權收入）用於佔比計算
         total_planned = sum([d['planned'] for d in chart_data])
@@ -1101,7 +799,9 @@ if page == "📊 投資總覽":
         realized_profit = total_sell - sold_cost
         # 股票損益 = 未實現 + 已實現
         stock_profit = unrealized_profit + realized_profit
-        total_profit = stock_profit + opt_total  # 股票報酬 + 選擇權收支
+        # 現金股利收入
+        dividend_total = dividend_events['股利收入(USD)'].sum() if not dividend_events.empty else 0
+        total_profit = stock_profit + opt_total + dividend_total  # 股票報酬 + 選擇權收支 + 股利
         total_return_rate = (total_profit / total_held_cost * 100) if total_held_cost > 0 else 0
 
         # 執行率 = (持有成本 + 被壓住保證金) / 總預算
@@ -1115,7 +815,7 @@ if page == "📊 投資總覽":
         # 總報酬率：股票報酬 + 選擇權收支
         delta_str = f"{total_return_rate:+.1f}%"
         col4.metric("📈 總報酬率", f"${total_profit:,.0f}", delta=delta_str)
-        st.caption(f"未實現: ${unrealized_profit:,.0f} (市值-成本) + 已實現: ${realized_profit:,.0f} (賣出-成本) + 選擇權: ${opt_total:,.0f}")
+        st.caption(f"未實現: ${unrealized_profit:,.0f} (市值-成本) + 已實現: ${realized_profit:,.0f} (賣出-成本) + 選擇權: ${opt_total:,.0f} + 股利: ${dividend_total:,.0f}")
 
         # 執行率
         col5.metric("🎯 執行率", f"{overall_exec_rate:.1f}%")
@@ -1150,12 +850,13 @@ elif page == "💵 投資計畫管理":
             "預計投入(USD)": st.column_config.NumberColumn("預計投入(USD)",
                 format="$%.2f", min_value=0, required=True),
             "匯率": st.column_config.NumberColumn("匯率(USD→TWD)",
-                format="%.2f", min_value=0, help=f"即時匯率: {get_exchange_rate('USD', 'TWD') or USD_RATE:.2f}")
+                format="%.2f", min_value=0, help=f"最新匯率: {get_local_exchange_rate(st.session_state.data_folder) or USD_RATE:.2f}")
         }, key="plan_editor")
+    unedited_plan = edited_plan.equals(df_plan)
 
     # 自動儲存到 session_state
     edited_plan['時間'] = edited_plan['時間'].astype(str)
-    st.session_state.df_plan = edited_plan
+    store_page_table('df_plan', edited_plan, unedited_plan)
 
     # 檢查保守型月度計畫
     missing_months = check_monthly_conservative_plan(edited_plan)
@@ -1218,6 +919,7 @@ elif page == "💵 投資計畫管理":
             "邊際4比重(%)": st.column_config.NumberColumn("比重4", format="%.0f%%", default=10.0),
             "邊際5比重(%)": st.column_config.NumberColumn("比重5", format="%.0f%%", default=20.0)
         }, key="allocation_editor")
+    unedited_alloc = edited_alloc.equals(df_allocation)
 
     total_weight = edited_alloc['比重'].sum()
     if total_weight != 100:
@@ -1226,27 +928,44 @@ elif page == "💵 投資計畫管理":
         st.success(f"✅ 總比重: {total_weight}%")
 
     # 自動儲存到 session_state
-    st.session_state.df_allocation = edited_alloc
+    store_page_table('df_allocation', edited_alloc, unedited_alloc)
 
-    # 顯示買入參考價格表
-    # 顯示邊際價格（文字格式）
+    # 五檔買入參考價格：所有標的與檔位一次比對現價
     if not edited_alloc.empty:
         st.write("**📋 五檔買入參考價格**")
-        for _, row in edited_alloc.iterrows():
-            code = row['股票代碼']
-            fair = row['公允值(USD)']
-            if fair > 0:
-                # 取得現價
-                current_price = get_current_price(code)
-                # 計算邊際價格
-                margin_prices = []
-                for i in range(1, 6):
-                    margin = row[f'邊際{i}(%)']
-                    if margin > 0:
-                        margin_prices.append(f"{fair * margin / 100:.2f}")
-                if margin_prices:
-                    price_str = " / ".join(margin_prices)
-                    st.write(f"**{code}**: 現價 {current_price:.2f} | 邊際價: {price_str}")
+        ladder_codes = tuple(sorted(edited_alloc['股票代碼'].dropna().astype(str).str.upper().unique()))
+        ladder = price_ladder.evaluate_ladder(
+            edited_alloc, get_batch_quotes(ladder_codes),
+            portfolio_core.planned_by_ticker(st.session_state.df_plan, edited_alloc),
+            portfolio_core.buy_cost(st.session_state.df_stock, '進攻型'))
+        if not ladder.empty:
+            st.dataframe(ladder, use_container_width=True, hide_index=True,
+                column_config={
+                    **{f"檔{j}價格": st.column_config.NumberColumn(format="$%.2f") for j in range(1, 6)},
+                    "現價": st.column_config.NumberColumn(format="$%.2f"),
+                    "預計投入(USD)": st.column_config.NumberColumn(format="$%.0f"),
+                    "應投入(USD)": st.column_config.NumberColumn(format="$%.0f"),
+                    "已投入(USD)": st.column_config.NumberColumn(format="$%.0f"),
+                    "待買入(USD)": st.column_config.NumberColumn(format="$%.0f")
+                })
+
+            # 狀態有變化的檔位寫入警示記錄（排程可改用: python price_ladder.py <資料夾>）
+            # 上傳模式沒有資料夾，記錄只保存在本次工作階段
+            alert_folder = st.session_state.data_folder if st.session_state.get('file_versions') is not None else None
+            session_log = st.session_state.get('ladder_alert_log')
+            new_alerts = price_ladder.record_alerts(alert_folder, ladder, log=session_log)
+            if alert_folder is None and not new_alerts.empty:
+                st.session_state.ladder_alert_log = pd.concat([session_log, new_alerts], ignore_index=True) \
+                    if session_log is not None else new_alerts
+            for _, alert in new_alerts[new_alerts['狀態'] == '觸發'].iterrows():
+                st.warning(f"🔔 {alert['股票代碼']} 跌破第{alert['檔位']}檔 ${alert['邊際價']:.2f}"
+                           f"（現價 ${alert['現價']:.2f}），本檔應投入 ${alert['應投入(USD)']:,.0f}")
+
+            alert_log = price_ladder.load_alert_log(alert_folder) if alert_folder else \
+                st.session_state.get('ladder_alert_log', pd.DataFrame(columns=price_ladder.ALERT_LOG_COLUMNS))
+            if not alert_log.empty:
+                with st.expander(f"🔔 警示記錄 ({len(alert_log)} 筆)"):
+                    st.dataframe(alert_log.iloc[::-1], use_container_width=True, hide_index=True)
 
     # ==================== 保守型股票配置 ====================
     st.divider()
@@ -1267,6 +986,7 @@ elif page == "💵 投資計畫管理":
             "比重": st.column_config.NumberColumn("比重(%)", format="%.0f", required=True),
             "說明": st.column_config.TextColumn("說明")
         }, key="conservative_editor")
+    unedited_conservative = edited_conservative.equals(df_conservative)
 
     conservative_weight = edited_conservative['比重'].sum()
     if conservative_weight != 100:
@@ -1275,7 +995,7 @@ elif page == "💵 投資計畫管理":
         st.success(f"✅ 保守型總比重: {conservative_weight}%")
 
     # 自動儲存到 session_state
-    st.session_state.df_conservative = edited_conservative
+    store_page_table('df_conservative', edited_conservative, unedited_conservative)
 
     # ==================== 樂透型股票配置 ====================
     st.divider()
@@ -1296,6 +1016,7 @@ elif page == "💵 投資計畫管理":
             "比重": st.column_config.NumberColumn("比重(%)", format="%.0f", required=True),
             "說明": st.column_config.TextColumn("說明")
         }, key="lottery_editor")
+    unedited_lottery = edited_lottery.equals(df_lottery)
 
     lottery_weight = edited_lottery['比重'].sum()
     if lottery_weight != 100:
@@ -1304,7 +1025,41 @@ elif page == "💵 投資計畫管理":
         st.success(f"✅ 樂透型總比重: {lottery_weight}%")
 
     # 自動儲存到 session_state
-    st.session_state.df_lottery = edited_lottery
+    store_page_table('df_lottery', edited_lottery, unedited_lottery)
+
+    # ==================== 計畫 vs 實際投入時間軸 ====================
+    st.divider()
+    st.subheader("📅 計畫 vs 實際投入時間軸")
+    rollup_tables = {key: st.session_state[key] for key in ['df_plan', 'df_stock', 'df_option', 'df_option_archive',
+                                                           'df_allocation', 'df_conservative', 'df_lottery']}
+    monthly = get_monthly_rollups(tuple(portfolio_core.data_version(df) for df in rollup_tables.values()),
+                                  st.session_state.data_folder if st.session_state.get('file_versions') is not None else None,
+                                  rollup_tables)
+    if monthly.empty:
+        st.info("尚無計畫或交易資料")
+    else:
+        col_cat, col_code = st.columns(2)
+        with col_cat:
+            timeline_category = st.selectbox("分類", ["全部"] + overview.CATEGORIES, key="timeline_category")
+        codes = sorted(c for c in monthly.loc[monthly['分類'] == timeline_category, '代碼'].unique() if c) \
+            if timeline_category != "全部" else []
+        with col_code:
+            timeline_code = st.selectbox("代碼", ["全部"] + codes, key="timeline_code", disabled=not codes)
+        category = None if timeline_category == "全部" else timeline_category
+        code = None if timeline_code == "全部" else timeline_code
+        timeline = rollups.timeline(monthly, rollup_tables, category, code)
+        if timeline.empty:
+            st.info("所選範圍沒有資料")
+        else:
+            import charts
+            label = code or category or "全部"
+            st.plotly_chart(charts.contribution_timeline_figure(timeline, f"計畫 vs 實際投入（{label}）"),
+                            use_container_width=True)
+            last = timeline.iloc[-1]
+            col1, col2, col3 = st.columns(3)
+            col1.metric("累計計畫", f"${last['累計計畫(USD)']:,.0f}")
+            col2.metric("累計淨投入", f"${last['累計淨投入(USD)']:,.0f}")
+            col3.metric("落後計畫", f"${last['累計計畫(USD)'] - last['累計淨投入(USD)']:,.0f}")
 
 # ==================== 股票交易記錄 ====================
 elif page == "📈 股票交易記錄":
@@ -1350,6 +1105,7 @@ elif page == "📈 股票交易記錄":
             "用途說明": st.column_config.TextColumn("用途"),
             "備註": st.column_config.TextColumn("備註")
         }, key="stock_editor")
+    unedited_stock = edited_stock.equals(df_stock)
     
     # 顯示計算預覽
     if not edited_stock.empty and len(edited_stock) > 0:
@@ -1419,7 +1175,7 @@ elif page == "📈 股票交易記錄":
             edited_stock.at[idx, '股數'] = -abs(row['股數'])
 
     edited_stock['交易日期'] = edited_stock['交易日期'].astype(str)
-    st.session_state.df_stock = edited_stock
+    store_page_table('df_stock', edited_stock, unedited_stock)
 
     # 統計
     if not df_stock.empty and len(df_stock) > 0:
@@ -1502,6 +1258,7 @@ elif page == "🎯 選擇權交易記錄":
             "資金來源": st.column_config.TextColumn("來源"),
             "策略說明": st.column_config.TextColumn("策略")
         }, key="option_editor")
+    unedited_option = edited_option.equals(df_option)
     
     # 自動處理預設值並儲存到 session_state
     for idx, row in edited_option.iterrows():
@@ -1520,12 +1277,90 @@ elif page == "🎯 選擇權交易記錄":
 
     edited_option['交易日期'] = edited_option['交易日期'].astype(str)
     edited_option['到期日'] = edited_option['到期日'].astype(str)
-    st.session_state.df_option = edited_option
+    store_page_table('df_option', edited_option, unedited_option)
+
+    # 到期/平倉部位批次處理（排程可改用: python option_expiry.py <資料夾>）
+    pending = option_expiry.pending_expiries(edited_option)
+    if pending:
+        col_msg, col_btn = st.columns([3, 1])
+        with col_msg:
+            st.warning(f"⏰ 有 {pending} 筆已到期或已平倉的部位尚未處理")
+        with col_btn:
+            if st.button("處理到期部位", use_container_width=True):
+                history = option_expiry.expiry_price_history(edited_option)
+                df_option_new, df_stock_new, df_archive_new, summary = option_expiry.process_expiries(
+                    edited_option, st.session_state.df_stock, st.session_state.df_option_archive, history)
+                st.session_state.df_option = df_option_new
+                st.session_state.df_stock = df_stock_new
+                st.session_state.df_option_archive = df_archive_new
+                st.session_state.pop('option_editor', None)
+                st.session_state.pop('stock_editor', None)
+                st.session_state.expiry_summary = summary
+                st.rerun()
+
+    if 'expiry_summary' in st.session_state:
+        summary = st.session_state.pop('expiry_summary')
+        st.success(
+            f"✅ 到期失效 {summary['到期失效']} | 被指派 {summary['被指派']} | 已履約 {summary['已履約']} | "
+            f"已平倉 {summary['已平倉']} | 新增股票交易 {summary['新增股票交易']} 筆 | "
+            f"釋放保證金 ${summary['釋放保證金']:,.0f}（請記得儲存到檔案）"
+        )
+        if summary.get('缺少結算價'):
+            st.warning(f"⚠️ 以下合約查不到到期日收盤價，暫不處理（仍保留在部位表）: {', '.join(summary['缺少結算價'])}")
+
+    if not st.session_state.df_option_archive.empty:
+        with st.expander(f"📦 已封存部位 ({len(st.session_state.df_option_archive)} 筆)"):
+            st.dataframe(st.session_state.df_option_archive, use_container_width=True, hide_index=True)
+
+    # Greeks 風險檢視（所有未到期部位一次向量化計算）
+    open_opts = option_analytics.open_positions(edited_option)
+    if not open_opts.empty:
+        st.divider()
+        st.subheader("📐 未到期部位 Greeks")
+        quotes = get_batch_quotes(tuple(sorted(open_opts['標的'].unique())))
+        greeks = option_analytics.compute_position_greeks(edited_option, quotes)
+        missing = sorted(set(open_opts['標的']) - set(quotes))
+        if missing:
+            st.warning(f"⚠️ 無法取得標的現價: {', '.join(missing)}")
+
+        total = greeks[['Delta', 'Gamma', 'Theta', 'Vega', 'Delta曝險(USD)']].sum()
+        col1, col2, col3, col4, col5 = st.columns(5)
+        col1.metric("Delta (股)", f"{total['Delta']:,.0f}")
+        col2.metric("Gamma", f"{total['Gamma']:,.2f}")
+        col3.metric("Theta (每日)", f"${total['Theta']:,.2f}")
+        col4.metric("Vega (每1%)", f"${total['Vega']:,.2f}")
+        col5.metric("Delta 曝險", f"${total['Delta曝險(USD)']:,.0f}")
+
+        greek_format = {
+            "隱含波動率": st.column_config.NumberColumn(format="percent"),
+            "理論價": st.column_config.NumberColumn(format="$%.2f"),
+            "Delta": st.column_config.NumberColumn(format="%.1f"),
+            "Gamma": st.column_config.NumberColumn(format="%.2f"),
+            "Theta": st.column_config.NumberColumn(format="$%.2f"),
+            "Vega": st.column_config.NumberColumn(format="$%.2f"),
+            "Delta曝險(USD)": st.column_config.NumberColumn(format="$%.0f")
+        }
+        col_under, col_source = st.columns(2)
+        with col_under:
+            st.write("**依標的彙總**")
+            st.dataframe(option_analytics.aggregate_exposure(greeks, '標的'),
+                use_container_width=True, hide_index=True, column_config=greek_format)
+        with col_source:
+            st.write("**依資金來源彙總**")
+            st.dataframe(option_analytics.aggregate_exposure(greeks, '資金來源'),
+                use_container_width=True, hide_index=True, column_config=greek_format)
+
+        with st.expander("各部位明細"):
+            st.dataframe(greeks[['標的', '買賣權', '買賣方向', '履約價', '到期日', '剩餘天數', '口數', '現價',
+                                 '隱含波動率', '理論價', 'Delta', 'Gamma', 'Theta', 'Vega', '資金來源']],
+                use_container_width=True, hide_index=True, column_config=greek_format)
 
 # ==================== 數據分析 ====================
 elif page == "📉 數據分析":
+    import charts
+    import plotly.graph_objects as go
     st.header("數據分析")
-    df_stock = st.session_state.df_stock
+    df_stock, dividend_events = get_adjusted_stock()
 
     if df_stock.empty:
         st.warning("尚無數據")
@@ -1595,10 +1430,460 @@ elif page == "📉 數據分析":
         else:
             st.info("無持倉")
 
+        # 依交易日匯率計算台幣成本與匯差損益
+        st.subheader("💱 台幣成本與匯差")
+        # 預設只讀本地匯率歷史；缺少的日期由使用者按鈕補抓，避免每次進入頁面都連網
+        if st.session_state.get('fx_online'):
+            fx_history = get_ledger_fx_history()
+        else:
+            fx_history = get_local_fx_history(st.session_state.data_folder)
+            if st.button("🔄 更新匯率歷史", help="下載帳本期間缺少的每日匯率"):
+                st.session_state.fx_online = True
+                st.rerun()
+        twd_basis = fx_service.stock_cost_basis_twd(df_stock, fx_history)
+        if not twd_basis.empty:
+            st.dataframe(twd_basis, use_container_width=True, hide_index=True,
+                column_config={
+                    "總成本(USD)": st.column_config.NumberColumn(format="$%.2f"),
+                    "總成本(TWD)": st.column_config.NumberColumn(format="NT$%.0f"),
+                    "平均匯率": st.column_config.NumberColumn(format="%.3f"),
+                    "現值匯率": st.column_config.NumberColumn(format="%.3f"),
+                    "匯差損益(TWD)": st.column_config.NumberColumn(format="NT$%.0f")
+                })
+            st.caption(f"匯差損益合計: NT${twd_basis['匯差損益(TWD)'].sum():,.0f}（成本以各筆交易日匯率換算）")
+        if fx_history.empty:
+            st.caption(f"⚠️ 無匯率歷史，暫以預設匯率 {USD_RATE} 計算")
+
+        # 年度已實現損益（報稅用，逐批配對）
+        st.divider()
+        st.subheader("🧾 年度已實現損益")
+        years = sorted(pd.to_datetime(df_stock.loc[df_stock['交易類型'] != '買進', '交易日期'], errors='coerce')
+                       .dt.year.dropna().astype(int).unique(), reverse=True)
+        if not years:
+            st.info("尚無賣出紀錄")
+        else:
+            col_year, col_method = st.columns(2)
+            tax_year = col_year.selectbox("年度", years)
+            tax_method = col_method.selectbox("成本計算方式", tax_lots.METHODS,
+                                              help="AVERAGE 為平均成本，與總覽頁的已實現損益一致")
+            lots = get_realized_lots(portfolio_core.data_version(df_stock), portfolio_core.data_version(fx_history),
+                                     tax_year, tax_method, df_stock, fx_history)
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("已實現損益", f"${lots['損益(USD)'].sum():,.2f}")
+            col2.metric("短期", f"${lots.loc[lots['期間'] == '短期', '損益(USD)'].sum():,.2f}")
+            col3.metric("長期", f"${lots.loc[lots['期間'] == '長期', '損益(USD)'].sum():,.2f}")
+            col4.metric("台幣損益", f"NT${lots['損益(TWD)'].sum():,.0f}")
+            st.download_button(f"📥 下載 {tax_year} 年明細 ({len(lots)} 筆)",
+                               lots.to_csv(index=False, date_format='%Y-%m-%d').encode('utf-8-sig'),
+                               file_name=f"realized_{tax_year}_{tax_method}.csv", mime="text/csv")
+            st.caption("大量交易可用命令列輸出 CSV / Parquet: python tax_lots.py <資料夾> --year 年度 --method FIFO")
+
+        # 股利與分割
+        st.divider()
+        st.subheader("💵 股利與股票分割")
+        col_info, col_btn = st.columns([3, 1])
+        with col_info:
+            st.caption("持股與成本已依分割調整；股利以除息日前一天的持股計算")
+        with col_btn:
+            if st.button("🔄 從 Yahoo 更新", use_container_width=True):
+                raw = st.session_state.df_stock
+                start = pd.to_datetime(raw['交易日期'], errors='coerce').min()
+                fetched = corporate_actions.fetch_actions(raw['股票代碼'].astype(str).unique(), start)
+                st.session_state.df_actions = corporate_actions.merge_actions(st.session_state.df_actions, fetched)
+                st.session_state.pop('actions_editor', None)
+                st.rerun()
+
+        if not dividend_events.empty:
+            income = dividend_events.groupby(['所屬分類', '股票代碼'])['股利收入(USD)'].sum().reset_index()
+            col_income, col_total = st.columns([3, 1])
+            with col_income:
+                st.dataframe(income, use_container_width=True, hide_index=True,
+                    column_config={"股利收入(USD)": st.column_config.NumberColumn(format="$%.2f")})
+            col_total.metric("累計股利", f"${income['股利收入(USD)'].sum():,.2f}")
+
+        with st.expander(f"公司行動表 ({len(st.session_state.df_actions)} 筆)"):
+            edited_actions = st.data_editor(st.session_state.df_actions, num_rows="dynamic", use_container_width=True,
+                key="actions_editor", column_config={
+                    "類型": st.column_config.SelectboxColumn("類型",
+                        options=[corporate_actions.SPLIT, corporate_actions.DIVIDEND], required=True),
+                    "分割比例": st.column_config.NumberColumn("分割比例", help="例如 1 拆 4 填 4", format="%.4g"),
+                    "每股股利(USD)": st.column_config.NumberColumn("每股股利", format="$%.4f")
+                })
+            unedited_actions = edited_actions.equals(st.session_state.df_actions)
+            # 自動儲存到 session_state（手動新增的列標記來源）
+            edited_actions['來源'] = edited_actions['來源'].fillna('手動')
+            store_page_table('df_actions', edited_actions, unedited_actions)
+
+        # 滾動分析：報酬、波動、回撤、相關性、Beta
+        st.divider()
+        st.subheader("📈 績效與風險")
+        window = st.select_slider("滾動視窗（交易日）", options=[20, 30, 60, 90, 120, 250], value=30)
+        stats = get_rolling_analytics(portfolio_core.data_version(df_stock), datetime.now().strftime('%Y-%m-%d'),
+                                      st.session_state.data_folder, df_stock, window)
+        if stats is None:
+            st.info("尚無足夠的價格歷史可供分析")
+        else:
+            col1, col2, col3, col4, col5 = st.columns(5)
+            col1.metric("日均報酬", f"{stats['daily_return'] * 100:.3f}%")
+            col2.metric("年化報酬", f"{stats['annual_return'] * 100:.1f}%")
+            col3.metric("年化波動", f"{stats['annual_volatility'] * 100:.1f}%")
+            col4.metric("最大回撤", f"{stats['max_drawdown'] * 100:.1f}%")
+            portfolio_beta = stats['beta'].get('組合')
+            col5.metric(f"Beta (vs {analytics.BENCHMARK})", f"{portfolio_beta:.2f}" if portfolio_beta is not None else "-")
+
+            st.plotly_chart(get_rolling_figure(portfolio_core.data_version(df_stock), datetime.now().strftime('%Y-%m-%d'),
+                                               window, stats), use_container_width=True)
+
+            col_corr, col_beta = st.columns([2, 1])
+            with col_corr:
+                if not stats['correlation'].empty:
+                    corr = stats['correlation']
+                    fig_corr = go.Figure(go.Heatmap(z=corr.values, x=corr.columns, y=corr.index,
+                        zmin=-1, zmax=1, colorscale='RdBu', text=corr.round(2).values, texttemplate='%{text}'))
+                    fig_corr.update_layout(title='持股相關係數', height=400)
+                    st.plotly_chart(fig_corr, use_container_width=True)
+            with col_beta:
+                if stats['beta']:
+                    st.write(f"**Beta (vs {analytics.BENCHMARK})**")
+                    st.dataframe(pd.DataFrame({'標的': list(stats['beta']), 'Beta': list(stats['beta'].values())}),
+                        use_container_width=True, hide_index=True,
+                        column_config={"Beta": st.column_config.NumberColumn(format="%.2f")})
+
+        # 恐懼貪婪指數歷史 vs 組合市值與投入時點
+        fg_history = get_fear_greed_updater(st.session_state.data_folder).history()
+        if not fg_history.empty:
+            st.divider()
+            st.subheader("😨 恐懼貪婪指數與投入時點")
+            nav = stats['value'] if stats is not None else None
+            contributions = sentiment.contribution_timeline(df_stock)
+            st.plotly_chart(get_fear_greed_history_figure(
+                portfolio_core.data_version(fg_history), portfolio_core.data_version(df_stock),
+                datetime.now().strftime('%Y-%m-%d'), fg_history, nav, contributions), use_container_width=True)
+            if not contributions.empty:
+                at_buy = fg_history.set_index('日期')['指數'].reindex(contributions.index, method='ffill')
+                weighted = (at_buy * contributions).sum() / contributions[at_buy.notna()].sum() if at_buy.notna().any() else None
+                if weighted is not None:
+                    st.caption(f"買進時的指數（依金額加權）平均: {weighted:.0f}｜目前: {fg_history['指數'].iloc[-1]:.0f}")
+
+# ==================== 蒙地卡羅模擬 ====================
+elif page == "🎲 蒙地卡羅模擬":
+    import plotly.graph_objects as go
+    st.header("蒙地卡羅模擬")
+    st.info("💡 以歷史月報酬（含標的間相關性）模擬目前持股加上每月依計畫比重投入的資產分佈")
+
+    weights = monte_carlo.target_weights(st.session_state.df_plan, st.session_state.df_allocation,
+                                         st.session_state.df_conservative, st.session_state.df_lottery)
+    shares = portfolio_core.net_holdings(get_adjusted_stock()[0])
+    tickers = tuple(sorted(set(weights.index) | set(shares.index)))
+
+    if not tickers:
+        st.warning("⚠️ 請先設定投資計畫或輸入交易記錄")
+    else:
+        col1, col2, col3, col4 = st.columns(4)
+        years = col1.slider("模擬年數", 1, 30, 10)
+        monthly = col2.number_input("每月投入(USD)", min_value=0.0, step=100.0,
+            value=round(monte_carlo.average_monthly_contribution(st.session_state.df_plan), 0))
+        n_paths = col3.selectbox("路徑數", [1000, 10000, 100000], index=1)
+        lookback = col4.slider("歷史資料年數", 1, 20, 5)
+        use_pool = st.checkbox("使用多處理程序加速", value=False, help="路徑數多時分批交給 process pool 平行運算")
+
+        quotes = get_batch_quotes(tickers)
+        start_values = (shares * pd.Series(quotes)).dropna()
+        start_values = start_values[start_values > 0]
+        contributions = weights * monthly if weights.sum() > 0 else pd.Series(dtype=float)
+
+        history_start = (pd.Timestamp(datetime.now().date()) - pd.DateOffset(years=lookback)).strftime('%Y-%m-%d')
+        history = get_price_history(st.session_state.data_folder, tickers, history_start)
+        returns = market_data.monthly_returns(history.loc[history_start:] if not history.empty else history)
+        no_history = [t for t in tickers if t not in returns.columns or returns[t].dropna().empty]
+        if no_history:
+            st.warning(f"⚠️ 無歷史價格，以現金（零報酬）模擬: {', '.join(no_history)}")
+
+        if start_values.empty and (contributions.empty or monthly <= 0):
+            st.warning("⚠️ 沒有可模擬的持股市值或每月投入")
+            st.stop()
+
+        started = datetime.now()
+        with st.spinner("模擬中..."):
+            bands, summary, drawdowns, loss_prob = run_monte_carlo(
+                start_values, contributions, returns, years * 12, n_paths, os.cpu_count() if use_pool else None)
+        elapsed = (datetime.now() - started).total_seconds()
+
+        invested = start_values.sum() + monthly * years * 12
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("目前市值", f"${start_values.sum():,.0f}")
+        col2.metric("累計投入", f"${invested:,.0f}")
+        col3.metric("期末中位數", f"${bands['P50'].iloc[-1]:,.0f}")
+        col4.metric("虧損機率", f"{loss_prob * 100:.1f}%")
+
+        # 百分位數帶
+        months_axis = pd.period_range(pd.Timestamp(datetime.now().date()), periods=len(bands), freq='M').strftime('%Y-%m')
+        fig_band = go.Figure()
+        fig_band.add_trace(go.Scatter(x=months_axis, y=bands['P95'], line=dict(width=0), showlegend=False, hoverinfo='skip'))
+        fig_band.add_trace(go.Scatter(x=months_axis, y=bands['P5'], fill='tonexty', fillcolor='rgba(59,130,246,0.15)',
+            line=dict(width=0), name='P5–P95'))
+        fig_band.add_trace(go.Scatter(x=months_axis, y=bands['P75'], line=dict(width=0), showlegend=False, hoverinfo='skip'))
+        fig_band.add_trace(go.Scatter(x=months_axis, y=bands['P25'], fill='tonexty', fillcolor='rgba(59,130,246,0.35)',
+            line=dict(width=0), name='P25–P75'))
+        fig_band.add_trace(go.Scatter(x=months_axis, y=bands['P50'], line=dict(color='#1d4ed8', width=2), name='中位數'))
+        fig_band.update_layout(title='資產價值百分位數帶', yaxis_title='金額 (USD)', height=450)
+        st.plotly_chart(fig_band, use_container_width=True)
+
+        col_table, col_hist = st.columns(2)
+        with col_table:
+            st.write("**期末資產與最大回撤分佈**")
+            st.dataframe(summary, use_container_width=True, hide_index=True,
+                column_config={
+                    "期末資產(USD)": st.column_config.NumberColumn(format="$%.0f"),
+                    "最大回撤": st.column_config.NumberColumn(format="percent")
+                })
+        with col_hist:
+            fig_dd = go.Figure(go.Histogram(x=drawdowns * 100, nbinsx=50, marker_color='#ef4444'))
+            fig_dd.update_layout(title='最大回撤分佈', xaxis_title='最大回撤 (%)', yaxis_title='路徑數', height=300)
+            st.plotly_chart(fig_dd, use_container_width=True)
+        st.caption(f"{n_paths:,} 條路徑 × {years * 12} 個月，耗時 {elapsed:.2f} 秒")
+
+# ==================== 再平衡試算 ====================
+elif page == "⚖️ 再平衡試算":
+    st.header("再平衡試算")
+    st.info("💡 依投資計畫的預計投入比例計算達到目標權重所需的買賣，並一次試算多種價格/投入情境")
+
+    df_allocation = st.session_state.df_allocation
+    targets = rebalance.planned_targets(st.session_state.df_plan, df_allocation,
+                                        st.session_state.df_conservative, st.session_state.df_lottery)
+    shares_held = portfolio_core.net_holdings(get_adjusted_stock()[0])
+    codes = sorted(set(targets.index) | set(shares_held.index))
+
+    if targets.sum() <= 0:
+        st.warning("⚠️ 請先在「投資計畫管理」設定投資計畫與配置比重")
+    else:
+        quotes = get_batch_quotes(tuple(codes))
+        missing = [c for c in codes if c not in quotes]
+        if missing:
+            st.warning(f"⚠️ 無法取得現價，試算時略過: {', '.join(missing)}")
+        codes = [c for c in codes if c in quotes]
+
+        col1, col2, col3, col4 = st.columns(4)
+        cash = col1.number_input("可用現金(USD)", min_value=0.0, value=0.0, step=100.0)
+        allow_sell = col2.checkbox("允許賣出", value=False)
+        whole_shares = col3.checkbox("整股交易", value=True, help="加密貨幣一律以 0.0001 為單位")
+        use_ladder = col4.checkbox("依安全邊際檔位限制進攻型買入", value=True)
+
+        weights = targets.reindex(codes).fillna(0).to_numpy()
+        shares = shares_held.reindex(codes).fillna(0).to_numpy()
+        prices = np.array([quotes[c] for c in codes])
+        lot_size = np.array([0.0001 if (c in market_data.CRYPTO_MAP or not whole_shares) else 1.0 for c in codes])
+        planned = portfolio_core.planned_by_ticker(st.session_state.df_plan, df_allocation)
+        invested = portfolio_core.buy_cost(st.session_state.df_stock, '進攻型')
+        caps_fn = (lambda p: rebalance.ladder_caps(df_allocation, np.array(codes), p, planned, invested)) if use_ladder else None
+
+        # 目前價格下的下單建議
+        base_summary, base_orders = rebalance.evaluate_scenarios(
+            codes, weights, shares, prices, [0.0], [0.0], cash, lot_size, allow_sell, caps_fn)
+        order_table = pd.DataFrame({
+            '股票代碼': codes,
+            '目標權重': weights / weights.sum(),
+            '目前權重': shares * prices / max((shares * prices).sum(), 1e-9),
+            '持有股數': shares,
+            '現價': prices,
+            '建議股數': base_orders.iloc[0].to_numpy(),
+        })
+        order_table['建議金額(USD)'] = order_table['建議股數'] * order_table['現價']
+        st.subheader("📝 目前價格下的建議下單")
+        st.dataframe(order_table, use_container_width=True, hide_index=True,
+            column_config={
+                "目標權重": st.column_config.NumberColumn(format="percent"),
+                "目前權重": st.column_config.NumberColumn(format="percent"),
+                "現價": st.column_config.NumberColumn(format="$%.2f"),
+                "建議金額(USD)": st.column_config.NumberColumn(format="$%.0f")
+            })
+        st.caption(f"買進 ${base_summary['買進金額(USD)'].iloc[0]:,.0f} | 賣出 ${base_summary['賣出金額(USD)'].iloc[0]:,.0f} | "
+                   f"剩餘現金 ${base_summary['剩餘現金(USD)'].iloc[0]:,.0f}")
+
+        # 情境表：價格變動 × 額外投入
+        st.subheader("🔮 情境試算")
+        col1, col2 = st.columns(2)
+        shock_range = col1.slider("價格變動範圍(%)", -80, 50, (-30, 10), step=5)
+        extra_max = col2.number_input("額外投入上限(USD)", min_value=0.0, value=float(max(cash, 1000.0)), step=500.0)
+        shocks = np.arange(shock_range[0], shock_range[1] + 1, 5) / 100
+        contributions = np.unique(np.linspace(0, extra_max, 5))
+        grid_summary, grid_orders = rebalance.evaluate_scenarios(
+            codes, weights, shares, prices, shocks, contributions, cash, lot_size, allow_sell, caps_fn)
+
+        pivot = grid_summary.assign(額外投入=np.tile(contributions, len(shocks))).pivot(
+            index='價格變動', columns='額外投入', values='買進金額(USD)')
+        pivot.index = [f"{v * 100:+.0f}%" for v in pivot.index]
+        pivot.columns = [f"+${v:,.0f}" for v in pivot.columns]
+        st.write("**各情境買進金額 (USD)**")
+        st.dataframe(pivot, use_container_width=True,
+            column_config={col: st.column_config.NumberColumn(format="$%.0f") for col in pivot.columns})
+        with st.expander("各情境下單股數明細"):
+            detail = pd.concat([grid_summary, grid_orders], axis=1)
+            st.dataframe(detail, use_container_width=True, hide_index=True,
+                column_config={"價格變動": st.column_config.NumberColumn(format="percent")})
+
+# ==================== 壓力測試 ====================
+elif page == "⚡ 壓力測試":
+    st.header("壓力測試")
+    st.info("💡 對目前持股快照套用價格、匯率與波動率衝擊；修改情境時只重算下方區塊，不重新取價")
+
+    df_stock = get_adjusted_stock()[0]
+    df_option = st.session_state.df_option
+    held = portfolio_core.net_holdings(df_stock)
+    open_opts = option_analytics.open_positions(df_option)
+    quotes = get_batch_quotes(tuple(sorted(set(held.index) | set(open_opts['標的']))))
+    snapshot = portfolio_core.holdings_snapshot(df_stock, quotes)
+    greeks = option_analytics.compute_position_greeks(df_option, quotes)
+    margin = portfolio_core.active_margin(df_option)
+    category_plan = st.session_state.df_plan.groupby('投資類型')['預計投入(USD)'].sum() if not st.session_state.df_plan.empty else pd.Series(dtype=float)
+    category_weights = category_plan / category_plan.sum() if category_plan.sum() > 0 else None
+    usd_rate = get_local_exchange_rate(st.session_state.data_folder) or USD_RATE
+
+    if snapshot.empty and greeks.empty:
+        st.warning("⚠️ 尚無持股或選擇權部位")
+    else:
+        # 快照只在頁面載入時建立，情境修改只重跑此 fragment
+        fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None) or (lambda f: f)
+
+        @fragment
+        def render_stress_scenarios():
+            st.subheader("📝 情境設定")
+            st.caption("個股覆寫格式: TSLA:-40, NVDA:-30（優先於全體與分類變動）")
+            scenarios = st.data_editor(stress_test.DEFAULT_SCENARIOS, num_rows="dynamic", use_container_width=True,
+                key="stress_editor", column_config={
+                    "情境": st.column_config.TextColumn("情境", required=True),
+                    "匯率(%)": st.column_config.NumberColumn("USD/TWD(%)", format="%.1f"),
+                    "波動率(點)": st.column_config.NumberColumn("波動率(點)", format="%.0f")
+                })
+            if st.checkbox("加入大盤 × 波動率情境網格", value=False):
+                scenarios = pd.concat([scenarios, stress_test.grid_scenarios()], ignore_index=True)
+
+            started = datetime.now()
+            result = stress_test.run_stress(snapshot, scenarios.dropna(subset=['情境']), greeks, margin,
+                                            category_weights, usd_rate)
+            elapsed = (datetime.now() - started).total_seconds() * 1000
+
+            st.subheader("📊 衝擊結果")
+            st.dataframe(result, use_container_width=True, hide_index=True,
+                column_config={
+                    "市值(USD)": st.column_config.NumberColumn(format="$%.0f"),
+                    "市值變動(USD)": st.column_config.NumberColumn(format="$%.0f"),
+                    "市值變動(%)": st.column_config.NumberColumn(format="percent"),
+                    "市值(TWD)": st.column_config.NumberColumn(format="NT$%.0f"),
+                    "選擇權損益(USD)": st.column_config.NumberColumn(format="$%.0f"),
+                    "保證金覆蓋率": st.column_config.NumberColumn(format="%.2fx"),
+                    "樂透型佔比": st.column_config.NumberColumn(format="percent"),
+                    "最大權重偏離": st.column_config.NumberColumn(format="percent"),
+                    "合規": st.column_config.CheckboxColumn("合規")
+                })
+            st.caption(f"{len(snapshot)} 檔持股 × {len(greeks)} 個選擇權部位 × {len(result)} 個情境，計算 {elapsed:.1f} ms")
+
+        render_stress_scenarios()
+
+# ==================== 多組合總覽 ====================
+elif page == "🗂️ 多組合總覽":
+    import plotly.graph_objects as go
+    st.header("多組合總覽")
+    st.info("💡 每行輸入一個資料夾（與單一組合相同的 CSV 結構），各組合平行載入與計算，並共用一次報價查詢")
+
+    folders_text = st.text_area("組合資料夾", value=st.session_state.get('multi_folders', st.session_state.data_folder),
+        height=120, help="每行一個資料夾路徑")
+    st.session_state.multi_folders = folders_text
+    folders = [f.strip() for f in folders_text.splitlines() if f.strip()]
+    missing = [f for f in folders if not os.path.isdir(f)]
+    if missing:
+        st.warning(f"⚠️ 找不到資料夾: {', '.join(missing)}")
+    folders = tuple(f for f in folders if os.path.isdir(f))
+
+    portfolios = {}
+    if folders:
+        signatures = tuple((f, tuple(sorted(portfolio_core.folder_signatures(f).items()))) for f in folders)
+        portfolios = load_portfolios(folders, signatures)
+
+    if not portfolios:
+        st.warning("⚠️ 沒有可載入的組合")
+    else:
+        quotes = get_batch_quotes(tuple(multi_portfolio.quote_tickers(portfolios)))
+        summaries = summarize_portfolios(signatures, quotes, datetime.now().strftime('%Y-%m-%d'), portfolios)
+        combined = multi_portfolio.consolidate(summaries)
+        totals = combined['totals']
+
+        col1, col2, col3, col4, col5 = st.columns(5)
+        col1.metric("🗂️ 組合數", len(summaries))
+        col2.metric("💵 總成本", f"${totals['總成本(USD)']:,.0f}")
+        col3.metric("💰 總市值", f"${totals['總市值(USD)']:,.0f}" if totals['總市值(USD)'] > 0 else "-")
+        col4.metric("📈 總損益", f"${totals['總損益(USD)']:,.0f}", delta=f"{totals['總報酬率(%)']:+.1f}%")
+        col5.metric("🎯 執行率", f"{totals['執行率(%)']:.1f}%")
+
+        st.subheader("📋 各組合")
+        st.dataframe(combined['by_portfolio'], use_container_width=True, hide_index=True,
+            column_config={
+                **{c: st.column_config.NumberColumn(format="$%.0f") for c in multi_portfolio.SUM_FIELDS},
+                "總報酬率(%)": st.column_config.NumberColumn(format="%.1f%%"),
+                "市值佔比": st.column_config.NumberColumn(format="percent")
+            })
+
+        # 各組合市值依投資類型堆疊
+        by_type = combined['allocation'].groupby(['組合', '類型'])['市值(USD)'].sum().unstack(fill_value=0)
+        colors = {'保守型': '#22c55e', '進攻型': '#3b82f6', '樂透型': '#f59e0b'}
+        fig = go.Figure([go.Bar(name=t, x=by_type.index, y=by_type[t], marker_color=colors.get(t))
+                         for t in by_type.columns])
+        fig.update_layout(title='各組合市值（依投資類型）', barmode='stack', yaxis_title='金額 (USD)', height=400,
+                          legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=1))
+        st.plotly_chart(fig, use_container_width=True)
+
+        if not combined['compliance'].empty:
+            st.subheader("⚠️ 計畫合規提醒")
+            st.dataframe(combined['compliance'], use_container_width=True, hide_index=True)
+
+        st.subheader("📦 合併持股")
+        st.dataframe(combined['holdings'], use_container_width=True, hide_index=True,
+            column_config={
+                "現價": st.column_config.NumberColumn(format="$%.2f"),
+                "市值(USD)": st.column_config.NumberColumn(format="$%.0f"),
+                "持有成本(USD)": st.column_config.NumberColumn(format="$%.0f")
+            })
+
+        # 單一組合明細
+        st.divider()
+        selected = st.selectbox("🔍 組合明細", list(summaries))
+        detail = summaries[selected]
+        d_totals = detail['totals']
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("📋 總預算", f"${d_totals['總預算(USD)']:,.0f}")
+        col2.metric("💵 總成本", f"${d_totals['總成本(USD)']:,.0f}")
+        col3.metric("💰 總市值", f"${d_totals['總市值(USD)']:,.0f}" if d_totals['總市值(USD)'] > 0 else "-")
+        col4.metric("📈 總損益", f"${d_totals['總損益(USD)']:,.0f}", delta=f"{d_totals['總報酬率(%)']:+.1f}%")
+        st.dataframe(detail['allocation'], use_container_width=True, hide_index=True,
+            column_config={
+                "預計投入(USD)": st.column_config.NumberColumn(format="$%.0f"),
+                "實際買入(USD)": st.column_config.NumberColumn(format="$%.0f"),
+                "保證金(USD)": st.column_config.NumberColumn(format="$%.0f"),
+                "現價": st.column_config.NumberColumn(format="$%.2f"),
+                "市值(USD)": st.column_config.NumberColumn(format="$%.0f"),
+                "成本價": st.column_config.NumberColumn(format="$%.2f"),
+                "損益(USD)": st.column_config.NumberColumn(format="$%.0f"),
+                "報酬率(%)": st.column_config.NumberColumn(format="%.1f%%"),
+                "完成率(%)": st.column_config.NumberColumn(format="%.0f%%")
+            })
+        if d_totals['缺價代碼']:
+            st.caption(f"⚠️ 缺少現價: {', '.join(d_totals['缺價代碼'])}")
+
 # 側邊欄底部資訊
 st.sidebar.divider()
-live_rate = get_exchange_rate("USD", "TWD")
+live_rate = get_local_exchange_rate(st.session_state.data_folder)
 if live_rate:
-    st.sidebar.info(f"**即時匯率:** 1 USD = {live_rate:.2f} TWD")
+    st.sidebar.info(f"**最新匯率:** 1 USD = {live_rate:.2f} TWD")
 else:
-    st.sidebar.info(f"**匯率參考:** 1 USD = {USD_RATE} TWD")
\ No newline at end of file
+    st.sidebar.info(f"**匯率參考:** 1 USD = {USD_RATE} TWD")
+
+# 執行時間：本次重新執行，以及此伺服器行程第一次產生頁面（冷啟動，含各模組首次匯入）
+@st.cache_resource
+def get_cold_start_timer():
+    return {'started': SCRIPT_STARTED, 'first_render_ms': None}
+
+render_ms = (time.perf_counter() - SCRIPT_STARTED) * 1000
+cold_start = get_cold_start_timer()
+if cold_start['first_render_ms'] is None:
+    cold_start['first_render_ms'] = (time.perf_counter() - cold_start['started']) * 1000
+st.sidebar.caption(f"⏱️ 頁面產生 {render_ms:,.0f} ms（冷啟動 {cold_start['first_render_ms']:,.0f} ms）")
\ No newline at end of file
@@ -0,0 +1,161 @@
+"""行情資料：以單次批次請求取得多檔股票/加密貨幣報價，並於資料夾快取每日收盤價歷史"""
+import importlib
+import importlib.util
+import os
+
+import numpy as np
+import pandas as pd
+
+import portfolio_core
+
+# yfinance 匯入要一秒以上，只先確認是否安裝，第一次連網時才載入
+YFINANCE_AVAILABLE = importlib.util.find_spec('yfinance') is not None
+
+PRICE_HISTORY_FILE = 'price_history.csv'
+
+# 加密貨幣代碼轉換 (BTC -> BTC-USD)
+CRYPTO_MAP = {'BTC': 'BTC-USD', 'ETH': 'ETH-USD', 'SOL': 'SOL-USD',
+              'XRP': 'XRP-USD', 'ADA': 'ADA-USD', 'DOGE': 'DOGE-USD'}
+
+
+def yfinance():
+    """延遲載入的 yfinance 模組"""
+    return importlib.import_module('yfinance')
+
+
+def to_yf_symbol(ticker):
+    """轉換為 Yahoo Finance 代碼"""
+    return CRYPTO_MAP.get(str(ticker).upper(), str(ticker).upper())
+
+
+def _close_frame(data, symbols):
+    """從 yf.download 結果取出收盤價表（欄位為 Yahoo 代碼）"""
+    if data is None or data.empty:
+        return pd.DataFrame()
+    close = data['Close']
+    if isinstance(close, pd.Series):
+        close = close.to_frame(name=symbols[0])
+    return close
+
+
+def fetch_quotes(tickers):
+    """一次批次下載所有代碼最近收盤/最新價，回傳 {代碼: 價格}"""
+    tickers = sorted({str(t).upper() for t in tickers if isinstance(t, str) and t.strip()})
+    if not YFINANCE_AVAILABLE or not tickers:
+        return {}
+
+    symbols = {to_yf_symbol(t): t for t in tickers}
+    try:
+        data = yfinance().download(list(symbols), period='5d', progress=False, auto_adjust=False, threads=True)
+    except Exception:
+        return {}
+
+    close = _close_frame(data, list(symbols))
+    if close.empty:
+        return {}
+    last = close.ffill().iloc[-1]
+    return {symbols[sym]: float(price) for sym, price in last.items()
+            if sym in symbols and pd.notna(price) and price > 0}
+
+
+def quotes_to_array(quotes, tickers):
+    """依代碼順序轉為 NumPy 陣列，缺價為 NaN"""
+    return np.array([quotes.get(str(t).upper(), np.nan) for t in tickers], dtype=float)
+
+
+def fetch_history(tickers, start, end=None):
+    """一次批次下載多檔每日收盤價，回傳 日期 × 代碼 的表格"""
+    tickers = sorted({str(t).upper() for t in tickers if isinstance(t, str) and t.strip()})
+    if not YFINANCE_AVAILABLE or not tickers:
+        return pd.DataFrame()
+
+    symbols = {to_yf_symbol(t): t for t in tickers}
+    end = pd.Timestamp(end) if end is not None else pd.Timestamp.now().normalize() + pd.Timedelta(days=1)
+    try:
+        data = yfinance().download(list(symbols), start=pd.Timestamp(start).strftime('%Y-%m-%d'),
+                           end=end.strftime('%Y-%m-%d'), progress=False, auto_adjust=False, threads=True)
+    except Exception:
+        return pd.DataFrame()
+
+    close = _close_frame(data, list(symbols))
+    if close.empty:
+        return close
+    close = close.rename(columns=symbols)
+    close.index = pd.to_datetime(close.index).tz_localize(None).normalize()
+    close.index.name = '日期'
+    return close.sort_index()
+
+
+def close_on(history, tickers, dates):
+    """向量化查詢每列代碼在指定日期（或之前最近交易日）的收盤價"""
+    tickers = pd.Series(tickers).astype(str).str.upper().to_numpy()
+    dates = pd.to_datetime(pd.Series(dates)).dt.normalize().to_numpy()
+    prices = np.full(len(tickers), np.nan)
+    if history is None or history.empty or not len(tickers):
+        return prices
+
+    filled = history.ffill()
+    row_idx = filled.index.get_indexer(dates, method='ffill')
+    col_idx = filled.columns.get_indexer(tickers)
+    valid = (row_idx >= 0) & (col_idx >= 0)
+    prices[valid] = filled.to_numpy(dtype=float)[row_idx[valid], col_idx[valid]]
+    return prices
+
+
+def load_price_history(folder_path):
+    """讀取本地收盤價歷史（日期 × 代碼）"""
+    file_path = os.path.join(folder_path, PRICE_HISTORY_FILE) if folder_path else None
+    if file_path and os.path.exists(file_path):
+        try:
+            history = pd.read_csv(file_path, encoding='utf-8-sig', index_col='日期', parse_dates=['日期'])
+            return history.sort_index()
+        except Exception:
+            pass
+    return pd.DataFrame()
+
+
+def save_price_history(folder_path, history):
+    """寫回本地收盤價歷史；資料夾不可寫入時直接略過"""
+    if not folder_path or not os.path.isdir(folder_path) or history.empty:
+        return False
+    try:
+        portfolio_core.atomic_write_csv(history, os.path.join(folder_path, PRICE_HISTORY_FILE), date_format='%Y-%m-%d')
+        return True
+    except Exception:
+        return False
+
+
+def update_price_history(folder_path, tickers, start):
+    """補齊本地快取：新代碼或起始日更早時從 start 下載，其餘只補最近缺少的日期，合併成一次請求"""
+    history = load_price_history(folder_path)
+    tickers = sorted({str(t).upper() for t in tickers if isinstance(t, str) and t.strip()})
+    if not tickers:
+        return history
+
+    start = pd.Timestamp(start).normalize()
+    today = pd.Timestamp.now().normalize()
+    fetch_from = []
+    for ticker in tickers:
+        series = history[ticker].dropna() if ticker in history.columns else pd.Series(dtype=float)
+        if series.empty or series.index.min() > start + pd.Timedelta(days=7):
+            fetch_from.append(start)
+        elif series.index.max() < today - pd.Timedelta(days=1):
+            fetch_from.append(series.index.max() + pd.Timedelta(days=1))
+    if not fetch_from:
+        return history
+
+    fetched = fetch_history(tickers, min(fetch_from))
+    if fetched.empty:
+        return history
+    history = fetched.combine_first(history) if not history.empty else fetched
+    history.index.name = '日期'
+    save_price_history(folder_path, history)
+    return history
+
+
+def monthly_returns(history):
+    """由每日收盤價計算月報酬率（以每月最後一個交易日收盤）"""
+    if history is None or history.empty:
+        return pd.DataFrame()
+    month_end = history.groupby(history.index.to_period('M')).last()
+    return month_end.pct_change(fill_method=None).iloc[1:]
@@ -0,0 +1,127 @@
+"""蒙地卡羅模擬：以歷史月報酬模擬目前持股加上每月定期投入的未來資產分佈"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+PERCENTILES = [5, 25, 50, 75, 95]
+CHUNK_PATHS = 10000
+
+
+def target_weights(df_plan, df_allocation, df_conservative, df_lottery):
+    """各標的目標權重 = 投資類型佔計畫比例 × 類型內比重"""
+    if df_plan is None or df_plan.empty:
+        return pd.Series(dtype=float)
+    category_total = df_plan.groupby('投資類型')['預計投入(USD)'].sum()
+    if category_total.sum() <= 0:
+        return pd.Series(dtype=float)
+    category_share = category_total / category_total.sum()
+
+    weights = []
+    for category, table in [('進攻型', df_allocation), ('保守型', df_conservative), ('樂透型', df_lottery)]:
+        if category not in category_share or table is None or table.empty:
+            continue
+        ticker_weight = pd.to_numeric(table['比重'], errors='coerce').fillna(0)
+        if ticker_weight.sum() <= 0:
+            continue
+        share = category_share[category] * ticker_weight / ticker_weight.sum()
+        weights.append(pd.Series(share.to_numpy(), index=table['股票代碼'].astype(str).str.upper()))
+    if not weights:
+        return pd.Series(dtype=float)
+    return pd.concat(weights).groupby(level=0).sum()
+
+
+def average_monthly_contribution(df_plan, months=12):
+    """最近 N 個月計畫投入的月平均"""
+    if df_plan is None or df_plan.empty:
+        return 0.0
+    plan = df_plan.copy()
+    plan['月份'] = pd.to_datetime(plan['時間'], errors='coerce').dt.to_period('M')
+    monthly = plan.groupby('月份')['預計投入(USD)'].sum().sort_index().tail(months)
+    return float(monthly.mean()) if not monthly.empty else 0.0
+
+
+def _simulate_chunk(args):
+    """模擬一批路徑，回傳每月總值 (paths × months+1)"""
+    seed, n_paths, start_values, contributions, mean, cov, months = args
+    rng = np.random.default_rng(seed)
+    n_assets = len(start_values)
+
+    # 以月對數報酬的多元常態抽樣，保留標的間相關性
+    chol = np.linalg.cholesky(cov + np.eye(n_assets) * 1e-12)
+    shocks = rng.standard_normal((months, n_paths, n_assets)) @ chol.T + mean
+    growth = np.exp(shocks)
+
+    values = np.broadcast_to(start_values, (n_paths, n_assets)).copy()
+    totals = np.empty((n_paths, months + 1))
+    totals[:, 0] = values.sum(axis=1)
+    for m in range(months):
+        values = (values + contributions) * growth[m]
+        totals[:, m + 1] = values.sum(axis=1)
+    return totals
+
+
+def simulate(start_values, contributions, returns, months, n_paths=10000, seed=None, workers=None):
+    """執行模擬；workers > 1 時分批交給 process pool
+
+    start_values / contributions: 以標的為索引的 Series（USD）
+    returns: 歷史月報酬 DataFrame（欄位為標的）
+    """
+    tickers = list(start_values.index.union(contributions.index))
+    start = start_values.reindex(tickers).fillna(0).to_numpy(dtype=float)
+    contrib = contributions.reindex(tickers).fillna(0).to_numpy(dtype=float)
+
+    # 沒有歷史報酬的標的視為現金（報酬 0、與其他標的無相關）
+    log_returns = np.log1p(returns.reindex(columns=tickers)).astype(float)
+    mean = log_returns.mean().fillna(0).to_numpy()
+    cov = log_returns.cov().reindex(index=tickers, columns=tickers).fillna(0).to_numpy()
+
+    chunks = [CHUNK_PATHS] * (n_paths // CHUNK_PATHS)
+    if n_paths % CHUNK_PATHS:
+        chunks.append(n_paths % CHUNK_PATHS)
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    jobs = [(s, n, start, contrib, mean, cov, months) for s, n in zip(seeds, chunks)]
+
+    if workers and workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_simulate_chunk, jobs))
+    else:
+        results = [_simulate_chunk(job) for job in jobs]
+    return np.vstack(results)
+
+
+def percentile_bands(totals):
+    """每月的百分位數帶，回傳 DataFrame（列為月份、欄位為百分位）"""
+    bands = np.percentile(totals, PERCENTILES, axis=0).T
+    return pd.DataFrame(bands, columns=[f'P{p}' for p in PERCENTILES]).rename_axis('月份')
+
+
+def max_drawdowns(totals, monthly_contribution=0.0):
+    """每條路徑的最大回撤（0 ~ 1）
+
+    以扣除每月投入後的累積報酬計算，新投入的資金不會掩蓋市場下跌
+    """
+    invested = totals[:, :-1] + monthly_contribution
+    monthly_growth = np.divide(totals[:, 1:], invested, out=np.ones_like(invested), where=invested > 0)
+    wealth = np.concatenate([np.ones((len(totals), 1)), np.cumprod(monthly_growth, axis=1)], axis=1)
+    running_max = np.maximum.accumulate(wealth, axis=1)
+    drawdown = 1 - wealth / running_max
+    return drawdown.max(axis=1)
+
+
+def summarize(totals, contributions_total):
+    """期末資產與最大回撤的分佈摘要"""
+    final = totals[:, -1]
+    invested = totals[0, 0] + contributions_total
+    months = totals.shape[1] - 1
+    dd = max_drawdowns(totals, contributions_total / months if months else 0.0)
+    rows = []
+    for p in PERCENTILES:
+        rows.append({
+            '百分位': f'P{p}',
+            '期末資產(USD)': np.percentile(final, p),
+            '最大回撤': np.percentile(dd, p),
+        })
+    summary = pd.DataFrame(rows)
+    loss_prob = float((final < invested).mean()) if invested > 0 else 0.0
+    return summary, dd, loss_prob
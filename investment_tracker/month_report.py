@@ -0,0 +1,244 @@
+"""月底報表：以無介面核心產生自含的 HTML（可選 PDF），含資金分配圖、恐懼貪婪儀表板、合規提醒、持股與損益表
+
+過去月份以本地收盤價歷史（price_history.csv）取月底價格，當月使用一次批次查詢的即時報價；
+多個組合或月份的報表以 process pool 平行產生。
+
+命令列:
+    python month_report.py <資料夾>... [--month 2026-09 ...] [--out 輸出資料夾] [--pdf] [--workers N]
+"""
+import argparse
+import base64
+import html
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+
+import pandas as pd
+
+import charts
+import market_data
+import multi_portfolio
+import overview
+import portfolio_core
+import sentiment
+
+REPORT_DIR = 'reports'
+STYLE = """
+body { font-family: -apple-system, 'Noto Sans TC', 'Microsoft JhengHei', sans-serif; margin: 32px; color: #1f2937; }
+h1 { margin-bottom: 4px; } .sub { color: #6b7280; margin-top: 0; }
+.metrics { display: flex; flex-wrap: wrap; gap: 12px; margin: 16px 0; }
+.metric { border: 1px solid #e5e7eb; border-radius: 8px; padding: 10px 16px; min-width: 140px; }
+.metric .label { color: #6b7280; font-size: 13px; } .metric .value { font-size: 20px; font-weight: 600; }
+.pos { color: #16a34a; } .neg { color: #dc2626; }
+table { border-collapse: collapse; width: 100%; margin: 8px 0 24px; font-size: 13px; }
+th, td { border-bottom: 1px solid #e5e7eb; padding: 6px 8px; text-align: right; } th { background: #f9fafb; }
+td:first-child, th:first-child { text-align: left; }
+.warning { background: #fef9c3; border-left: 4px solid #eab308; padding: 8px 12px; margin: 6px 0; }
+.error { background: #fee2e2; border-left: 4px solid #dc2626; padding: 8px 12px; margin: 6px 0; }
+"""
+MONEY_COLUMNS = ['預計投入(USD)', '實際買入(USD)', '保證金(USD)', '市值(USD)', '損益(USD)', '持有成本(USD)',
+                 '未實現損益(USD)', '已實現損益(USD)', '選擇權收支(USD)', '股利收入(USD)', '總損益(USD)']
+PRICE_COLUMNS = ['現價', '成本價']
+PERCENT_COLUMNS = ['報酬率(%)', '完成率(%)']
+
+
+def month_end(month):
+    """月份的報表基準日：過去月份為月底，當月為今天"""
+    period = pd.Period(month, 'M')
+    today = pd.Timestamp.now().normalize()
+    return min(period.end_time.normalize(), today)
+
+
+@lru_cache(maxsize=1)
+def _plotly_js():
+    from plotly.offline import get_plotlyjs
+    return get_plotlyjs()
+
+
+@lru_cache(maxsize=64)
+def _figure_html(figure_json):
+    """相同內容的圖表只轉換一次（同一個 worker 連續產生多份報表時共用）"""
+    import plotly.io as pio
+    return pio.from_json(figure_json).to_html(full_html=False, include_plotlyjs=False)
+
+
+@lru_cache(maxsize=64)
+def _figure_png(figure_json):
+    import plotly.io as pio
+    return base64.b64encode(pio.from_json(figure_json).to_image(format='png', scale=2)).decode('ascii')
+
+
+def _figure_block(fig, static=False):
+    figure_json = fig.to_json()
+    if static:
+        return f'<img style="width:100%" src="data:image/png;base64,{_figure_png(figure_json)}">'
+    return _figure_html(figure_json)
+
+
+def _format_table(df):
+    """數字欄位轉成顯示用字串"""
+    out = df.copy()
+    for column in out.columns:
+        if column in MONEY_COLUMNS:
+            out[column] = out[column].map(lambda v: f"${v:,.0f}" if pd.notna(v) else "-")
+        elif column in PRICE_COLUMNS:
+            out[column] = out[column].map(lambda v: f"${v:,.2f}" if pd.notna(v) and v else "-")
+        elif column in PERCENT_COLUMNS:
+            out[column] = out[column].map(lambda v: f"{v:+.1f}%" if pd.notna(v) else "-")
+    return out.to_html(index=False, border=0, escape=True)
+
+
+def _metric(label, value, delta=None):
+    delta_html = ''
+    if delta is not None:
+        delta_html = f' <span class="{"pos" if delta >= 0 else "neg"}">{delta:+.1f}%</span>'
+    return f'<div class="metric"><div class="label">{html.escape(label)}</div><div class="value">{value}{delta_html}</div></div>'
+
+
+def price_snapshot(history, tickers, as_of, live_quotes=None):
+    """報表基準日的價格：當天有即時報價時優先使用，否則取本地收盤價歷史"""
+    prices = market_data.close_on(history, tickers, [as_of] * len(tickers))
+    quotes = {t: float(p) for t, p in zip(tickers, prices) if pd.notna(p)}
+    if live_quotes and as_of >= pd.Timestamp.now().normalize():
+        quotes.update({str(k).upper(): v for k, v in live_quotes.items()})
+    return quotes
+
+
+def build_report(tables, quotes, as_of, title, fear_greed=None, static=False):
+    """產生單一報表的 HTML 字串（static=True 時圖表轉為 PNG，供 PDF 使用）"""
+    as_of = pd.Timestamp(as_of)
+    point_in_time = portfolio_core.tables_as_of(tables, as_of)
+    summary = overview.summarize(point_in_time, quotes, as_of)
+    totals = summary['totals']
+    allocation = summary['allocation']
+
+    parts = [f'<h1>{html.escape(title)}</h1>',
+             f'<p class="sub">基準日 {as_of:%Y-%m-%d}｜產生時間 {datetime.now():%Y-%m-%d %H:%M}</p>',
+             '<div class="metrics">',
+             _metric('📋 總預算', f"${totals['總預算(USD)']:,.0f}"),
+             _metric('💵 總成本', f"${totals['總成本(USD)']:,.0f}"),
+             _metric('💰 總市值', f"${totals['總市值(USD)']:,.0f}"),
+             _metric('📈 總損益', f"${totals['總損益(USD)']:,.0f}", totals['總報酬率(%)']),
+             _metric('🔒 保證金', f"${totals['被壓住保證金(USD)']:,.0f}"),
+             _metric('🎯 執行率', f"{totals['執行率(%)']:.1f}%"),
+             '</div>']
+
+    if fear_greed:
+        gauge = charts.fear_greed_gauge(fear_greed['value'], fear_greed.get('description', ''), fear_greed.get('last_update', ''))
+        parts.append(f'<div style="max-width:420px">{_figure_block(gauge, static)}</div>')
+
+    if summary['compliance']:
+        parts.append('<h2>⚠️ 計畫合規提醒</h2>')
+        parts += [f'<div class="{w["等級"]}"><b>{html.escape(w["項目"])}</b>：{html.escape(w["說明"])}</div>'
+                  for w in summary['compliance']]
+
+    if not allocation.empty:
+        figure = charts.allocation_figure(allocation, point_in_time.get('df_allocation'),
+                                          overview.margin_details(point_in_time.get('df_option'), as_of))
+        parts += ['<h2>📊 資金分配</h2>', _figure_block(figure, static)]
+
+    parts += ['<h2>💹 損益</h2>',
+              _format_table(pd.DataFrame([{
+                  '未實現損益(USD)': totals['未實現損益(USD)'], '已實現損益(USD)': totals['已實現損益(USD)'],
+                  '選擇權收支(USD)': totals['選擇權收支(USD)'], '股利收入(USD)': totals['股利收入(USD)'],
+                  '總損益(USD)': totals['總損益(USD)']}])),
+              _format_table(allocation[['名稱', '類型', '預計投入(USD)', '實際買入(USD)', '市值(USD)',
+                                        '損益(USD)', '報酬率(%)', '完成率(%)']]) if not allocation.empty else '']
+    if not summary['holdings'].empty:
+        parts += ['<h2>📦 持股</h2>', _format_table(summary['holdings'])]
+    if totals['缺價代碼']:
+        parts.append(f'<p class="sub">缺少價格: {html.escape(", ".join(totals["缺價代碼"]))}</p>')
+
+    script = '' if static else f'<script type="text/javascript">{_plotly_js()}</script>'
+    return (f'<!DOCTYPE html><html lang="zh-Hant"><head><meta charset="utf-8"><title>{html.escape(title)}</title>'
+            f'<style>{STYLE}</style>{script}</head><body>{"".join(parts)}</body></html>')
+
+
+def write_pdf(html_text, pdf_path):
+    """以 weasyprint 將靜態版 HTML 轉成 PDF（需另外安裝 weasyprint 與 kaleido）"""
+    try:
+        from weasyprint import HTML
+    except ImportError:
+        raise RuntimeError("產生 PDF 需要安裝 weasyprint 與 kaleido: pip install weasyprint kaleido")
+    HTML(string=html_text).write_pdf(pdf_path)
+
+
+@lru_cache(maxsize=8)
+def _load(folder_path, signature):
+    tables, _ = portfolio_core.read_folder(folder_path)
+    return tables, market_data.load_price_history(folder_path), sentiment.load_history(folder_path)
+
+
+def fear_greed_on(history, as_of):
+    """基準日（或之前最近一天）的恐懼貪婪指數"""
+    return sentiment.latest(history[history['日期'] <= as_of]) if not history.empty else None
+
+
+def _render(job):
+    folder_path, month, out_dir, pdf, live_quotes = job
+    signature = tuple(sorted(portfolio_core.folder_signatures(folder_path).items()))
+    tables, history, fg_history = _load(folder_path, signature)
+    as_of = month_end(month)
+    quotes = price_snapshot(history, overview.quote_tickers(tables), as_of, live_quotes)
+    name = multi_portfolio.portfolio_name(folder_path)
+    title = f"{name} {pd.Period(month, 'M'):%Y年%m月} 投資報表"
+    gauge = fear_greed_on(fg_history, as_of)
+
+    os.makedirs(out_dir, exist_ok=True)
+    base = os.path.join(out_dir, f"report_{name}_{pd.Period(month, 'M'):%Y-%m}")
+    with open(base + '.html', 'w', encoding='utf-8') as f:
+        f.write(build_report(tables, quotes, as_of, title, gauge))
+    paths = [base + '.html']
+    if pdf:
+        write_pdf(build_report(tables, quotes, as_of, title, gauge, static=True), base + '.pdf')
+        paths.append(base + '.pdf')
+    return paths
+
+
+def generate_reports(folders, months, out_dir=None, pdf=False, workers=None, live_quotes=None):
+    """為每個 組合 × 月份 產生報表，回傳輸出檔案路徑 list
+
+    先在主程序為每個資料夾補齊一次價格與恐懼貪婪指數歷史，worker 只讀本地快取，不重複連網。
+    """
+    folders = [f for f in folders if os.path.isdir(f)]
+    months = [str(pd.Period(m, 'M')) for m in months]
+    earliest = min(pd.Period(m, 'M').start_time for m in months) - pd.Timedelta(days=7)
+    current = any(month_end(m) >= pd.Timestamp.now().normalize() for m in months)
+
+    tickers = set()
+    for folder in folders:
+        tables, _ = portfolio_core.read_folder(folder)
+        folder_tickers = overview.quote_tickers(tables)
+        tickers.update(folder_tickers)
+        market_data.update_price_history(folder, folder_tickers, earliest)
+        sentiment.update_history(folder)
+    if current and live_quotes is None:
+        live_quotes = market_data.fetch_quotes(sorted(tickers))
+
+    jobs = [(folder, month, out_dir or os.path.join(folder, REPORT_DIR), pdf, live_quotes)
+            for folder in folders for month in months]
+    if workers and workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            results = list(pool.map(_render, jobs))
+    else:
+        results = [_render(job) for job in jobs]
+    return [path for paths in results for path in paths]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='產生月底投資報表')
+    parser.add_argument('folders', nargs='*', default=[os.path.dirname(os.path.abspath(__file__))])
+    parser.add_argument('--month', nargs='+', default=[datetime.now().strftime('%Y-%m')], help='YYYY-MM，可多個')
+    parser.add_argument('--out', default=None, help='輸出資料夾（預設為各組合資料夾下的 reports/）')
+    parser.add_argument('--pdf', action='store_true', help='同時輸出 PDF')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    try:
+        outputs = generate_reports(args.folders, args.month, args.out, args.pdf, args.workers)
+    except RuntimeError as e:
+        print(e)
+    else:
+        for path in outputs:
+            print(path)
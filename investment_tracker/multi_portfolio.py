@@ -0,0 +1,116 @@
+"""多組合模式：平行載入多個資料夾、共用一次批次報價，各自計算總覽後合併成總表並保留各組合明細
+
+命令列:
+    python multi_portfolio.py <資料夾1> <資料夾2> ...
+"""
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import market_data
+import overview
+import portfolio_core
+
+# 可加總的總計欄位；比率欄位合併後重新計算
+SUM_FIELDS = ['總預算(USD)', '總成本(USD)', '總市值(USD)', '未實現損益(USD)', '已實現損益(USD)',
+              '選擇權收支(USD)', '股利收入(USD)', '總損益(USD)', '被壓住保證金(USD)']
+
+
+def portfolio_name(folder_path):
+    return os.path.basename(os.path.normpath(folder_path)) or folder_path
+
+
+def _load(folder_path):
+    tables, loaded_files = portfolio_core.read_folder(folder_path)
+    return tables, loaded_files
+
+
+def _summarize(args):
+    tables, quotes, as_of = args
+    return overview.summarize(tables, quotes, as_of)
+
+
+def _map(func, items, workers):
+    if workers and workers > 1 and len(items) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(items))) as pool:
+            return list(pool.map(func, items))
+    return [func(item) for item in items]
+
+
+def load_portfolios(folders, workers=None):
+    """平行讀取各資料夾，回傳 {組合名稱: 表格 dict}（找不到資料的資料夾略過）"""
+    folders = [f for f in folders if f and os.path.isdir(f)]
+    loaded = _map(_load, folders, workers)
+    portfolios = {}
+    for folder, (tables, loaded_files) in zip(folders, loaded):
+        if not loaded_files:
+            continue
+        name = portfolio_name(folder)
+        # 資料夾名稱重複時附上上層路徑區分
+        if name in portfolios:
+            name = os.path.join(portfolio_name(os.path.dirname(os.path.normpath(folder))), name)
+        portfolios[name] = tables
+    return portfolios
+
+
+def quote_tickers(portfolios):
+    """所有組合需要的報價代碼聯集"""
+    return sorted({code for tables in portfolios.values() for code in overview.quote_tickers(tables)})
+
+
+def summarize_portfolios(portfolios, quotes, as_of=None, workers=None):
+    """各組合獨立計算總覽（可平行），回傳 {組合名稱: summary}"""
+    names = list(portfolios)
+    results = _map(_summarize, [(portfolios[name], quotes, as_of) for name in names], workers)
+    return dict(zip(names, results))
+
+
+def consolidate(summaries):
+    """合併各組合：總計、各組合總計（供明細切換）、合併配置與持股"""
+    if not summaries:
+        return {'totals': {}, 'by_portfolio': pd.DataFrame(), 'allocation': pd.DataFrame(),
+                'holdings': pd.DataFrame(), 'compliance': pd.DataFrame()}
+
+    by_portfolio = pd.DataFrame({name: {k: s['totals'][k] for k in SUM_FIELDS} for name, s in summaries.items()}).T
+    by_portfolio.index.name = '組合'
+    totals = by_portfolio.sum().to_dict()
+    totals['總報酬率(%)'] = totals['總損益(USD)'] / totals['總成本(USD)'] * 100 if totals['總成本(USD)'] > 0 else 0.0
+    totals['執行率(%)'] = (totals['總成本(USD)'] + totals['被壓住保證金(USD)']) / totals['總預算(USD)'] * 100 \
+        if totals['總預算(USD)'] > 0 else 0.0
+    by_portfolio['總報酬率(%)'] = (by_portfolio['總損益(USD)'] / by_portfolio['總成本(USD)'].where(by_portfolio['總成本(USD)'] > 0) * 100).fillna(0)
+    by_portfolio['市值佔比'] = by_portfolio['總市值(USD)'] / totals['總市值(USD)'] if totals['總市值(USD)'] > 0 else 0.0
+
+    allocation = pd.concat([s['allocation'].assign(組合=name) for name, s in summaries.items()], ignore_index=True)
+    holdings_parts = [s['holdings'].assign(組合=name) for name, s in summaries.items() if not s['holdings'].empty]
+    holdings = pd.concat(holdings_parts, ignore_index=True) if holdings_parts else pd.DataFrame(
+        columns=['所屬分類', '股票代碼', '持有股數', '現價', '市值(USD)', '持有成本(USD)', '組合'])
+    # 同分類同代碼跨組合合併
+    merged = holdings.groupby(['所屬分類', '股票代碼'], as_index=False).agg({
+        '持有股數': 'sum', '現價': 'first', '市值(USD)': 'sum', '持有成本(USD)': 'sum', '組合': lambda s: ', '.join(sorted(set(s)))
+    }) if not holdings.empty else holdings
+    compliance = pd.DataFrame([{**w, '組合': name} for name, s in summaries.items() for w in s['compliance']],
+                              columns=['組合', '等級', '項目', '說明'])
+    return {'totals': totals, 'by_portfolio': by_portfolio.reset_index(), 'allocation': allocation,
+            'holdings': merged, 'holdings_detail': holdings, 'compliance': compliance}
+
+
+def run(folders, as_of=None, workers=None, quotes=None):
+    """載入 → 單次批次報價 → 各組合計算 → 合併，回傳 (各組合 summary, 合併結果)"""
+    workers = workers if workers is not None else os.cpu_count()
+    portfolios = load_portfolios(folders, workers)
+    if quotes is None:
+        quotes = market_data.fetch_quotes(quote_tickers(portfolios))
+    summaries = summarize_portfolios(portfolios, quotes, as_of, workers)
+    return summaries, consolidate(summaries)
+
+
+if __name__ == '__main__':
+    summaries, combined = run(sys.argv[1:])
+    if not summaries:
+        print("沒有可載入的組合")
+    else:
+        print(combined['by_portfolio'][['組合', '總成本(USD)', '總市值(USD)', '總損益(USD)', '總報酬率(%)']].to_string(index=False))
+        t = combined['totals']
+        print(f"合計: 成本 ${t['總成本(USD)']:,.0f} | 市值 ${t['總市值(USD)']:,.0f} | 損益 ${t['總損益(USD)']:,.0f} ({t['總報酬率(%)']:+.1f}%)")
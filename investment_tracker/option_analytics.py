@@ -0,0 +1,145 @@
+"""選擇權分析：以 NumPy 向量化計算所有未到期部位的 Black-Scholes Greeks 與隱含波動率"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import market_data
+
+RISK_FREE_RATE = 0.04
+DEFAULT_VOLATILITY = 0.40
+CONTRACT_MULTIPLIER = 100
+IV_BOUNDS = (0.01, 5.0)
+
+
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / np.sqrt(2 * np.pi)
+
+
+def norm_cdf(x):
+    """標準常態累積分配（Abramowitz-Stegun 7.1.26，誤差 < 1.5e-7）"""
+    x = np.asarray(x, dtype=float)
+    z = np.abs(x) / np.sqrt(2)
+    t = 1.0 / (1.0 + 0.3275911 * z)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1.0 - poly * np.exp(-z * z)
+    return 0.5 * (1.0 + np.sign(x) * erf)
+
+
+def _d1_d2(spot, strike, t, vol, rate):
+    sqrt_t = np.sqrt(t)
+    d1 = (np.log(spot / strike) + (rate + 0.5 * vol * vol) * t) / (vol * sqrt_t)
+    return d1, d1 - vol * sqrt_t
+
+
+def bs_price(spot, strike, t, vol, is_call, rate=RISK_FREE_RATE):
+    """Black-Scholes 理論價（每股）"""
+    d1, d2 = _d1_d2(spot, strike, t, vol, rate)
+    discount = np.exp(-rate * t)
+    call = spot * norm_cdf(d1) - strike * discount * norm_cdf(d2)
+    put = strike * discount * norm_cdf(-d2) - spot * norm_cdf(-d1)
+    return np.where(is_call, call, put)
+
+
+def bs_greeks(spot, strike, t, vol, is_call, rate=RISK_FREE_RATE):
+    """回傳每股 delta、gamma、theta（每日）、vega（每 1% 波動率）"""
+    d1, d2 = _d1_d2(spot, strike, t, vol, rate)
+    sqrt_t = np.sqrt(t)
+    pdf_d1 = norm_pdf(d1)
+    discount = np.exp(-rate * t)
+
+    delta = np.where(is_call, norm_cdf(d1), norm_cdf(d1) - 1.0)
+    gamma = pdf_d1 / (spot * vol * sqrt_t)
+    decay = -spot * pdf_d1 * vol / (2 * sqrt_t)
+    theta = np.where(is_call,
+                     decay - rate * strike * discount * norm_cdf(d2),
+                     decay + rate * strike * discount * norm_cdf(-d2)) / 365.0
+    vega = spot * pdf_d1 * sqrt_t / 100.0
+    return delta, gamma, theta, vega
+
+
+def implied_volatility(price, spot, strike, t, is_call, rate=RISK_FREE_RATE, iterations=60):
+    """整批反推隱含波動率（向量化二分法，權利金低於內含價值時回傳 NaN）"""
+    price = np.asarray(price, dtype=float)
+    low = np.full(price.shape, IV_BOUNDS[0])
+    high = np.full(price.shape, IV_BOUNDS[1])
+
+    price_low = bs_price(spot, strike, t, low, is_call, rate)
+    price_high = bs_price(spot, strike, t, high, is_call, rate)
+    solvable = (price >= price_low) & (price <= price_high)
+
+    for _ in range(iterations):
+        mid = 0.5 * (low + high)
+        too_high = bs_price(spot, strike, t, mid, is_call, rate) > price
+        high = np.where(too_high, mid, high)
+        low = np.where(too_high, low, mid)
+
+    return np.where(solvable, 0.5 * (low + high), np.nan)
+
+
+def open_positions(df_option, as_of=None):
+    """篩選未到期部位並整理成數值欄位"""
+    columns = ['標的', '履約價', '到期日', '買賣權', '買賣方向', '口數', '權利金', '資金來源']
+    if df_option is None or df_option.empty or not set(columns[:7]).issubset(df_option.columns):
+        return pd.DataFrame(columns=columns)
+
+    positions = df_option.copy()
+    positions['到期日'] = pd.to_datetime(positions['到期日'], errors='coerce')
+    today = pd.Timestamp(as_of or datetime.now().date())
+    positions = positions[positions['到期日'] >= today]
+    if '資金來源' not in positions.columns:
+        positions['資金來源'] = ''
+    positions['資金來源'] = positions['資金來源'].fillna('').astype(str).str.upper().replace('', '(未指定)')
+    positions['標的'] = positions['標的'].astype(str).str.upper()
+    for col in ['履約價', '口數', '權利金']:
+        positions[col] = pd.to_numeric(positions[col], errors='coerce').fillna(0)
+    return positions[positions['口數'] != 0].reset_index(drop=True)
+
+
+def compute_position_greeks(df_option, quotes, as_of=None, volatility=None, rate=RISK_FREE_RATE):
+    """對所有未到期部位一次計算 Greeks 與部位曝險（已乘上口數、合約乘數與買賣方向）"""
+    positions = open_positions(df_option, as_of)
+    if positions.empty:
+        return positions
+
+    today = pd.Timestamp(as_of or datetime.now().date())
+    spot = market_data.quotes_to_array(quotes, positions['標的'])
+    strike = positions['履約價'].to_numpy(dtype=float)
+    # 到期當日仍保留半天時間價值，避免除以 0
+    t = np.maximum((positions['到期日'] - today).dt.days.to_numpy(dtype=float), 0.5) / 365.0
+    is_call = positions['買賣權'].astype(str).str.contains('Call|買權', regex=True).to_numpy()
+    sign = np.where(positions['買賣方向'] == '賣出', -1.0, 1.0)
+    quantity = positions['口數'].abs().to_numpy(dtype=float) * CONTRACT_MULTIPLIER * sign
+
+    valid = (spot > 0) & (strike > 0)
+    spot_safe = np.where(valid, spot, 1.0)
+    strike_safe = np.where(valid, strike, 1.0)
+
+    iv = implied_volatility(positions['權利金'].to_numpy(dtype=float), spot_safe, strike_safe, t, is_call, rate)
+    # 未指定波動率時使用權利金反推的 IV，反推失敗者用預設值
+    if volatility is None:
+        vol = np.where(np.isnan(iv), DEFAULT_VOLATILITY, iv)
+    else:
+        vol = np.full(t.shape, float(volatility))
+    delta, gamma, theta, vega = bs_greeks(spot_safe, strike_safe, t, vol, is_call, rate)
+    theo = bs_price(spot_safe, strike_safe, t, vol, is_call, rate)
+
+    result = positions.copy()
+    result['現價'] = spot
+    result['剩餘天數'] = np.round(t * 365).astype(int)
+    result['隱含波動率'] = np.where(valid, iv, np.nan)
+    result['理論價'] = np.where(valid, theo, np.nan)
+    result['Delta'] = np.where(valid, delta * quantity, np.nan)
+    result['Gamma'] = np.where(valid, gamma * quantity, np.nan)
+    result['Theta'] = np.where(valid, theta * quantity, np.nan)
+    result['Vega'] = np.where(valid, vega * quantity, np.nan)
+    result['Delta曝險(USD)'] = result['Delta'] * spot
+    return result
+
+
+def aggregate_exposure(greeks, by):
+    """依標的或資金來源彙總 Greeks 曝險"""
+    value_cols = ['口數', 'Delta', 'Gamma', 'Theta', 'Vega', 'Delta曝險(USD)']
+    if greeks.empty:
+        return pd.DataFrame(columns=[by] + value_cols)
+    return greeks.groupby(by)[value_cols].sum(min_count=1).reset_index()
@@ -0,0 +1,183 @@
+"""選擇權到期處理：每日批次將到期/平倉部位移入封存表，被指派或履約時產生對應股票交易
+
+命令列（可排程每日執行一次）:
+    python option_expiry.py <資料夾路徑>
+"""
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import market_data
+import portfolio_core
+import snapshots
+
+CONTRACT_MULTIPLIER = 100
+CONTRACT_KEY = ['標的', '履約價', '到期日', '買賣權']
+
+
+def _contract_groups(df_option):
+    """依合約（標的/履約價/到期日/買賣權）計算淨口數"""
+    opts = df_option.copy()
+    opts['到期日'] = pd.to_datetime(opts['到期日'], errors='coerce')
+    opts['標的'] = opts['標的'].astype(str).str.upper()
+    opts['履約價'] = pd.to_numeric(opts['履約價'], errors='coerce').fillna(0)
+    contracts = pd.to_numeric(opts['口數'], errors='coerce').fillna(0).abs()
+    opts['_淨口數'] = np.where(opts['買賣方向'] == '賣出', -contracts, contracts)
+    opts['_合約'] = opts.groupby(CONTRACT_KEY, dropna=False).ngroup()
+    return opts
+
+
+def pending_expiries(df_option, as_of=None):
+    """列出今日可處理的部位數（已過到期日或已完全平倉）"""
+    if df_option is None or df_option.empty or not set(CONTRACT_KEY).issubset(df_option.columns):
+        return 0
+    opts = _contract_groups(df_option)
+    today = pd.Timestamp(as_of or datetime.now().date())
+    net = opts.groupby('_合約')['_淨口數'].transform('sum')
+    return int(((opts['到期日'] < today) | (net == 0)).sum())
+
+
+def _stock_category(df_stock, tickers):
+    """被指派股票沿用該代碼最近一筆交易的分類，沒有則歸入進攻型"""
+    if df_stock is None or df_stock.empty:
+        return pd.Series('進攻型', index=tickers.index)
+    latest = df_stock.assign(_代碼=df_stock['股票代碼'].astype(str).str.upper()).groupby('_代碼')['所屬分類'].last()
+    return tickers.map(latest).fillna('進攻型')
+
+
+def process_expiries(df_option, df_stock, df_archive=None, price_history=None, as_of=None):
+    """批次處理到期與平倉部位
+
+    回傳 (新的 df_option, 新的 df_stock, 新的 df_archive, 摘要 dict)
+    """
+    summary = {'到期失效': 0, '被指派': 0, '已履約': 0, '已平倉': 0, '釋放保證金': 0.0, '新增股票交易': 0, '缺少結算價': []}
+    if df_archive is None or df_archive.empty:
+        df_archive = pd.DataFrame(columns=portfolio_core.OPTION_ARCHIVE_COLUMNS)
+    if df_option is None or df_option.empty or not set(CONTRACT_KEY).issubset(df_option.columns):
+        return df_option, df_stock, df_archive, summary
+
+    today = pd.Timestamp(as_of or datetime.now().date())
+    opts = _contract_groups(df_option)
+    groups = opts.groupby('_合約').agg(
+        標的=('標的', 'first'), 履約價=('履約價', 'first'), 到期日=('到期日', 'first'),
+        買賣權=('買賣權', 'first'), 淨口數=('_淨口數', 'sum'))
+    expired = groups['到期日'] < today
+    closed = groups['淨口數'] == 0
+    groups = groups[expired | closed]
+    if groups.empty:
+        return df_option, df_stock, df_archive, summary
+
+    # 以到期日收盤價判斷是否價內；已到期但缺結算價的合約留在 df_option 待下次處理，不可當成到期失效
+    settle = market_data.close_on(price_history, groups['標的'], groups['到期日'])
+    unsettled = np.isnan(settle) & (groups['淨口數'] != 0).to_numpy()
+    if unsettled.any():
+        missing = groups[unsettled]
+        summary['缺少結算價'] = (missing['標的'] + ' ' + missing['到期日'].dt.strftime('%Y-%m-%d') + ' '
+                              + missing['履約價'].map('{:g}'.format) + ' ' + missing['買賣權'].astype(str)).tolist()
+        groups, settle = groups[~unsettled], settle[~unsettled]
+        if groups.empty:
+            return df_option, df_stock, df_archive, summary
+    is_call = groups['買賣權'].astype(str).str.contains('Call|買權', regex=True).to_numpy()
+    strike = groups['履約價'].to_numpy(dtype=float)
+    in_the_money = np.where(is_call, settle > strike, settle < strike)
+    net = groups['淨口數'].to_numpy(dtype=float)
+
+    status = np.select(
+        [net == 0, in_the_money & (net < 0), in_the_money & (net > 0)],
+        ['已平倉', '被指派', '已履約'], default='到期失效')
+    groups['處理狀態'] = status
+    groups['結算價'] = settle
+
+    # 被指派/履約的合約轉為股票交易：買權多方或賣權空方買進股票，其餘賣出
+    exercised = groups[np.isin(status, ['被指派', '已履約'])]
+    if not exercised.empty:
+        ex_call = exercised['買賣權'].astype(str).str.contains('Call|買權', regex=True)
+        is_buy = ex_call == (exercised['淨口數'] > 0)
+        shares = exercised['淨口數'].abs() * CONTRACT_MULTIPLIER
+        new_trades = pd.DataFrame({
+            '交易日期': exercised['到期日'].dt.strftime('%Y-%m-%d'),
+            '交易類型': np.where(is_buy, '買進', '賣出'),
+            '所屬分類': _stock_category(df_stock, exercised['標的']),
+            '股票代碼': exercised['標的'],
+            '股數': np.where(is_buy, shares, -shares),
+            '成交價格(USD)': exercised['履約價'],
+            '手續費(USD)': 0.0,
+            '交易稅(USD)': 0.0,
+            '用途說明': np.where(exercised['處理狀態'] == '被指派', '選擇權被指派', '選擇權履約'),
+            '備註': (exercised['標的'] + ' ' + exercised['到期日'].dt.strftime('%Y-%m-%d') + ' '
+                     + exercised['履約價'].map('{:g}'.format) + ' ' + exercised['買賣權'].astype(str))
+        })
+        base = df_stock if df_stock is not None and not df_stock.empty else pd.DataFrame(columns=portfolio_core.STOCK_COLUMNS)
+        df_stock = pd.concat([base, new_trades], ignore_index=True)
+        summary['新增股票交易'] = len(new_trades)
+
+    # 移入封存表並釋放保證金
+    done = opts['_合約'].isin(groups.index)
+    archived = df_option[done.to_numpy()].copy()
+    group_ids = opts.loc[done, '_合約'].to_numpy()
+    archived['處理狀態'] = groups.loc[group_ids, '處理狀態'].to_numpy()
+    archived['處理日期'] = today.strftime('%Y-%m-%d')
+    archived['結算價'] = groups.loc[group_ids, '結算價'].to_numpy()
+    margin = pd.to_numeric(archived.get('保證金(USD)', 0), errors='coerce')
+    archived['釋放保證金(USD)'] = np.where(archived['買賣方向'] == '賣出', margin.fillna(0), 0.0)
+
+    df_archive = pd.concat([df_archive, archived], ignore_index=True) if not df_archive.empty else archived.reset_index(drop=True)
+    df_option = df_option[~done.to_numpy()].reset_index(drop=True)
+
+    counts = pd.Series(groups['處理狀態']).value_counts()
+    for key in ['到期失效', '被指派', '已履約', '已平倉']:
+        summary[key] = int(counts.get(key, 0))
+    summary['釋放保證金'] = float(archived['釋放保證金(USD)'].sum())
+    return df_option, df_stock, df_archive, summary
+
+
+def expiry_price_history(df_option, as_of=None):
+    """一次下載所有已到期標的在到期日附近的收盤價"""
+    if df_option is None or df_option.empty:
+        return pd.DataFrame()
+    expiries = pd.to_datetime(df_option['到期日'], errors='coerce')
+    today = pd.Timestamp(as_of or datetime.now().date())
+    expired = df_option[expiries < today]
+    if expired.empty:
+        return pd.DataFrame()
+    start = expiries[expiries < today].min() - pd.Timedelta(days=7)
+    return market_data.fetch_history(expired['標的'].astype(str).unique(), start, today)
+
+
+def run_daily(folder_path, as_of=None):
+    """讀取資料夾、處理到期部位並寫回（每日排程入口）"""
+    tables, _, versions = portfolio_core.load_folder(folder_path)
+    base_tables = dict(tables)
+    df_option = tables.get('df_option')
+    if df_option is None or df_option.empty:
+        return None
+
+    history = expiry_price_history(df_option, as_of)
+    df_option, df_stock, df_archive, summary = process_expiries(
+        df_option, tables.get('df_stock'), tables.get('df_option_archive'), history, as_of)
+    if sum(summary[k] for k in ['到期失效', '被指派', '已履約', '已平倉']) == 0:
+        return summary
+
+    tables.update({'df_option': df_option, 'df_stock': df_stock, 'df_option_archive': df_archive})
+    # 全部部位皆已處理時仍要寫入空表，以免舊檔殘留
+    # 帶版本儲存：處理期間若網頁端剛好寫入，交易帳本會依列合併
+    _, _, conflicts, _ = portfolio_core.save_folder(folder_path, tables, base_tables, versions,
+                                                    allow_empty=('df_option',))
+    summary['衝突檔案'] = len(conflicts)
+    snapshots.create_snapshot(folder_path, message='選擇權到期處理')
+    return summary
+
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.abspath(__file__))
+    result = run_daily(folder)
+    if result is None:
+        print("沒有選擇權資料")
+    else:
+        missing = result.pop('缺少結算價', [])
+        print(" | ".join(f"{k}: {v:,.0f}" if isinstance(v, float) else f"{k}: {v}" for k, v in result.items()))
+        if missing:
+            print(f"缺少結算價，暫不處理: {', '.join(missing)}")
@@ -0,0 +1,232 @@
+"""投資總覽計算：與總覽頁相同的資金配置、損益與計畫合規檢查（不依賴 Streamlit，供 API、報表與多組合使用）"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import corporate_actions
+import portfolio_core
+
+CATEGORIES = ['保守型', '進攻型', '樂透型']
+ALLOCATION_TABLES = {'進攻型': 'df_allocation', '保守型': 'df_conservative', '樂透型': 'df_lottery'}
+ALLOCATION_COLUMNS = ['名稱', '類型', '預計投入(USD)', '實際買入(USD)', '保證金(USD)', '持有股數', '現價',
+                      '市值(USD)', '成本價', '損益(USD)', '報酬率(%)', '完成率(%)']
+
+
+def check_monthly_conservative_plan(df_plan, as_of=None, start='2026-01'):
+    """檢查從 2026/1 開始每個月是否有保守型投資計畫，回傳缺少的月份"""
+    if df_plan is None or df_plan.empty:
+        return []
+    months = pd.to_datetime(df_plan.loc[df_plan['投資類型'] == '保守型', '時間'], errors='coerce').dt.to_period('M')
+    if months.empty:
+        return []
+    expected = pd.period_range(pd.Period(start, 'M'), pd.Period(as_of or datetime.now(), 'M'), freq='M')
+    return [p.strftime('%Y年%m月') for p in expected if p not in set(months.dropna())]
+
+
+def check_conservative_monthly_limit(df_plan, minimum=300):
+    """檢查保守型每月投資是否低於下限"""
+    if df_plan is None or df_plan.empty:
+        return []
+    conservative = df_plan[df_plan['投資類型'] == '保守型']
+    if conservative.empty:
+        return []
+    month = pd.to_datetime(conservative['時間'], errors='coerce').dt.to_period('M')
+    monthly_sum = pd.to_numeric(conservative['預計投入(USD)'], errors='coerce').fillna(0).groupby(month).sum()
+    return [{'month': m.strftime('%Y年%m月'), 'amount': amount, 'minimum': minimum}
+            for m, amount in monthly_sum.items() if amount < minimum]
+
+
+def check_lottery_ratio(df_plan, max_ratio=10):
+    """檢查樂透型是否超過總投資金額的比例上限"""
+    if df_plan is None or df_plan.empty:
+        return None
+    amounts = pd.to_numeric(df_plan['預計投入(USD)'], errors='coerce').fillna(0)
+    total_investment = amounts.sum()
+    if total_investment == 0:
+        return None
+    lottery_amount = amounts[df_plan['投資類型'] == '樂透型'].sum()
+    lottery_ratio = lottery_amount / total_investment * 100
+    if lottery_ratio > max_ratio:
+        return {'ratio': lottery_ratio, 'amount': lottery_amount, 'total': total_investment, 'max_ratio': max_ratio}
+    return None
+
+
+def compliance_warnings(df_plan, as_of=None, minimum=300, max_ratio=10):
+    """計畫合規檢查結果，回傳 [{'等級', '項目', '說明'}]"""
+    warnings = []
+    missing = check_monthly_conservative_plan(df_plan, as_of)
+    if missing:
+        warnings.append({'等級': 'warning', '項目': '保守型月度計畫', '說明': "缺少的月份: " + ", ".join(missing)})
+    for item in check_conservative_monthly_limit(df_plan, minimum):
+        warnings.append({'等級': 'warning', '項目': '保守型投資不足',
+                         '說明': f"{item['month']}: ${item['amount']:.0f} (下限: ${item['minimum']})"})
+    lottery = check_lottery_ratio(df_plan, max_ratio)
+    if lottery:
+        warnings.append({'等級': 'error', '項目': '樂透型投資超額',
+                         '說明': f"目前佔比 {lottery['ratio']:.1f}% (上限: {lottery['max_ratio']}%)，"
+                                 f"樂透型金額: ${lottery['amount']:,.0f} / 總投資金額: ${lottery['total']:,.0f}"})
+    return warnings
+
+
+def sell_proceeds(df_stock, category=None):
+    """各代碼賣出收入（賣出金額 - 手續費 - 交易稅）"""
+    if df_stock is None or df_stock.empty:
+        return pd.Series(dtype=float)
+    ledger = df_stock[df_stock['交易類型'] == '賣出']
+    if category:
+        ledger = ledger[ledger['所屬分類'] == category]
+    if ledger.empty:
+        return pd.Series(dtype=float)
+    shares = pd.to_numeric(ledger['股數'], errors='coerce').fillna(0).abs()
+    price = pd.to_numeric(ledger['成交價格(USD)'], errors='coerce').fillna(0)
+    fee = pd.to_numeric(ledger['手續費(USD)'], errors='coerce').fillna(0).clip(lower=0)
+    tax = pd.to_numeric(ledger.get('交易稅(USD)', 0), errors='coerce').fillna(0).clip(lower=0)
+    return (shares * price - fee - tax).groupby(ledger['股票代碼'].astype(str).str.upper()).sum()
+
+
+def quote_tickers(tables):
+    """計算總覽所需報價的代碼（交易記錄 + 各配置表），供單次批次查詢"""
+    codes = set()
+    for key in ['df_stock', 'df_allocation', 'df_conservative', 'df_lottery']:
+        df = tables.get(key)
+        if df is not None and not df.empty and '股票代碼' in df.columns:
+            codes.update(df['股票代碼'].dropna().astype(str).str.upper())
+    return sorted(c for c in codes if c.strip())
+
+
+def allocation_rows(tables, quotes, as_of=None):
+    """總覽長條圖的每一列：預計投入、實際買入、保證金與目前市值"""
+    df_plan = tables.get('df_plan')
+    df_stock = tables.get('df_stock')
+    if df_plan is None or df_plan.empty:
+        return pd.DataFrame(columns=ALLOCATION_COLUMNS)
+
+    planned_total = pd.to_numeric(df_plan['預計投入(USD)'], errors='coerce').fillna(0).groupby(df_plan['投資類型']).sum()
+    holdings = portfolio_core.net_holdings(df_stock, by=('所屬分類', '股票代碼'))
+    margin = portfolio_core.active_margin(tables.get('df_option'), as_of)
+
+    rows = []
+    for category, planned in planned_total.items():
+        allocation = tables.get(ALLOCATION_TABLES.get(category, ''))
+        cost = portfolio_core.buy_cost(df_stock, category)
+        held = holdings[category] if category in holdings.index.get_level_values(0) else pd.Series(dtype=float)
+        if allocation is not None and not allocation.empty:
+            codes = allocation['股票代碼'].astype(str).str.upper().to_numpy()
+            weight = pd.to_numeric(allocation['比重'], errors='coerce').fillna(0).to_numpy()
+            for code, w in zip(codes, weight):
+                actual = float(cost.get(code, 0.0))
+                shares = float(held.get(code, 0.0))
+                # 已全部賣出的股票不列入
+                if actual > 0 and shares <= 0:
+                    continue
+                rows.append([code, category, planned * w / 100, actual,
+                             float(margin.get(code, 0.0)) if category == '進攻型' else 0.0, shares, code])
+        elif category != '進攻型':
+            # 沒有配置時顯示整體
+            rows.append([category, category, planned, float(cost.sum()), 0.0, float(held.sum()), None])
+
+    result = pd.DataFrame(rows, columns=['名稱', '類型', '預計投入(USD)', '實際買入(USD)', '保證金(USD)', '持有股數', '_代碼'])
+    if result.empty:
+        return pd.DataFrame(columns=ALLOCATION_COLUMNS)
+    quotes = {str(k).upper(): v for k, v in (quotes or {}).items()}
+    result['現價'] = result['_代碼'].map(quotes).astype(float)
+
+    # 未配置的分類：市值為該分類所有持股的市值
+    market = result['持有股數'] * result['現價']
+    for i in np.flatnonzero(result['_代碼'].isna().to_numpy()):
+        category = result.at[i, '類型']
+        held = holdings[category] if category in holdings.index.get_level_values(0) else pd.Series(dtype=float)
+        market.iat[i] = float((held * held.index.map(quotes).astype(float)).sum()) if not held.empty else 0.0
+    result['市值(USD)'] = market.fillna(0.0)
+
+    result['成本價'] = np.where(result['持有股數'] > 0, result['實際買入(USD)'] / result['持有股數'].where(result['持有股數'] > 0, 1), 0.0)
+    has_value = (result['實際買入(USD)'] > 0) & (result['市值(USD)'] > 0)
+    result['損益(USD)'] = np.where(has_value, result['市值(USD)'] - result['實際買入(USD)'], 0.0)
+    result['報酬率(%)'] = np.where(has_value, result['損益(USD)'] / result['實際買入(USD)'].where(has_value, 1) * 100, 0.0)
+    result['完成率(%)'] = np.where(result['預計投入(USD)'] > 0,
+                                 result['實際買入(USD)'] / result['預計投入(USD)'].where(result['預計投入(USD)'] > 0, 1) * 100, 0.0)
+    return result[ALLOCATION_COLUMNS]
+
+
+def margin_details(df_option, as_of=None):
+    """各資金來源被壓住的保證金明細 {代碼: [(標的, 保證金), ...]}"""
+    if df_option is None or df_option.empty or not {'保證金(USD)', '資金來源', '到期日', '買賣方向', '標的'}.issubset(df_option.columns):
+        return {}
+    today = pd.Timestamp(as_of or datetime.now().date())
+    expiry = pd.to_datetime(df_option['到期日'], errors='coerce')
+    active = df_option[(expiry >= today) & (df_option['買賣方向'] == '賣出')]
+    source = active['資金來源'].fillna('').astype(str).str.upper()
+    margin = pd.to_numeric(active['保證金(USD)'], errors='coerce').fillna(0)
+    details = {}
+    for code, ticker, amount in zip(source, active['標的'], margin):
+        details.setdefault(code, []).append((ticker, float(amount)))
+    return details
+
+
+def option_income(tables):
+    """選擇權收支合計（未到期部位 + 已封存的到期部位）"""
+    total = 0.0
+    for key in ['df_option', 'df_option_archive']:
+        df = tables.get(key)
+        if df is None or df.empty:
+            continue
+        for column in ['收支金額(USD)', '總成本(USD)']:
+            if column in df.columns:
+                total += float(pd.to_numeric(df[column], errors='coerce').fillna(0).sum())
+                break
+    return total
+
+
+def summarize(tables, quotes, as_of=None):
+    """總覽頁的完整計算結果
+
+    回傳 dict：allocation（長條圖各列）、holdings（分類 × 代碼持股）、totals（總計數字）、
+    compliance（合規警示）、dividends（股利事件）
+    """
+    df_stock = tables.get('df_stock')
+    df_actions = tables.get('df_actions')
+    if df_stock is not None and not df_stock.empty and df_actions is not None and not df_actions.empty:
+        df_stock = corporate_actions.apply_splits(df_stock, df_actions)
+        dividends = corporate_actions.dividend_events(df_stock, df_actions)
+    else:
+        dividends = pd.DataFrame(columns=['日期', '所屬分類', '股票代碼', '持有股數', '每股股利(USD)', '股利收入(USD)'])
+    tables = {**tables, 'df_stock': df_stock}
+
+    allocation = allocation_rows(tables, quotes, as_of)
+    holdings = portfolio_core.holdings_snapshot(df_stock, {str(k).upper(): v for k, v in (quotes or {}).items()})
+
+    total_planned = float(allocation['預計投入(USD)'].sum())
+    held_cost = float(allocation['實際買入(USD)'].sum())
+    all_buy = float(sum(portfolio_core.buy_cost(df_stock, c).sum() for c in CATEGORIES))
+    total_sell = float(sell_proceeds(df_stock).sum())
+    market_value = float(allocation['市值(USD)'].sum())
+    margin = float(portfolio_core.active_margin(tables.get('df_option'), as_of).sum())
+    opt_total = option_income(tables)
+    dividend_total = float(dividends['股利收入(USD)'].sum()) if not dividends.empty else 0.0
+
+    unrealized = market_value - held_cost
+    realized = total_sell - (all_buy - held_cost)
+    total_profit = unrealized + realized + opt_total + dividend_total
+    totals = {
+        '總預算(USD)': total_planned,
+        '總成本(USD)': held_cost,
+        '總市值(USD)': market_value,
+        '未實現損益(USD)': unrealized,
+        '已實現損益(USD)': realized,
+        '選擇權收支(USD)': opt_total,
+        '股利收入(USD)': dividend_total,
+        '總損益(USD)': total_profit,
+        '總報酬率(%)': total_profit / held_cost * 100 if held_cost > 0 else 0.0,
+        '被壓住保證金(USD)': margin,
+        '執行率(%)': (held_cost + margin) / total_planned * 100 if total_planned > 0 else 0.0,
+        '缺價代碼': sorted(holdings.loc[holdings['現價'].isna(), '股票代碼'].unique().tolist()) if not holdings.empty else [],
+    }
+    return {
+        'as_of': pd.Timestamp(as_of or datetime.now()).strftime('%Y-%m-%d'),
+        'allocation': allocation,
+        'holdings': holdings,
+        'totals': totals,
+        'compliance': compliance_warnings(tables.get('df_plan'), as_of),
+        'dividends': dividends,
+    }
@@ -0,0 +1,481 @@
+"""投資組合資料核心：CSV 檔案對應與資料夾讀寫（不依賴 Streamlit，可供排程/命令列使用）"""
+import hashlib
+import io
+import os
+import stat
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# 檔案名稱對應
+FILE_MAPPING = {
+    'investment_plan.csv': 'df_plan',
+    'aggressive_allocation.csv': 'df_allocation',
+    'conservative_allocation.csv': 'df_conservative',
+    'lottery_allocation.csv': 'df_lottery',
+    'stock_transactions.csv': 'df_stock',
+    'options_transactions.csv': 'df_option',
+    'options_archive.csv': 'df_option_archive',
+    'corporate_actions.csv': 'df_actions'
+}
+
+# 多個工作階段共用同一資料夾時的寫入鎖
+LOCK_FILE = '.portfolio.lock'
+LOCK_TIMEOUT = 10.0
+# 交易帳本為逐列累加，衝突時可依列合併；其餘設定表衝突時拒絕寫入
+MERGEABLE_TABLES = ('df_stock', 'df_option', 'df_option_archive', 'df_actions')
+
+STOCK_COLUMNS = ['交易日期', '交易類型', '所屬分類', '股票代碼', '股數', '成交價格(USD)', '手續費(USD)', '交易稅(USD)', '用途說明', '備註']
+OPTION_COLUMNS = ['交易日期', '商品類型', '標的', '履約價', '到期日', '買賣權', '買賣方向', '口數', '權利金', '交易金額(USD)', '手續費(USD)', '保證金(USD)', '總成本(USD)', '資金來源', '策略說明']
+OPTION_ARCHIVE_COLUMNS = OPTION_COLUMNS + ['處理狀態', '處理日期', '結算價', '釋放保證金(USD)']
+
+
+def data_version(df):
+    """表格內容的版本雜湊，內容不變時版本不變（供快取鍵使用）"""
+    if df is None or df.empty:
+        return 'empty'
+    digest = hashlib.sha1('|'.join(map(str, df.columns)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def file_version(file_path):
+    """檔案內容的版本雜湊；檔案不存在時為 None"""
+    try:
+        with open(file_path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()[:16]
+    except OSError:
+        return None
+
+
+def folder_versions(folder_path):
+    """資料夾內各對應檔案的目前版本 {檔名: 版本}"""
+    return {filename: file_version(os.path.join(folder_path, filename)) for filename in FILE_MAPPING}
+
+
+def load_folder(folder_path):
+    """讀取資料夾，回傳 (表格 dict, 已載入檔名 list, 讀取當下的檔案版本 dict)
+
+    版本與內容取自同一份位元組，儲存時可用來判斷檔案是否已被其他工作階段改寫
+    """
+    tables = {}
+    loaded_files = []
+    versions = {}
+    if not os.path.isdir(folder_path):
+        return tables, loaded_files, versions
+
+    for filename, state_key in FILE_MAPPING.items():
+        file_path = os.path.join(folder_path, filename)
+        try:
+            with open(file_path, 'rb') as f:
+                raw = f.read()
+        except OSError:
+            versions[filename] = None
+            continue
+        versions[filename] = hashlib.sha1(raw).hexdigest()[:16]
+        try:
+            tables[state_key] = pd.read_csv(io.BytesIO(raw), encoding='utf-8-sig')
+            loaded_files.append(filename)
+        except Exception:
+            pass
+    return tables, loaded_files, versions
+
+
+def read_folder(folder_path):
+    """讀取資料夾內所有對應的 CSV，回傳 (表格 dict, 已載入檔名 list)"""
+    tables, loaded_files, _ = load_folder(folder_path)
+    return tables, loaded_files
+
+
+def folder_signatures(folder_path, filenames=None):
+    """各對應檔案（或指定檔案）的 (mtime_ns, 大小)，只做 stat 不讀內容，用於快速偵測變更"""
+    signatures = {}
+    for filename in filenames if filenames is not None else FILE_MAPPING:
+        try:
+            stat = os.stat(os.path.join(folder_path, filename))
+            signatures[filename] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            signatures[filename] = None
+    return signatures
+
+
+def reload_changed(folder_path, versions, signatures=None):
+    """只重新讀取內容有變的檔案
+
+    先比對 mtime + 大小，有差異的檔案再比對內容雜湊（僅 touch 或內容相同時不重新解析）。
+    回傳 (變更的表格 dict, 已刪除的表格 list, 新的檔案版本, 新的檔案簽章)
+    """
+    versions = dict(versions or {})
+    new_signatures = folder_signatures(folder_path)
+    changed, removed = {}, []
+    for filename, state_key in FILE_MAPPING.items():
+        if signatures is not None and new_signatures[filename] == signatures.get(filename):
+            continue
+        file_path = os.path.join(folder_path, filename)
+        try:
+            with open(file_path, 'rb') as f:
+                raw = f.read()
+        except OSError:
+            if versions.get(filename) is not None:
+                removed.append(state_key)
+            versions[filename] = None
+            continue
+        version = hashlib.sha1(raw).hexdigest()[:16]
+        if version == versions.get(filename):
+            continue
+        try:
+            changed[state_key] = pd.read_csv(io.BytesIO(raw), encoding='utf-8-sig')
+            versions[filename] = version
+        except Exception:
+            # 讀到其他程式寫到一半的檔案時保留舊版本，下次再試
+            new_signatures[filename] = None
+    return changed, removed, versions, new_signatures
+
+
+class FolderWatcher:
+    """輕量背景執行緒：定期 stat 資料夾檔案並保存最新簽章
+
+    多個工作階段可共用同一個 watcher，各自以 changed_since() 與自己記錄的簽章比對
+    """
+
+    def __init__(self, folder_path, interval=2.0, filenames=None):
+        self.folder_path = folder_path
+        self.interval = interval
+        self.filenames = filenames
+        self._signatures = folder_signatures(folder_path, filenames)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'FolderWatcher({folder_path})', daemon=True)
+
+    def start(self):
+        if not self._thread.is_alive():
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not os.path.isdir(self.folder_path):
+                continue
+            current = folder_signatures(self.folder_path, self.filenames)
+            with self._lock:
+                self._signatures = current
+
+    def changed_since(self, signatures):
+        """與呼叫端記錄的簽章相比有變動的檔名"""
+        with self._lock:
+            current = self._signatures
+        signatures = signatures or {}
+        return [f for f in current if current[f] != signatures.get(f)]
+
+
+@contextmanager
+def folder_lock(folder_path, timeout=LOCK_TIMEOUT):
+    """資料夾層級的互斥鎖（跨行程），逾時拋出 TimeoutError"""
+    handle = open(os.path.join(folder_path, LOCK_FILE), 'a+b')
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                if sys.platform == 'win32':
+                    import msvcrt
+                    handle.seek(0)
+                    msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+                else:
+                    import fcntl
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"資料夾正被其他工作階段寫入: {folder_path}")
+                time.sleep(0.05)
+        yield
+    finally:
+        try:
+            if sys.platform == 'win32':
+                import msvcrt
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+        except OSError:
+            pass
+        handle.close()
+
+
+# 行程的 umask（讀取時須暫時改寫，故只在載入時讀一次）
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def replace_file(tmp_path, file_path):
+    """以暫存檔取代目標檔；mkstemp 的暫存檔權限為 0600，先改成原檔權限（新檔依 umask），儲存不會收緊檔案權限"""
+    try:
+        mode = stat.S_IMODE(os.stat(file_path).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    os.chmod(tmp_path, mode)
+    os.replace(tmp_path, file_path)
+
+
+def atomic_write_csv(df, file_path, **kwargs):
+    """先寫入同資料夾的暫存檔再以 os.replace 取代，讀取端不會看到寫到一半的檔案"""
+    folder = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.' + os.path.basename(file_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8-sig', newline='') as f:
+            df.to_csv(f, **kwargs)
+            f.flush()
+            os.fsync(f.fileno())
+        replace_file(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _row_keys(df, columns):
+    """每列的內容雜湊（數值欄位統一成浮點數，避免 10 與 10.0 被視為不同列）"""
+    normalized = df.reindex(columns=columns).copy()
+    for col in columns:
+        numeric = pd.to_numeric(normalized[col], errors='coerce')
+        if numeric.notna().sum() == normalized[col].notna().sum():
+            normalized[col] = numeric.astype(float)
+    return pd.util.hash_pandas_object(normalized.astype(str), index=False).to_numpy()
+
+
+def merge_rows(base, mine, theirs):
+    """三方列合併：以磁碟上的最新版本為準，套用本工作階段相對於載入時的新增與刪除
+
+    base: 本工作階段載入時的表格；mine: 本工作階段目前的表格；theirs: 磁碟上的最新表格
+    """
+    columns = list(dict.fromkeys(list(theirs.columns) + list(mine.columns)))
+    base_keys = _row_keys(base, columns) if base is not None else np.array([], dtype=np.uint64)
+    mine_keys = _row_keys(mine, columns)
+    theirs_keys = _row_keys(theirs, columns)
+
+    removed = Counter(base_keys) - Counter(mine_keys)
+    added = Counter(mine_keys) - Counter(base_keys)
+
+    keep = np.ones(len(theirs), dtype=bool)
+    for i, key in enumerate(theirs_keys):
+        if removed[key] > 0:
+            removed[key] -= 1
+            keep[i] = False
+    take = np.zeros(len(mine), dtype=bool)
+    for i, key in enumerate(mine_keys):
+        if added[key] > 0:
+            added[key] -= 1
+            take[i] = True
+    parts = [df for df in (theirs[keep].reindex(columns=columns), mine[take].reindex(columns=columns)) if not df.empty]
+    return pd.concat(parts, ignore_index=True) if parts else theirs.reindex(columns=columns).iloc[0:0]
+
+
+def write_folder(folder_path, tables, allow_empty=()):
+    """將非空表格寫回資料夾，回傳已儲存檔名 list
+
+    allow_empty 中的表格即使為空也會寫入（例如選擇權全部封存後需清空原檔）
+    """
+    saved_files, _, _, _ = save_folder(folder_path, tables, allow_empty=allow_empty)
+    return saved_files
+
+
+def save_folder(folder_path, tables, base_tables=None, base_versions=None, allow_empty=()):
+    """在資料夾鎖內以原子方式寫回表格，並做樂觀版本檢查
+
+    base_versions 為載入時的檔案版本（load_folder 的第三個回傳值）；省略時不檢查、直接覆寫。
+    磁碟檔案在載入後被其他工作階段改寫時：
+      - 本工作階段未修改該表 → 保留磁碟版本
+      - 交易帳本（MERGEABLE_TABLES）且有 base_tables → 依列三方合併後寫入
+      - 其他 → 拒絕寫入並列入衝突
+    回傳 (已儲存檔名, 已合併檔名, 衝突檔名, 寫入後的檔案版本)
+    """
+    saved_files, merged_files, conflicts = [], [], []
+    base_tables = base_tables or {}
+    with folder_lock(folder_path):
+        current = folder_versions(folder_path)
+        for filename, state_key in FILE_MAPPING.items():
+            df = tables.get(state_key)
+            if df is None or (df.empty and state_key not in allow_empty):
+                continue
+            file_path = os.path.join(folder_path, filename)
+
+            stale = base_versions is not None and current[filename] != base_versions.get(filename)
+            if stale:
+                base = base_tables.get(state_key)
+                if base is not None and data_version(base) == data_version(df):
+                    continue
+                if state_key in MERGEABLE_TABLES and base is not None and current[filename] is not None:
+                    try:
+                        theirs = pd.read_csv(file_path, encoding='utf-8-sig')
+                    except Exception:
+                        conflicts.append(filename)
+                        continue
+                    df = merge_rows(base, df, theirs)
+                    merged_files.append(filename)
+                else:
+                    conflicts.append(filename)
+                    continue
+
+            atomic_write_csv(df, file_path, index=False)
+            saved_files.append(filename)
+        versions = folder_versions(folder_path)
+    return saved_files, merged_files, conflicts, versions
+
+
+def net_holdings(df_stock, by=('股票代碼',)):
+    """向量化計算持有股數（買進為正、賣出為負），僅回傳持股大於 0 者"""
+    by = list(by)
+    if df_stock is None or df_stock.empty:
+        return pd.Series(dtype=float)
+    ledger = df_stock.copy()
+    ledger['股票代碼'] = ledger['股票代碼'].astype(str).str.upper()
+    shares = pd.to_numeric(ledger['股數'], errors='coerce').fillna(0).abs()
+    ledger['_持股變動'] = shares.where(ledger['交易類型'] == '買進', -shares)
+    holdings = ledger.groupby(by)['_持股變動'].sum()
+    return holdings[holdings > 1e-9]
+
+
+def buy_cost(df_stock, category=None):
+    """向量化計算各代碼買進總成本（交易金額 + 手續費）"""
+    if df_stock is None or df_stock.empty:
+        return pd.Series(dtype=float)
+    ledger = df_stock[df_stock['交易類型'] == '買進']
+    if category:
+        ledger = ledger[ledger['所屬分類'] == category]
+    if ledger.empty:
+        return pd.Series(dtype=float)
+    shares = pd.to_numeric(ledger['股數'], errors='coerce').fillna(0).abs()
+    price = pd.to_numeric(ledger['成交價格(USD)'], errors='coerce').fillna(0)
+    fee = pd.to_numeric(ledger['手續費(USD)'], errors='coerce').fillna(0).clip(lower=0)
+    cost = shares * price + fee
+    return cost.groupby(ledger['股票代碼'].astype(str).str.upper()).sum()
+
+
+def planned_by_ticker(df_plan, df_allocation, category='進攻型'):
+    """各代碼預計投入 = 該類型計畫總額 × 配置比重"""
+    if df_plan is None or df_plan.empty or df_allocation is None or df_allocation.empty:
+        return pd.Series(dtype=float)
+    total = pd.to_numeric(df_plan.loc[df_plan['投資類型'] == category, '預計投入(USD)'], errors='coerce').sum()
+    weight = pd.to_numeric(df_allocation['比重'], errors='coerce').fillna(0).to_numpy()
+    codes = df_allocation['股票代碼'].astype(str).str.upper()
+    return pd.Series(total * weight / 100, index=codes).groupby(level=0).sum()
+
+
+def active_margin(df_option, as_of=None):
+    """未到期賣方部位被壓住的保證金，依資金來源（大寫）彙總"""
+    if df_option is None or df_option.empty or not {'保證金(USD)', '資金來源', '到期日', '買賣方向'}.issubset(df_option.columns):
+        return pd.Series(dtype=float)
+    today = pd.Timestamp(as_of or datetime.now().date())
+    expiry = pd.to_datetime(df_option['到期日'], errors='coerce')
+    active = df_option[(expiry >= today) & (df_option['買賣方向'] == '賣出')]
+    if active.empty:
+        return pd.Series(dtype=float)
+    margin = pd.to_numeric(active['保證金(USD)'], errors='coerce').fillna(0)
+    return margin.groupby(active['資金來源'].fillna('').astype(str).str.upper()).sum()
+
+
+def tables_as_of(tables, as_of):
+    """回到指定日期當時的資料狀態：只保留當天以前的記錄，之後才封存的選擇權放回未平倉表"""
+    as_of = pd.Timestamp(as_of).normalize()
+
+    def until(df, column):
+        if df is None or df.empty or column not in df.columns:
+            return df
+        return df[pd.to_datetime(df[column], errors='coerce') <= as_of].reset_index(drop=True)
+
+    result = dict(tables)
+    result['df_plan'] = until(tables.get('df_plan'), '時間')
+    result['df_stock'] = until(tables.get('df_stock'), '交易日期')
+    result['df_actions'] = until(tables.get('df_actions'), '日期')
+    df_option = until(tables.get('df_option'), '交易日期')
+    archive = tables.get('df_option_archive')
+    if archive is not None and not archive.empty:
+        archive = until(archive, '交易日期')
+        processed = pd.to_datetime(archive['處理日期'], errors='coerce')
+        reopened = archive.loc[processed > as_of, [c for c in OPTION_COLUMNS if c in archive.columns]]
+        if not reopened.empty:
+            df_option = pd.concat([df_option, reopened], ignore_index=True) if df_option is not None else reopened
+        result['df_option_archive'] = archive[processed <= as_of].reset_index(drop=True)
+    result['df_option'] = df_option
+    return result
+
+
+def holdings_snapshot(df_stock, quotes):
+    """依 分類 × 代碼 彙總持股、現價、市值與持有成本（成本按持有比例攤提）"""
+    columns = ['所屬分類', '股票代碼', '持有股數', '現價', '市值(USD)', '持有成本(USD)']
+    if df_stock is None or df_stock.empty:
+        return pd.DataFrame(columns=columns)
+
+    ledger = df_stock.copy()
+    ledger['股票代碼'] = ledger['股票代碼'].astype(str).str.upper()
+    shares = pd.to_numeric(ledger['股數'], errors='coerce').fillna(0).abs()
+    price = pd.to_numeric(ledger['成交價格(USD)'], errors='coerce').fillna(0)
+    fee = pd.to_numeric(ledger['手續費(USD)'], errors='coerce').fillna(0).clip(lower=0)
+    is_buy = ledger['交易類型'] == '買進'
+    ledger['_持股變動'] = np.where(is_buy, shares, -shares)
+    ledger['_買入股數'] = np.where(is_buy, shares, 0.0)
+    ledger['_買入成本'] = np.where(is_buy, shares * price + fee, 0.0)
+
+    grouped = ledger.groupby(['所屬分類', '股票代碼'])[['_持股變動', '_買入股數', '_買入成本']].sum().reset_index()
+    grouped = grouped[grouped['_持股變動'] > 1e-9]
+    if grouped.empty:
+        return pd.DataFrame(columns=columns)
+
+    held_ratio = (grouped['_持股變動'] / grouped['_買入股數'].replace(0, np.nan)).fillna(0).clip(upper=1)
+    snapshot = pd.DataFrame({
+        '所屬分類': grouped['所屬分類'],
+        '股票代碼': grouped['股票代碼'],
+        '持有股數': grouped['_持股變動'],
+        '現價': grouped['股票代碼'].map(quotes).astype(float),
+        '持有成本(USD)': grouped['_買入成本'] * held_ratio,
+    })
+    snapshot['市值(USD)'] = snapshot['持有股數'] * snapshot['現價']
+    return snapshot[columns].reset_index(drop=True)
+
+
+def _stress_writer(args):
+    """壓力測試的單一寫入者：每輪 載入 → 新增一筆交易 → 帶版本儲存"""
+    folder_path, writer, rounds = args
+    for r in range(rounds):
+        tables, _, versions = load_folder(folder_path)
+        base = tables.get('df_stock', pd.DataFrame(columns=STOCK_COLUMNS))
+        row = pd.DataFrame([['2024-01-01', '買進', '進攻型', f'W{writer}', r + 1, 1.0, 0.0, 0.0, '', f'{writer}-{r}']],
+                           columns=STOCK_COLUMNS)
+        mine = pd.concat([base, row], ignore_index=True) if not base.empty else row
+        save_folder(folder_path, {'df_stock': mine}, {'df_stock': base}, versions)
+
+
+def stress_test_writes(writers=16, rounds=20, folder_path=None):
+    """多行程同時寫入同一資料夾，回傳 (預期筆數, 實際筆數, 是否完整無重複)"""
+    from concurrent.futures import ProcessPoolExecutor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = folder_path or tmp
+        with ProcessPoolExecutor(max_workers=writers) as pool:
+            list(pool.map(_stress_writer, [(folder, w, rounds) for w in range(writers)]))
+        result = pd.read_csv(os.path.join(folder, 'stock_transactions.csv'), encoding='utf-8-sig')
+    expected = writers * rounds
+    notes = result['備註'].astype(str)
+    return expected, len(result), len(result) == expected and notes.is_unique
+
+
+if __name__ == '__main__':
+    # 寫入壓力測試: python portfolio_core.py --stress [寫入者數] [每人輪數]
+    if len(sys.argv) > 1 and sys.argv[1] == '--stress':
+        n_writers = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+        n_rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+        start = time.perf_counter()
+        expected, actual, ok = stress_test_writes(n_writers, n_rounds)
+        print(f"{n_writers} 個寫入者 × {n_rounds} 輪: 預期 {expected} 筆, 實際 {actual} 筆, "
+              f"{'通過' if ok else '失敗'} ({time.perf_counter() - start:.1f}s)")
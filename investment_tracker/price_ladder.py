@@ -0,0 +1,163 @@
+"""安全邊際五檔價格警示：對所有進攻型標的與檔位一次判斷是否跌破買入價，並記錄警示
+
+命令列（可排程執行，不需開啟網頁）:
+    python price_ladder.py <資料夾路徑>
+"""
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import market_data
+import portfolio_core
+
+LEVELS = 5
+ALERT_LOG_FILE = 'ladder_alerts.csv'
+ALERT_LOG_COLUMNS = ['時間', '股票代碼', '檔位', '邊際價', '現價', '狀態', '應投入(USD)']
+
+
+def ladder_matrix(df_allocation):
+    """回傳 (代碼陣列, 各檔價格矩陣 n×5, 各檔比重矩陣 n×5)；無效檔位為 NaN / 0"""
+    if df_allocation is None or df_allocation.empty:
+        return np.array([], dtype=object), np.empty((0, LEVELS)), np.empty((0, LEVELS))
+
+    alloc = df_allocation.reindex(columns=['股票代碼', '公允值(USD)']
+                                  + [f'邊際{j}(%)' for j in range(1, LEVELS + 1)]
+                                  + [f'邊際{j}比重(%)' for j in range(1, LEVELS + 1)])
+    codes = alloc['股票代碼'].astype(str).str.upper().to_numpy()
+    fair = pd.to_numeric(alloc['公允值(USD)'], errors='coerce').fillna(0).to_numpy()[:, None]
+    pct = alloc[[f'邊際{j}(%)' for j in range(1, LEVELS + 1)]].apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy()
+    weight = alloc[[f'邊際{j}比重(%)' for j in range(1, LEVELS + 1)]].apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy()
+
+    valid = (fair > 0) & (pct > 0) & (weight > 0)
+    prices = np.where(valid, fair * pct / 100, np.nan)
+    weights = np.where(valid, weight, 0.0)
+    return codes, prices, weights
+
+
+def evaluate_ladder(df_allocation, quotes, planned, invested=None):
+    """判斷每個標的跌破的檔位與應投入金額
+
+    planned / invested: 以代碼為索引的 Series（預計投入、已買入成本）
+    回傳每個標的一列的 DataFrame，含各檔價格、是否觸發與待買入金額
+    """
+    codes, prices, weights = ladder_matrix(df_allocation)
+    if not len(codes):
+        return pd.DataFrame()
+
+    spot = market_data.quotes_to_array(quotes, codes)
+    crossed = (spot[:, None] <= prices) & ~np.isnan(prices)
+    planned_amt = pd.Series(planned).reindex(codes).fillna(0).to_numpy()
+    invested_amt = pd.Series(invested if invested is not None else {}, dtype=float).reindex(codes).fillna(0).to_numpy()
+
+    due_weight = np.where(crossed, weights, 0.0).sum(axis=1)
+    due = planned_amt * due_weight / 100
+
+    result = pd.DataFrame({'股票代碼': codes, '現價': spot})
+    for j in range(LEVELS):
+        result[f'檔{j + 1}價格'] = prices[:, j]
+    result['觸發檔數'] = crossed.sum(axis=1)
+    result['預計投入(USD)'] = planned_amt
+    result['應投入(USD)'] = due
+    result['已投入(USD)'] = invested_amt
+    result['待買入(USD)'] = np.clip(due - invested_amt, 0, None)
+    result.attrs['crossed'] = crossed
+    result.attrs['weights'] = weights
+    result.attrs['prices'] = prices
+    return result
+
+
+def level_states(result):
+    """展開成 代碼 × 檔位 的長表，供警示記錄比對"""
+    if result.empty:
+        return pd.DataFrame(columns=['股票代碼', '檔位', '邊際價', '現價', '狀態', '應投入(USD)'])
+    crossed = result.attrs['crossed']
+    prices = result.attrs['prices']
+    weights = result.attrs['weights']
+    n = len(result)
+    states = pd.DataFrame({
+        '股票代碼': np.repeat(result['股票代碼'].to_numpy(), LEVELS),
+        '檔位': np.tile(np.arange(1, LEVELS + 1), n),
+        '邊際價': prices.ravel(),
+        '現價': np.repeat(result['現價'].to_numpy(), LEVELS),
+        '狀態': np.where(crossed.ravel(), '觸發', '解除'),
+        '應投入(USD)': (result['預計投入(USD)'].to_numpy()[:, None] * weights / 100).ravel()
+    })
+    # 缺現價或無效檔位不列入
+    return states[states['邊際價'].notna() & states['現價'].notna()].reset_index(drop=True)
+
+
+def load_alert_log(folder_path):
+    file_path = os.path.join(folder_path, ALERT_LOG_FILE)
+    if os.path.exists(file_path):
+        try:
+            return pd.read_csv(file_path, encoding='utf-8-sig')
+        except Exception:
+            pass
+    return pd.DataFrame(columns=ALERT_LOG_COLUMNS)
+
+
+def _changed_levels(states, log):
+    """與記錄中各檔位的最後狀態比較，回傳狀態改變的列"""
+    last = log.groupby(['股票代碼', '檔位'])['狀態'].last().rename('上次狀態').reset_index() if not log.empty else \
+        pd.DataFrame(columns=['股票代碼', '檔位', '上次狀態'])
+    last['檔位'] = pd.to_numeric(last['檔位'], errors='coerce')
+    merged = states.merge(last, on=['股票代碼', '檔位'], how='left')
+    # 沒有記錄時預設為解除，因此首次觸發才會記錄
+    changed = merged['狀態'] != merged['上次狀態'].fillna('解除')
+    return merged.loc[changed, ['股票代碼', '檔位', '邊際價', '現價', '狀態', '應投入(USD)']].copy()
+
+
+def record_alerts(folder_path, result, now=None, log=None):
+    """只記錄狀態改變的檔位（新觸發或回升解除），回傳新增的記錄
+
+    有資料夾時在資料夾鎖內讀取、比較並寫回記錄檔；沒有資料夾（上傳模式）時只與傳入的 log 比較，不寫檔
+    """
+    states = level_states(result)
+    if states.empty:
+        return states
+    timestamp = (now or datetime.now()).strftime('%Y-%m-%d %H:%M')
+
+    if not folder_path or not os.path.isdir(folder_path):
+        new_rows = _changed_levels(states, log if log is not None else pd.DataFrame(columns=ALERT_LOG_COLUMNS))
+        new_rows.insert(0, '時間', timestamp)
+        return new_rows
+
+    with portfolio_core.folder_lock(folder_path):
+        log = load_alert_log(folder_path)
+        new_rows = _changed_levels(states, log)
+        new_rows.insert(0, '時間', timestamp)
+        if not new_rows.empty:
+            log = pd.concat([log, new_rows], ignore_index=True) if not log.empty else new_rows
+            portfolio_core.atomic_write_csv(log, os.path.join(folder_path, ALERT_LOG_FILE), index=False)
+    return new_rows
+
+
+def run_alerts(folder_path, quotes=None):
+    """讀取資料夾、批次取得現價並評估警示（排程入口）"""
+    tables, _ = portfolio_core.read_folder(folder_path)
+    df_allocation = tables.get('df_allocation')
+    if df_allocation is None or df_allocation.empty:
+        return pd.DataFrame(), pd.DataFrame()
+
+    if quotes is None:
+        quotes = market_data.fetch_quotes(df_allocation['股票代碼'].astype(str))
+    planned = portfolio_core.planned_by_ticker(tables.get('df_plan'), df_allocation)
+    invested = portfolio_core.buy_cost(tables.get('df_stock'), '進攻型')
+    result = evaluate_ladder(df_allocation, quotes, planned, invested)
+    return result, record_alerts(folder_path, result)
+
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.abspath(__file__))
+    result, new_alerts = run_alerts(folder)
+    if result.empty:
+        print("沒有進攻型配置")
+    elif new_alerts.empty:
+        print("沒有新的警示")
+    else:
+        for _, row in new_alerts.iterrows():
+            print(f"[{row['狀態']}] {row['股票代碼']} 第{row['檔位']}檔 ${row['邊際價']:.2f} "
+                  f"(現價 ${row['現價']:.2f}) 應投入 ${row['應投入(USD)']:,.0f}")
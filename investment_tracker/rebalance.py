@@ -0,0 +1,100 @@
+"""再平衡試算：依計畫目標計算買賣單，並以向量化方式一次評估大量價格/投入情境"""
+import numpy as np
+import pandas as pd
+
+import portfolio_core
+import price_ladder
+
+
+def planned_targets(df_plan, df_allocation, df_conservative, df_lottery):
+    """三種投資類型的各代碼預計投入金額"""
+    parts = [portfolio_core.planned_by_ticker(df_plan, table, category)
+             for category, table in [('進攻型', df_allocation), ('保守型', df_conservative), ('樂透型', df_lottery)]]
+    parts = [p for p in parts if not p.empty]
+    if not parts:
+        return pd.Series(dtype=float)
+    return pd.concat(parts).groupby(level=0).sum()
+
+
+def ladder_caps(df_allocation, codes, prices, planned, invested):
+    """在各情境價格下，進攻型標的依已跌破檔位最多可買的金額（S × N，非進攻型為無上限）"""
+    ladder_codes, ladder_prices, ladder_weights = price_ladder.ladder_matrix(df_allocation)
+    caps = np.full(prices.shape, np.inf)
+    if not len(ladder_codes):
+        return caps
+
+    position = {code: i for i, code in enumerate(ladder_codes)}
+    cols = np.array([position.get(code, -1) for code in codes])
+    has_ladder = cols >= 0
+    if not has_ladder.any():
+        return caps
+
+    # (S, N_ladder, 5)：情境價格是否跌破各檔
+    level_prices = ladder_prices[cols[has_ladder]]
+    crossed = prices[:, has_ladder, None] <= level_prices[None, :, :]
+    due_weight = np.where(crossed, ladder_weights[cols[has_ladder]][None, :, :], 0.0).sum(axis=2)
+    planned_amt = planned.reindex(codes[has_ladder]).fillna(0).to_numpy()
+    invested_amt = invested.reindex(codes[has_ladder]).fillna(0).to_numpy()
+    caps[:, has_ladder] = np.clip(planned_amt * due_weight / 100 - invested_amt, 0, None)
+    return caps
+
+
+def solve_orders(weights, shares, prices, cash=0.0, lot_size=None, allow_sell=True, max_buy=None):
+    """向量化求解達到目標權重所需的買賣股數
+
+    weights / shares / lot_size: 長度 N；prices: (S, N) 或 (N,)；cash: 純量或長度 S
+    回傳 (股數 S×N, 金額 S×N)，正數為買進、負數為賣出
+    """
+    prices = np.atleast_2d(np.asarray(prices, dtype=float))
+    n_scenarios = prices.shape[0]
+    cash = np.broadcast_to(np.asarray(cash, dtype=float), (n_scenarios,))
+    weights = np.asarray(weights, dtype=float)
+    weights = weights / weights.sum() if weights.sum() > 0 else weights
+    lot = np.ones_like(weights) if lot_size is None else np.asarray(lot_size, dtype=float)
+
+    value = np.asarray(shares, dtype=float) * prices
+    total = np.nansum(value, axis=1) + cash
+    diff = total[:, None] * weights - value
+
+    if not allow_sell:
+        diff = np.clip(diff, 0, None)
+    if max_buy is not None:
+        diff = np.minimum(diff, max_buy)
+    if not allow_sell:
+        # 只買不賣時以可用現金為上限等比例縮小
+        spend = diff.sum(axis=1)
+        scale = np.where(spend > cash, cash / np.where(spend > 0, spend, 1), 1.0)
+        diff = diff * scale[:, None]
+
+    valid = prices > 0
+    raw = np.where(valid, diff / np.where(valid, prices, 1), 0.0)
+    # 依交易單位取整（往 0 的方向），避免超出現金
+    order_shares = np.trunc(raw / lot) * lot
+    return order_shares, order_shares * np.where(valid, prices, 0.0)
+
+
+def scenario_grid(price_shocks, contributions):
+    """價格變動 × 投入金額 的情境組合，回傳 (shock 陣列, 投入陣列)"""
+    shock, contrib = np.meshgrid(np.asarray(price_shocks, dtype=float), np.asarray(contributions, dtype=float), indexing='ij')
+    return shock.ravel(), contrib.ravel()
+
+
+def evaluate_scenarios(codes, weights, shares, base_prices, price_shocks, contributions, cash=0.0,
+                       lot_size=None, allow_sell=True, caps_fn=None):
+    """一次評估所有情境，回傳每個情境的彙總表與各代碼下單股數"""
+    shock, contrib = scenario_grid(price_shocks, contributions)
+    prices = np.asarray(base_prices, dtype=float)[None, :] * (1 + shock[:, None])
+    available = cash + contrib
+    max_buy = caps_fn(prices) if caps_fn else None
+    order_shares, order_amounts = solve_orders(weights, shares, prices, available, lot_size, allow_sell, max_buy)
+
+    summary = pd.DataFrame({
+        '價格變動': shock,
+        '可用資金(USD)': available,
+        '組合市值(USD)': np.nansum(np.asarray(shares, dtype=float) * prices, axis=1),
+        '買進金額(USD)': np.clip(order_amounts, 0, None).sum(axis=1),
+        '賣出金額(USD)': np.clip(-order_amounts, 0, None).sum(axis=1),
+    })
+    summary['剩餘現金(USD)'] = available - summary['買進金額(USD)'] + summary['賣出金額(USD)']
+    orders = pd.DataFrame(order_shares, columns=list(codes))
+    return summary, orders
@@ -0,0 +1,236 @@
+"""每月彙總（物化）：計畫投入、實際買進、賣出與被壓住的保證金，依 月份 × 分類 × 代碼
+
+每個來源表各自保存一份彙總與「已彙總的列數 + 前段雜湊」；新資料只是往後追加時只彙總新增的列，
+前面的列有修改或刪除時才重算該來源。彙總存於資料夾的 .rollups/，雲端模式只保存在記憶體。
+
+命令列:
+    python rollups.py [資料夾路徑]
+"""
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+import overview
+import portfolio_core
+
+ROLLUP_DIR = '.rollups'
+STATE_FILE = 'state.json'
+KEYS = ['月份', '分類', '代碼']
+MEASURES = ['預計投入(USD)', '買進(USD)', '賣出(USD)', '保證金(USD)']
+# 雲端模式或同一行程內重複呼叫時的記憶體快取 {(資料夾, 來源): (列數, 雜湊, 彙總)}
+_memory = {}
+
+
+def _empty():
+    return pd.DataFrame({**{k: pd.Series(dtype=str) for k in KEYS}, **{m: pd.Series(dtype=float) for m in MEASURES}})
+
+
+def _months(dates):
+    return pd.to_datetime(dates, errors='coerce').dt.strftime('%Y-%m')
+
+
+def _group(frame):
+    """依 月份 × 分類 × 代碼 加總，缺少的量值欄補 0"""
+    frame = frame.dropna(subset=['月份'])
+    if frame.empty:
+        return _empty()
+    grouped = frame.groupby(KEYS, as_index=False, sort=False).sum(numeric_only=True)
+    for measure in MEASURES:
+        if measure not in grouped.columns:
+            grouped[measure] = 0.0
+    return grouped[KEYS + MEASURES]
+
+
+def rollup_plan(df_plan):
+    """計畫投入依月份與投資類型彙總（代碼留空，各代碼依目前配置比重在讀取時分攤）"""
+    if df_plan is None or df_plan.empty:
+        return _empty()
+    return _group(pd.DataFrame({'月份': _months(df_plan['時間']), '分類': df_plan['投資類型'].astype(str), '代碼': '',
+                                '預計投入(USD)': pd.to_numeric(df_plan['預計投入(USD)'], errors='coerce').fillna(0)}))
+
+
+def rollup_stock(df_stock):
+    """買進成本（含手續費）與賣出收入（扣手續費、交易稅），與 buy_cost / sell_proceeds 算法一致"""
+    if df_stock is None or df_stock.empty:
+        return _empty()
+    shares = pd.to_numeric(df_stock['股數'], errors='coerce').fillna(0).abs()
+    price = pd.to_numeric(df_stock['成交價格(USD)'], errors='coerce').fillna(0)
+    fee = pd.to_numeric(df_stock['手續費(USD)'], errors='coerce').fillna(0).clip(lower=0)
+    tax = pd.to_numeric(df_stock.get('交易稅(USD)', 0), errors='coerce').fillna(0).clip(lower=0)
+    is_buy = (df_stock['交易類型'] == '買進').to_numpy()
+    amount = (shares * price).to_numpy()
+    return _group(pd.DataFrame({
+        '月份': _months(df_stock['交易日期']), '分類': df_stock['所屬分類'].astype(str),
+        '代碼': df_stock['股票代碼'].astype(str).str.upper(),
+        '買進(USD)': np.where(is_buy, amount + fee.to_numpy(), 0.0),
+        '賣出(USD)': np.where(is_buy, 0.0, amount - fee.to_numpy() - tax.to_numpy())}))
+
+
+def rollup_margin(df_option):
+    """賣方部位的保證金計入從交易月到到期月的每一個月（依資金來源，歸在進攻型）"""
+    if df_option is None or df_option.empty or not {'保證金(USD)', '資金來源', '到期日', '買賣方向'}.issubset(df_option.columns):
+        return _empty()
+    sold = df_option[df_option['買賣方向'] == '賣出']
+    start = pd.to_datetime(sold['交易日期'], errors='coerce').dt.to_period('M')
+    end = pd.to_datetime(sold['到期日'], errors='coerce').dt.to_period('M')
+    valid = (start.notna() & end.notna()).to_numpy()
+    if not valid.any():
+        return _empty()
+    first = start[valid].map(lambda p: p.ordinal).to_numpy(dtype=np.int64)
+    last = end[valid].map(lambda p: p.ordinal).to_numpy(dtype=np.int64)
+    span = np.maximum(last - first + 1, 1)
+    # 每列展開成所跨的月份數
+    rows = np.repeat(np.arange(len(first)), span)
+    offset = np.arange(len(rows)) - np.repeat(np.cumsum(span) - span, span)
+    months = pd.PeriodIndex.from_ordinals(first[rows] + offset, freq='M').strftime('%Y-%m')
+    margin = pd.to_numeric(sold['保證金(USD)'], errors='coerce').fillna(0).to_numpy()[valid]
+    source = sold['資金來源'].fillna('').astype(str).str.upper().to_numpy()[valid]
+    return _group(pd.DataFrame({'月份': months, '分類': '進攻型', '代碼': source[rows], '保證金(USD)': margin[rows]}))
+
+
+ROLLUPS = {'df_plan': rollup_plan, 'df_stock': rollup_stock,
+           'df_option': rollup_margin, 'df_option_archive': rollup_margin}
+
+
+def _row_hashes(df):
+    if df is None or df.empty:
+        return np.empty(0, dtype=np.uint64)
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def _prefix_digest(df, hashes, n):
+    """前 n 列內容的雜湊（用來判斷新資料是否只是往後追加）"""
+    if df is None or n == 0:
+        return ''
+    return hashlib.sha1('|'.join(map(str, df.columns)).encode('utf-8') + hashes[:n].tobytes()).hexdigest()[:16]
+
+
+def _combine(*parts):
+    parts = [p for p in parts if p is not None and not p.empty]
+    if not parts:
+        return _empty()
+    return _group(pd.concat(parts, ignore_index=True))
+
+
+def _load_state(folder_path):
+    state_path = os.path.join(folder_path, ROLLUP_DIR, STATE_FILE) if folder_path else None
+    if not state_path or not os.path.exists(state_path):
+        return {}
+    try:
+        with open(state_path, encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    loaded = {}
+    for source, (rows, digest) in state.items():
+        try:
+            part = pd.read_csv(os.path.join(folder_path, ROLLUP_DIR, f'{source}.csv'), encoding='utf-8-sig',
+                               dtype={'月份': str, '分類': str, '代碼': str}, keep_default_na=False)
+        except (OSError, ValueError):
+            continue
+        loaded[source] = (rows, digest, part[KEYS + MEASURES])
+    return loaded
+
+
+def _save_state(folder_path, state):
+    """寫回各來源彙總；資料夾不可寫入時直接略過"""
+    if not folder_path or not os.path.isdir(folder_path):
+        return False
+    try:
+        os.makedirs(os.path.join(folder_path, ROLLUP_DIR), exist_ok=True)
+        for source, (_, _, part) in state.items():
+            portfolio_core.atomic_write_csv(part, os.path.join(folder_path, ROLLUP_DIR, f'{source}.csv'), index=False)
+        meta = {source: [rows, digest] for source, (rows, digest, _) in state.items()}
+        with open(os.path.join(folder_path, ROLLUP_DIR, STATE_FILE), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        return True
+    except OSError:
+        return False
+
+
+def update_rollups(tables, folder_path=None):
+    """更新並回傳 (合併後的每月彙總, 各來源處理方式 {來源: '未變'/'追加 n 列'/'重算'})"""
+    cached = {source: _memory[(folder_path, source)] for source in ROLLUPS if (folder_path, source) in _memory}
+    if len(cached) < len(ROLLUPS):
+        cached = {**_load_state(folder_path), **cached}
+
+    state, actions, dirty = {}, {}, False
+    for source, rollup in ROLLUPS.items():
+        df = tables.get(source)
+        rows = 0 if df is None else len(df)
+        hashes = _row_hashes(df)
+        previous = cached.get(source)
+        if previous is not None and previous[0] <= rows and _prefix_digest(df, hashes, previous[0]) == previous[1]:
+            if previous[0] == rows:
+                state[source] = previous
+                actions[source] = '未變'
+                continue
+            # 只彙總新追加的列
+            part = _combine(previous[2], rollup(df.iloc[previous[0]:]))
+            actions[source] = f'追加 {rows - previous[0]} 列'
+        else:
+            part = rollup(df)
+            actions[source] = '重算'
+        state[source] = (rows, _prefix_digest(df, hashes, rows), part)
+        dirty = True
+
+    for source, entry in state.items():
+        _memory[(folder_path, source)] = entry
+    if dirty:
+        _save_state(folder_path, state)
+    return _combine(*(part for _, _, part in state.values())), actions
+
+
+def ticker_plan(monthly, tables):
+    """把分類層級的計畫投入依目前配置比重分攤到各代碼"""
+    plan = monthly[(monthly['代碼'] == '') & (monthly['預計投入(USD)'] != 0)]
+    parts = []
+    for category, table_key in overview.ALLOCATION_TABLES.items():
+        allocation = tables.get(table_key)
+        rows = plan[plan['分類'] == category]
+        if allocation is None or allocation.empty or rows.empty:
+            continue
+        weights = pd.to_numeric(allocation['比重'], errors='coerce').fillna(0).groupby(
+            allocation['股票代碼'].astype(str).str.upper()).sum() / 100
+        spread = rows[['月份', '分類', '預計投入(USD)']].merge(weights.rename('比重').rename_axis('代碼').reset_index(), how='cross')
+        spread['預計投入(USD)'] *= spread['比重']
+        parts.append(spread[['月份', '分類', '代碼', '預計投入(USD)']])
+    return _combine(*parts)
+
+
+def timeline(monthly, tables=None, category=None, ticker=None):
+    """每月與累計的 計畫 / 買進 / 賣出 / 淨投入，以及當月被壓住的保證金
+
+    指定 ticker 時計畫投入依配置比重分攤；未指定時使用分類層級的計畫
+    """
+    if ticker:
+        plan = ticker_plan(monthly, tables or {})
+        rows = pd.concat([monthly[monthly['代碼'] == ticker].assign(**{'預計投入(USD)': 0.0}),
+                          plan[plan['代碼'] == ticker]], ignore_index=True)
+    else:
+        rows = monthly
+    if category:
+        rows = rows[rows['分類'] == category]
+    if rows.empty:
+        return pd.DataFrame(columns=['月份'] + MEASURES + ['淨投入(USD)', '累計計畫(USD)', '累計淨投入(USD)'])
+
+    by_month = rows.groupby('月份')[MEASURES].sum().sort_index()
+    # 補齊中間沒有資料的月份
+    months = pd.period_range(by_month.index.min(), by_month.index.max(), freq='M').strftime('%Y-%m')
+    by_month = by_month.reindex(months, fill_value=0.0)
+    by_month['淨投入(USD)'] = by_month['買進(USD)'] - by_month['賣出(USD)']
+    by_month['累計計畫(USD)'] = by_month['預計投入(USD)'].cumsum()
+    by_month['累計淨投入(USD)'] = by_month['淨投入(USD)'].cumsum()
+    return by_month.rename_axis('月份').reset_index()
+
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.abspath(__file__))
+    tables, _ = portfolio_core.read_folder(folder)
+    monthly, actions = update_rollups(tables, folder)
+    print(", ".join(f"{source}: {action}" for source, action in actions.items()))
+    print(timeline(monthly).tail(12).to_string(index=False))
@@ -0,0 +1,198 @@
+"""市場情緒：CNN 恐懼貪婪指數的本地歷史與背景更新
+
+背景執行緒定期抓取一次並寫入資料夾的 fear_greed_history.csv，頁面只讀取記憶體中的最新值與歷史，
+不在每次重新執行時連網。
+
+命令列（手動更新一次）:
+    python sentiment.py [資料夾路徑]
+"""
+import importlib
+import importlib.util
+import os
+import sys
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+import portfolio_core
+
+# requests（CNN 歷史資料）與 fear_and_greed（僅最新值）都在背景執行緒第一次抓取時才載入
+REQUESTS_AVAILABLE = importlib.util.find_spec('requests') is not None
+FEAR_GREED_AVAILABLE = importlib.util.find_spec('fear_and_greed') is not None
+
+FEAR_GREED_FILE = 'fear_greed_history.csv'
+HISTORY_URL = 'https://production.dataviz.cnn.io/index/fearandgreed/graphdata/{start}'
+HISTORY_START = '2020-09-01'
+REQUEST_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                                 '(KHTML, like Gecko) Chrome/120.0 Safari/537.36'}
+REFRESH_INTERVAL = 3600
+HISTORY_COLUMNS = ['日期', '指數', '描述', '更新時間']
+
+
+def _empty():
+    return pd.DataFrame({'日期': pd.Series(dtype='datetime64[ns]'), '指數': pd.Series(dtype=float),
+                         '描述': pd.Series(dtype=str), '更新時間': pd.Series(dtype=str)})
+
+
+def load_history(folder_path):
+    """讀取本地恐懼貪婪指數歷史（每日一列）"""
+    file_path = os.path.join(folder_path, FEAR_GREED_FILE) if folder_path else None
+    if file_path and os.path.exists(file_path):
+        try:
+            history = pd.read_csv(file_path, encoding='utf-8-sig', keep_default_na=False)
+            history['日期'] = pd.to_datetime(history['日期'])
+            history['指數'] = pd.to_numeric(history['指數'], errors='coerce')
+            return history[HISTORY_COLUMNS].sort_values('日期').reset_index(drop=True)
+        except Exception:
+            pass
+    return _empty()
+
+
+def save_history(folder_path, history):
+    """寫回本地歷史；資料夾不可寫入時（雲端模式）直接略過"""
+    if not folder_path or not os.path.isdir(folder_path) or history.empty:
+        return False
+    try:
+        out = history.copy()
+        out['日期'] = out['日期'].dt.strftime('%Y-%m-%d')
+        portfolio_core.atomic_write_csv(out, os.path.join(folder_path, FEAR_GREED_FILE), index=False)
+        return True
+    except Exception:
+        return False
+
+
+def fetch_history(start=HISTORY_START, timeout=10):
+    """從 CNN 取得 start 之後的每日指數與目前值；失敗時退回 fear_and_greed 的最新值"""
+    rows = []
+    if REQUESTS_AVAILABLE:
+        try:
+            requests = importlib.import_module('requests')
+            response = requests.get(HISTORY_URL.format(start=pd.Timestamp(start).strftime('%Y-%m-%d')),
+                                    headers=REQUEST_HEADERS, timeout=timeout)
+            response.raise_for_status()
+            data = response.json()
+            for point in data.get('fear_and_greed_historical', {}).get('data', []):
+                rows.append({'日期': pd.to_datetime(point['x'], unit='ms'), '指數': float(point['y']),
+                             '描述': point.get('rating', ''), '更新時間': ''})
+            current = data.get('fear_and_greed') or {}
+            if 'score' in current:
+                updated = pd.to_datetime(current.get('timestamp'), errors='coerce', utc=True)
+                rows.append({'日期': updated.tz_convert(None) if pd.notna(updated) else pd.Timestamp.now(),
+                             '指數': float(current['score']), '描述': current.get('rating', ''),
+                             '更新時間': updated.strftime('%Y-%m-%d %H:%M') if pd.notna(updated) else ''})
+        except Exception:
+            rows = []
+    if not rows and FEAR_GREED_AVAILABLE:
+        try:
+            fgi = importlib.import_module('fear_and_greed').get()
+            rows.append({'日期': pd.Timestamp(fgi.last_update).tz_localize(None) if fgi.last_update else pd.Timestamp.now(),
+                         '指數': float(fgi.value), '描述': fgi.description,
+                         '更新時間': fgi.last_update.strftime('%Y-%m-%d %H:%M') if fgi.last_update else ''})
+        except Exception:
+            pass
+    if not rows:
+        return _empty()
+    fetched = pd.DataFrame(rows, columns=HISTORY_COLUMNS)
+    fetched['日期'] = fetched['日期'].dt.normalize()
+    return fetched
+
+
+def merge_history(history, fetched):
+    """合併新抓到的資料，同一天以較新的值為準"""
+    if fetched.empty:
+        return history
+    merged = pd.concat([history, fetched], ignore_index=True) if not history.empty else fetched
+    return merged.drop_duplicates('日期', keep='last').sort_values('日期').reset_index(drop=True)
+
+
+def update_history(folder_path, history=None):
+    """只抓本地最後一天之後的資料並寫回，回傳更新後的歷史"""
+    history = load_history(folder_path) if history is None else history
+    start = history['日期'].max() - pd.Timedelta(days=1) if not history.empty else HISTORY_START
+    merged = merge_history(history, fetch_history(start))
+    if len(merged) != len(history) or not merged.tail(1).equals(history.tail(1)):
+        save_history(folder_path, merged)
+    return merged
+
+
+def latest(history):
+    """最新一筆，格式與儀表板使用的 dict 相同；沒有資料時為 None"""
+    if history is None or history.empty:
+        return None
+    row = history.iloc[-1]
+    return {'value': float(row['指數']), 'description': row['描述'],
+            'last_update': row['更新時間'] or row['日期'].strftime('%Y-%m-%d')}
+
+
+class FearGreedUpdater:
+    """背景執行緒：啟動時先讀本地歷史，之後每 interval 秒更新一次
+
+    頁面呼叫 latest()/history() 只讀記憶體，不會等待網路
+    """
+
+    def __init__(self, folder_path=None, interval=REFRESH_INTERVAL):
+        self.folder_path = folder_path
+        self.interval = interval
+        self._history = load_history(folder_path)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.updated_at = None
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name=f'FearGreedUpdater({folder_path})', daemon=True)
+
+    def start(self):
+        if not self._thread.is_alive():
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def refresh(self):
+        try:
+            history = update_history(self.folder_path, self.history())
+        except Exception as e:
+            self.error = str(e)
+            return
+        with self._lock:
+            self._history = history
+        self.updated_at = datetime.now()
+        self.error = None if not history.empty else '無法取得恐懼貪婪指數'
+
+    def _run(self):
+        self.refresh()
+        while not self._stop.wait(self.interval):
+            self.refresh()
+
+    def history(self):
+        with self._lock:
+            return self._history
+
+    def latest(self):
+        return latest(self.history())
+
+    @property
+    def ready(self):
+        """是否已完成第一次更新（或本地已有資料）"""
+        return self.updated_at is not None or not self.history().empty
+
+
+def contribution_timeline(df_stock):
+    """每日買進金額（投入時點），供與指數對照"""
+    if df_stock is None or df_stock.empty:
+        return pd.Series(dtype=float)
+    buys = df_stock[df_stock['交易類型'] == '買進']
+    amount = pd.to_numeric(buys['股數'], errors='coerce').abs() * pd.to_numeric(buys['成交價格(USD)'], errors='coerce')
+    dates = pd.to_datetime(buys['交易日期'], errors='coerce').dt.normalize()
+    return amount.groupby(dates).sum().sort_index()
+
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.abspath(__file__))
+    history = update_history(folder)
+    current = latest(history)
+    if current is None:
+        print("無法取得恐懼貪婪指數")
+    else:
+        print(f"{len(history)} 筆歷史，最新 {current['value']:.0f}（{current['description']}，{current['last_update']}）")
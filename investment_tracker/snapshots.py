@@ -0,0 +1,342 @@
+"""版本快照：每次儲存建立一份快照，表格以內容雜湊定址共用，交易帳本以列差異儲存，可比較、還原與復原
+
+存放於資料夾下的 .snapshots/：
+    objects/<版本>.csv.gz         完整表格
+    objects/<版本>.delta.json.gz  相對於前一版本的列差異（新增列 + 列順序區段）
+    manifest.jsonl                每次快照一行：時間、說明、各檔案對應的表格版本
+
+命令列:
+    python snapshots.py <資料夾路徑> [list | undo | restore <快照編號>]
+"""
+import gzip
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import pandas as pd
+
+import portfolio_core
+
+SNAPSHOT_DIR = '.snapshots'
+MANIFEST_FILE = 'manifest.jsonl'
+# 以列差異儲存的表格（其餘表格小且常整表修改，直接存完整內容）
+DELTA_TABLES = portfolio_core.MERGEABLE_TABLES
+# 差異鏈過長時改存完整表格，避免還原時逐層套用太多次
+MAX_CHAIN = 200
+# 最近寫入/讀取的表格原文，連續儲存時不必重建差異鏈
+_recent = {}
+
+
+def _store(folder_path, *parts):
+    return os.path.join(folder_path, SNAPSHOT_DIR, *parts)
+
+
+def _write_bytes(file_path, data):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        portfolio_core.replace_file(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def canonical_csv(df):
+    """字串表格的 CSV 文字（與 pandas 寫回資料夾的格式一致）"""
+    return df.to_csv(index=False, lineterminator='\n')
+
+
+def read_file_text(file_path):
+    """檔案原文（去除 BOM、統一換行），快照保存原文以便逐位元還原"""
+    try:
+        with open(file_path, encoding='utf-8-sig', newline='') as f:
+            return f.read().replace('\r\n', '\n')
+    except OSError:
+        return None
+
+
+def content_id(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def _parse(text):
+    """以字串解析，保留原始文字，重新輸出時內容不變"""
+    if not text.strip():
+        return pd.DataFrame()
+    return pd.read_csv(io.StringIO(text), dtype=str, keep_default_na=False)
+
+
+def _row_hashes(frame):
+    return pd.util.hash_pandas_object(frame, index=False).tolist() if len(frame.columns) else []
+
+
+def _runs(sources):
+    """將 [(來源, 列號)] 壓縮成連續區段 [[來源, 起始列, 長度], ...]"""
+    runs = []
+    for source, row in sources:
+        if runs and runs[-1][0] == source and runs[-1][1] + runs[-1][2] == row:
+            runs[-1][2] += 1
+        else:
+            runs.append([source, row, 1])
+    return runs
+
+
+def make_delta(base_text, new_text):
+    """計算新版本相對於基準版本的列差異；欄位不同或無法逐位元重建時回傳 None（改存完整表格）"""
+    base, new = _parse(base_text), _parse(new_text)
+    if list(base.columns) != list(new.columns):
+        return None
+
+    # 以列雜湊比對：基準中每個列內容 → 可用的列號（重複列依序配對）
+    available = defaultdict(list)
+    for i, key in enumerate(_row_hashes(base)):
+        available[key].append(i)
+    for rows in available.values():
+        rows.reverse()
+
+    sources, added = [], []
+    for i, key in enumerate(_row_hashes(new)):
+        if available.get(key):
+            sources.append((0, available[key].pop()))
+        else:
+            sources.append((1, len(added)))
+            added.append(i)
+    delta = {'runs': _runs(sources), 'added': canonical_csv(new.iloc[added]) if added else ''}
+    return delta if canonical_csv(_apply_frames(base, delta)) == new_text else None
+
+
+def _apply_frames(base, delta):
+    added = _parse(delta['added']) if delta['added'] else base.iloc[0:0]
+    parts = [(base if source == 0 else added).iloc[start:start + length]
+             for source, start, length in delta['runs']]
+    return pd.concat(parts, ignore_index=True) if parts else base.iloc[0:0]
+
+
+def read_manifest(folder_path):
+    path = _store(folder_path, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def list_snapshots(folder_path):
+    """快照清單（新 → 舊）"""
+    entries = read_manifest(folder_path)
+    return pd.DataFrame([{
+        '快照': e['id'], '時間': e['time'], '說明': e.get('message', ''),
+        '檔案數': sum(1 for v in e['tables'].values() if v)
+    } for e in reversed(entries)], columns=['快照', '時間', '說明', '檔案數'])
+
+
+def _object_path(folder_path, object_id):
+    full = _store(folder_path, 'objects', f'{object_id}.csv.gz')
+    return full if os.path.exists(full) else _store(folder_path, 'objects', f'{object_id}.delta.json.gz')
+
+
+def _read_chain(folder_path, object_id):
+    """回傳 (完整表格原文, 由舊到新的差異 list)"""
+    deltas = []
+    path = _object_path(folder_path, object_id)
+    while path.endswith('.delta.json.gz'):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            delta = json.loads(f.read())
+        deltas.append(delta)
+        path = _object_path(folder_path, delta['base'])
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return f.read(), deltas[::-1]
+
+
+def read_object(folder_path, object_id, _cache=None):
+    """依版本讀取表格原文；差異鏈在記憶體中逐層套用後才輸出一次文字"""
+    cache = _cache if _cache is not None else {}
+    if object_id in _recent:
+        return _recent[object_id][1]
+    if object_id not in cache:
+        text, deltas = _read_chain(folder_path, object_id)
+        if deltas:
+            frame = _parse(text)
+            for delta in deltas:
+                frame = _apply_frames(frame, delta)
+            text = canonical_csv(frame)
+        cache[object_id] = text
+    return cache[object_id]
+
+
+def _chain_depth(folder_path, object_id):
+    if object_id in _recent:
+        return _recent[object_id][0]
+    path = _object_path(folder_path, object_id)
+    if path.endswith('.csv.gz'):
+        return 0
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return json.loads(f.read()).get('depth', MAX_CHAIN)
+
+
+def _remember(object_id, depth, text):
+    _recent[object_id] = (depth, text)
+    while len(_recent) > 2 * len(portfolio_core.FILE_MAPPING):
+        _recent.pop(next(iter(_recent)))
+
+
+def _write_object(folder_path, state_key, text, base_id):
+    """寫入表格版本；內容已存在時直接共用"""
+    object_id = content_id(text)
+    if os.path.exists(_object_path(folder_path, object_id)):
+        return object_id
+
+    delta = None
+    depth = _chain_depth(folder_path, base_id) + 1 if state_key in DELTA_TABLES and base_id else MAX_CHAIN + 1
+    if depth <= MAX_CHAIN:
+        delta = make_delta(read_object(folder_path, base_id), text)
+    if delta is not None:
+        delta.update(base=base_id, depth=depth)
+        _write_bytes(_store(folder_path, 'objects', f'{object_id}.delta.json.gz'),
+                     gzip.compress(json.dumps(delta, ensure_ascii=False).encode('utf-8')))
+    else:
+        depth = 0
+        _write_bytes(_store(folder_path, 'objects', f'{object_id}.csv.gz'), gzip.compress(text.encode('utf-8')))
+    _remember(object_id, depth, text)
+    return object_id
+
+
+def create_snapshot(folder_path, message='', restored_from=None, force=False):
+    """為目前資料夾內容建立快照；與上一份快照相同時不建立（force=True 時仍建立），回傳快照編號或 None"""
+    with portfolio_core.folder_lock(folder_path):
+        entries = read_manifest(folder_path)
+        previous = entries[-1]['tables'] if entries else {}
+        mapping = {}
+        for filename, state_key in portfolio_core.FILE_MAPPING.items():
+            text = read_file_text(os.path.join(folder_path, filename))
+            mapping[filename] = _write_object(folder_path, state_key, text, previous.get(filename)) \
+                if text is not None else None
+        if mapping == previous and not (restored_from or force):
+            return None
+
+        os.makedirs(_store(folder_path), exist_ok=True)
+        snapshot_id = content_id(json.dumps([entries[-1]['id'] if entries else '', mapping], sort_keys=True))[:10]
+        entry = {'id': snapshot_id, 'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                 'message': message, 'tables': mapping}
+        if restored_from:
+            entry['restored_from'] = restored_from
+        with open(_store(folder_path, MANIFEST_FILE), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    return snapshot_id
+
+
+def _entry(folder_path, snapshot_id):
+    for entry in read_manifest(folder_path):
+        if entry['id'] == snapshot_id:
+            return entry
+    raise KeyError(f"找不到快照: {snapshot_id}")
+
+
+def load_snapshot(folder_path, snapshot_id):
+    """讀取快照內所有表格（與 read_folder 相同的型別推斷）"""
+    cache = {}
+    tables = {}
+    for filename, object_id in _entry(folder_path, snapshot_id)['tables'].items():
+        if object_id and filename in portfolio_core.FILE_MAPPING:
+            text = read_object(folder_path, object_id, cache)
+            tables[portfolio_core.FILE_MAPPING[filename]] = pd.read_csv(io.StringIO(text)) if text.strip() else pd.DataFrame()
+    return tables
+
+
+def diff_table(old_text, new_text):
+    """兩個版本之間的 (新增列, 刪除列)"""
+    old, new = _parse(old_text or ''), _parse(new_text or '')
+    old_rows = Counter(old.itertuples(index=False, name=None))
+    new_rows = Counter(new.itertuples(index=False, name=None))
+    added = list((new_rows - old_rows).elements())
+    removed = list((old_rows - new_rows).elements())
+    return (pd.DataFrame(added, columns=new.columns if len(new.columns) else old.columns),
+            pd.DataFrame(removed, columns=old.columns if len(old.columns) else new.columns))
+
+
+def diff_snapshots(folder_path, old_id, new_id):
+    """兩份快照的逐表差異摘要；只比較版本不同的表格"""
+    old_tables = _entry(folder_path, old_id)['tables']
+    new_tables = _entry(folder_path, new_id)['tables']
+    cache = {}
+    rows = []
+    for filename in portfolio_core.FILE_MAPPING:
+        old_obj, new_obj = old_tables.get(filename), new_tables.get(filename)
+        if old_obj == new_obj:
+            continue
+        old_text = read_object(folder_path, old_obj, cache) if old_obj else ''
+        new_text = read_object(folder_path, new_obj, cache) if new_obj else ''
+        added, removed = diff_table(old_text, new_text)
+        rows.append({'檔案': filename, '新增列': len(added), '刪除列': len(removed)})
+    return pd.DataFrame(rows, columns=['檔案', '新增列', '刪除列'])
+
+
+def restore_snapshot(folder_path, snapshot_id, backup=True):
+    """將資料夾還原成指定快照（逐位元寫回原文），並建立一份新的快照記錄此次還原
+
+    還原前一律為目前內容建立快照（backup=True，內容與先前快照相同也建立），因此還原本身也可以復原；
+    快照中沒有的資料檔（例如快照之後才產生的 options_archive.csv）會被刪除，資料夾內容與快照完全一致。
+    回傳 (寫回的檔案, 刪除的檔案)
+    """
+    mapping = _entry(folder_path, snapshot_id)['tables']
+    if backup:
+        create_snapshot(folder_path, message=f'還原 {snapshot_id} 前的自動快照', force=True)
+    cache = {}
+    saved_files, removed_files = [], []
+    with portfolio_core.folder_lock(folder_path):
+        for filename in portfolio_core.FILE_MAPPING:
+            file_path = os.path.join(folder_path, filename)
+            object_id = mapping.get(filename)
+            if object_id:
+                text = read_object(folder_path, object_id, cache)
+                _write_bytes(file_path, text.encode('utf-8-sig'))
+                saved_files.append(filename)
+            elif os.path.exists(file_path):
+                os.remove(file_path)
+                removed_files.append(filename)
+    create_snapshot(folder_path, message=f'還原 {snapshot_id}', restored_from=snapshot_id)
+    return saved_files, removed_files
+
+
+def undo(folder_path):
+    """復原最近一步：還原到最新快照的前一份快照，回傳該快照編號（沒有可復原時回傳 None）
+
+    先為尚未建立快照的目前內容建立快照，復原的就是最近一次的變更；
+    還原記錄與一般快照同樣是一步，因此還原後的復原會回到還原前的內容
+    """
+    create_snapshot(folder_path, message='復原前的自動快照')
+    entries = read_manifest(folder_path)
+    if len(entries) < 2:
+        return None
+    target = entries[-2]['id']
+    restore_snapshot(folder_path, target, backup=False)
+    return target
+
+
+def store_size(folder_path):
+    """快照存放區占用的位元組數"""
+    total = 0
+    for root, _, files in os.walk(_store(folder_path)):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.abspath(__file__))
+    command = sys.argv[2] if len(sys.argv) > 2 else 'list'
+    if command == 'undo':
+        target = undo(folder)
+        print(f"已還原到 {target}" if target else "沒有可復原的快照")
+    elif command == 'restore' and len(sys.argv) > 3:
+        saved, removed = restore_snapshot(folder, sys.argv[3])
+        print(f"已還原: {', '.join(saved)}" + (f"｜已刪除: {', '.join(removed)}" if removed else ""))
+    else:
+        print(list_snapshots(folder).to_string(index=False))
+        print(f"存放區大小: {store_size(folder) / 1024:,.1f} KB")
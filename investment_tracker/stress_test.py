@@ -0,0 +1,141 @@
+"""壓力測試：以 持股 × 情境 的矩陣運算一次評估價格、匯率與波動率衝擊"""
+import numpy as np
+import pandas as pd
+
+CATEGORIES = ['保守型', '進攻型', '樂透型']
+SCENARIO_COLUMNS = ['情境', '全體(%)', '保守型(%)', '進攻型(%)', '樂透型(%)', '個股覆寫', '匯率(%)', '波動率(點)']
+
+# 預設情境；個股覆寫格式: "TSLA:-40, NVDA:-30"
+DEFAULT_SCENARIOS = pd.DataFrame([
+    ['大盤 -10%', -10.0, 0.0, 0.0, 0.0, '', 0.0, 5.0],
+    ['大盤 -20%', -20.0, 0.0, 0.0, 0.0, '', 0.0, 10.0],
+    ['大盤 -35%（金融海嘯）', -35.0, 0.0, -15.0, -30.0, '', 5.0, 30.0],
+    ['科技股修正', 0.0, -5.0, -30.0, 0.0, '', 0.0, 15.0],
+    ['加密貨幣崩跌', 0.0, 0.0, 0.0, -60.0, '', 0.0, 0.0],
+    ['台幣升值 5%', 0.0, 0.0, 0.0, 0.0, '', -5.0, 0.0],
+    ['多頭 +15%', 15.0, 0.0, 5.0, 20.0, '', 0.0, -5.0],
+], columns=SCENARIO_COLUMNS)
+
+
+def parse_overrides(text):
+    """解析個股覆寫字串 "TSLA:-40, NVDA:-30" → {'TSLA': -40.0, ...}"""
+    overrides = {}
+    for part in str(text or '').replace('，', ',').split(','):
+        if ':' not in part:
+            continue
+        code, value = part.split(':', 1)
+        try:
+            overrides[code.strip().upper()] = float(value)
+        except ValueError:
+            continue
+    return overrides
+
+
+def grid_scenarios(market_range=(-50, 30), step=1, vol_spikes=(0, 10, 25)):
+    """產生 大盤漲跌 × 波動率 的情境網格（數百個情境）"""
+    moves = np.arange(market_range[0], market_range[1] + step, step, dtype=float)
+    market, vol = np.meshgrid(moves, np.asarray(vol_spikes, dtype=float), indexing='ij')
+    n = market.size
+    return pd.DataFrame({
+        '情境': [f"大盤 {m:+.0f}% / 波動 {v:+.0f}點" for m, v in zip(market.ravel(), vol.ravel())],
+        '全體(%)': market.ravel(), '保守型(%)': np.zeros(n), '進攻型(%)': np.zeros(n), '樂透型(%)': np.zeros(n),
+        '個股覆寫': [''] * n, '匯率(%)': np.zeros(n), '波動率(點)': vol.ravel(),
+    })
+
+
+def shock_matrix(codes, categories, scenarios):
+    """回傳 (代碼 × 情境) 的價格變動比例矩陣：全體 + 分類，個股覆寫優先"""
+    scenarios = scenarios.reindex(columns=SCENARIO_COLUMNS)
+    market = pd.to_numeric(scenarios['全體(%)'], errors='coerce').fillna(0).to_numpy()
+    category_shock = np.column_stack([
+        pd.to_numeric(scenarios[f'{c}(%)'], errors='coerce').fillna(0).to_numpy() for c in CATEGORIES
+    ]) if len(scenarios) else np.zeros((0, len(CATEGORIES)))
+
+    cat_idx = np.array([CATEGORIES.index(c) if c in CATEGORIES else -1 for c in categories], dtype=int)
+    per_holding = np.where(cat_idx[:, None] >= 0, category_shock.T[np.clip(cat_idx, 0, None)], 0.0)
+    shocks = market[None, :] + per_holding
+
+    codes = list(codes)
+    for s, text in enumerate(scenarios['個股覆寫'].fillna('')):
+        for code, value in parse_overrides(text).items():
+            rows = [i for i, c in enumerate(codes) if c == code]
+            shocks[rows, s] = value
+    # 價格最多跌到 0
+    return np.maximum(shocks / 100, -1.0)
+
+
+def underlying_shocks(option_codes, holding_codes, holding_shocks, scenarios):
+    """選擇權標的的價格變動：有持股時沿用持股衝擊，否則用全體 + 個股覆寫"""
+    market = pd.to_numeric(scenarios.reindex(columns=SCENARIO_COLUMNS)['全體(%)'], errors='coerce').fillna(0).to_numpy() / 100
+    lookup = {code: i for i, code in enumerate(holding_codes)}
+    result = np.tile(market, (len(option_codes), 1))
+    overrides = [parse_overrides(t) for t in scenarios.reindex(columns=SCENARIO_COLUMNS)['個股覆寫'].fillna('')]
+    for p, code in enumerate(option_codes):
+        if code in lookup:
+            result[p] = holding_shocks[lookup[code]]
+        else:
+            for s, ov in enumerate(overrides):
+                if code in ov:
+                    result[p, s] = ov[code] / 100
+    return np.maximum(result, -1.0)
+
+
+def run_stress(snapshot, scenarios, greeks=None, margin=None, weights=None, usd_rate=31.5, lottery_max=10.0):
+    """一次計算所有情境的衝擊
+
+    snapshot: portfolio_core.holdings_snapshot 的結果
+    greeks: option_analytics.compute_position_greeks 的結果（可省略）
+    margin: 依資金來源的保證金 Series；weights: 各分類目標權重 Series（0~1）
+    """
+    if scenarios.empty:
+        return pd.DataFrame()
+    valued = snapshot[snapshot['市值(USD)'].notna()] if not snapshot.empty else snapshot
+    codes = valued['股票代碼'].to_numpy() if not valued.empty else np.array([], dtype=object)
+    categories = valued['所屬分類'].to_numpy() if not valued.empty else np.array([], dtype=object)
+    base_value = valued['市值(USD)'].to_numpy(dtype=float) if not valued.empty else np.array([])
+
+    shocks = shock_matrix(codes, categories, scenarios)                     # H × S
+    values = base_value[:, None] * (1 + shocks)                             # H × S
+    total = values.sum(axis=0)
+    base_total = base_value.sum()
+    fx_move = pd.to_numeric(scenarios['匯率(%)'], errors='coerce').fillna(0).to_numpy() / 100
+    vol_move = pd.to_numeric(scenarios['波動率(點)'], errors='coerce').fillna(0).to_numpy()
+
+    result = pd.DataFrame({'情境': scenarios['情境'].to_numpy()})
+    result['市值(USD)'] = total
+    result['市值變動(USD)'] = total - base_total
+    result['市值變動(%)'] = np.where(base_total > 0, (total - base_total) / max(base_total, 1e-9), 0.0)
+    result['市值(TWD)'] = total * usd_rate * (1 + fx_move)
+
+    # 選擇權：Delta-Gamma-Vega 近似損益（P × S）
+    option_pnl = np.zeros(len(scenarios))
+    if greeks is not None and not greeks.empty:
+        g = greeks[greeks['現價'].notna()]
+        if not g.empty:
+            spot = g['現價'].to_numpy(dtype=float)
+            u_shock = underlying_shocks(g['標的'].to_numpy(), list(codes), shocks, scenarios)
+            d_spot = spot[:, None] * u_shock
+            option_pnl = (g['Delta'].to_numpy()[:, None] * d_spot
+                          + 0.5 * g['Gamma'].to_numpy()[:, None] * d_spot ** 2
+                          + g['Vega'].to_numpy()[:, None] * vol_move[None, :]).sum(axis=0)
+    result['選擇權損益(USD)'] = option_pnl
+
+    # 保證金覆蓋率：資金來源持股在衝擊後的市值 / 被壓住的保證金
+    if margin is not None and not margin.empty and margin.sum() > 0:
+        source_mask = np.isin(codes, margin.index)
+        covered = values[source_mask].sum(axis=0)
+        result['保證金覆蓋率'] = covered / margin.sum()
+    else:
+        result['保證金覆蓋率'] = np.nan
+
+    # 計畫合規：各分類實際權重與目標的最大偏離、樂透型佔比
+    cat_values = np.vstack([values[categories == c].sum(axis=0) for c in CATEGORIES])  # 3 × S
+    cat_share = cat_values / np.where(total > 0, total, 1)
+    result['樂透型佔比'] = cat_share[CATEGORIES.index('樂透型')]
+    if weights is not None and not weights.empty:
+        target = weights.reindex(CATEGORIES).fillna(0).to_numpy()[:, None]
+        result['最大權重偏離'] = np.abs(cat_share - target).max(axis=0)
+    result['合規'] = result['樂透型佔比'] * 100 <= lottery_max
+    if '保證金覆蓋率' in result and result['保證金覆蓋率'].notna().any():
+        result['合規'] &= result['保證金覆蓋率'].fillna(np.inf) >= 1.0
+    return result
@@ -0,0 +1,341 @@
+"""年度已實現損益報表（報稅用）：依選定的批次法配對每筆賣出的買入批次，計算持有期間與依交易日匯率換算的 TWD 損益
+
+帳本先依公司行動調整分割（與各頁面相同），依 分類 × 代碼 各自配對；結果分批寫出 CSV 或 Parquet，
+不在記憶體保留整份報表。
+
+批次法:
+    FIFO     先進先出
+    LIFO     後進先出
+    HIFO     成本最高者先出
+    AVERAGE  全期平均成本（與總覽頁的已實現損益一致；持有期間依先進先出的批次計算）
+
+命令列:
+    python tax_lots.py <資料夾> [--year 2026] [--method FIFO] [--format csv|parquet] [--out 檔案路徑]
+    python tax_lots.py --check    檢查分批寫出
+"""
+import argparse
+import heapq
+import os
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+import corporate_actions
+import fx_service
+import overview
+import portfolio_core
+
+METHODS = ['FIFO', 'LIFO', 'HIFO', 'AVERAGE']
+LONG_TERM_DAYS = 365
+CHUNK_ROWS = 50_000
+COLUMNS = ['賣出日期', '買入日期', '所屬分類', '股票代碼', '股數', '持有天數', '期間',
+           '賣出收入(USD)', '成本(USD)', '損益(USD)', '賣出匯率', '買入匯率',
+           '賣出收入(TWD)', '成本(TWD)', '損益(TWD)', '備註']
+# 每批固定型別：有無「無對應買入批次」的批次型別一致，Parquet 才能逐批寫入同一個檔案
+TEXT_COLUMNS = ['所屬分類', '股票代碼', '期間', '備註']
+DATE_COLUMNS = ['賣出日期', '買入日期']
+DTYPES = {column: ('datetime64[ns]' if column in DATE_COLUMNS else str if column in TEXT_COLUMNS
+                   else 'Int64' if column == '持有天數' else 'float64') for column in COLUMNS}
+
+# 嘗試導入 pyarrow（Parquet 輸出）
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+
+def _prepare(df_stock, fx_history):
+    """排序（分類、代碼、日期、原順序）並取出配對需要的欄位陣列"""
+    ledger = df_stock.copy()
+    ledger['_日期'] = pd.to_datetime(ledger['交易日期'], errors='coerce').dt.normalize()
+    ledger = ledger[ledger['_日期'].notna()]
+    ledger['股票代碼'] = ledger['股票代碼'].astype(str).str.upper()
+    ledger['所屬分類'] = ledger['所屬分類'].astype(str)
+    ledger['_順序'] = np.arange(len(ledger))
+    ledger = ledger.sort_values(['所屬分類', '股票代碼', '_日期', '_順序'], kind='stable')
+
+    shares = pd.to_numeric(ledger['股數'], errors='coerce').fillna(0).abs().to_numpy()
+    price = pd.to_numeric(ledger['成交價格(USD)'], errors='coerce').fillna(0).to_numpy()
+    fee = pd.to_numeric(ledger['手續費(USD)'], errors='coerce').fillna(0).clip(lower=0).to_numpy()
+    tax = pd.to_numeric(ledger.get('交易稅(USD)', 0), errors='coerce').fillna(0).clip(lower=0).to_numpy() \
+        if '交易稅(USD)' in ledger.columns else np.zeros(len(ledger))
+    is_buy = (ledger['交易類型'] == '買進').to_numpy()
+    currencies = ledger['幣別'] if '幣別' in ledger.columns else pd.Series('USD', index=ledger.index)
+    rates = fx_service.lookup_rates(fx_service.rate_matrix(fx_history), ledger['_日期'], currencies)
+    return {
+        'date': ledger['_日期'].to_numpy(dtype='datetime64[D]'),
+        'category': ledger['所屬分類'].to_numpy(),
+        'code': ledger['股票代碼'].to_numpy(),
+        'is_buy': is_buy,
+        'shares': shares,
+        # 買進: 成本（含手續費）；賣出: 淨收入（扣手續費、交易稅），與 buy_cost / sell_proceeds 相同
+        'amount': np.where(is_buy, shares * price + fee, shares * price - fee - tax),
+        'rate': rates,
+    }
+
+
+class _Lots:
+    """單一 分類 × 代碼 的未平倉批次；依批次法決定取用順序"""
+
+    def __init__(self, method):
+        self.method = method
+        self._queue = deque()
+        self._heap = []
+
+    def add(self, date, shares, cost_per_share, rate, seq):
+        lot = [date, shares, cost_per_share, rate]
+        if self.method == 'HIFO':
+            heapq.heappush(self._heap, (-cost_per_share, seq, lot))
+        else:
+            self._queue.append(lot)
+
+    def take(self, shares):
+        """取出 shares 股，回傳 [(日期, 股數, 每股成本, 匯率), ...]"""
+        taken = []
+        while shares > 1e-9:
+            if self.method == 'HIFO':
+                if not self._heap:
+                    break
+                lot = self._heap[0][2]
+            elif self._queue:
+                lot = self._queue[-1] if self.method == 'LIFO' else self._queue[0]
+            else:
+                break
+            used = min(shares, lot[1])
+            taken.append((lot[0], used, lot[2], lot[3]))
+            lot[1] -= used
+            shares -= used
+            if lot[1] <= 1e-9:
+                if self.method == 'HIFO':
+                    heapq.heappop(self._heap)
+                elif self.method == 'LIFO':
+                    self._queue.pop()
+                else:
+                    self._queue.popleft()
+        return taken, shares
+
+
+def _pooled_cost(data):
+    """AVERAGE 法：各 分類 × 代碼 全期買進的每股平均成本（USD 與 TWD）"""
+    keys = pd.MultiIndex.from_arrays([data['category'], data['code']])
+    buys = pd.DataFrame({'shares': np.where(data['is_buy'], data['shares'], 0.0),
+                         'usd': np.where(data['is_buy'], data['amount'], 0.0),
+                         'twd': np.where(data['is_buy'], data['amount'] * data['rate'], 0.0)}, index=keys)
+    total = buys.groupby(level=[0, 1]).sum()
+    per_share = total[['usd', 'twd']].div(total['shares'].where(total['shares'] > 0), axis=0).fillna(0)
+    return {key: (row.usd, row.twd, shares) for key, row, shares in zip(per_share.index, per_share.itertuples(), total['shares'])}
+
+
+def realized_lot_chunks(df_stock, fx_history=None, method='FIFO', year=None, df_actions=None, chunk_rows=CHUNK_ROWS):
+    """逐批產生已實現損益明細 DataFrame（每列為一筆賣出配到的一個買入批次）"""
+    method = method.upper()
+    if method not in METHODS:
+        raise ValueError(f"未知的批次法: {method}（可用: {', '.join(METHODS)}）")
+    if df_stock is None or df_stock.empty:
+        return
+    ledger = corporate_actions.apply_splits(df_stock, df_actions) if df_actions is not None and not df_actions.empty else df_stock
+    data = _prepare(ledger, fx_history if fx_history is not None else fx_service.load_fx_history(None))
+    pooled = _pooled_cost(data) if method == 'AVERAGE' else None
+
+    rows = []
+    lots, key = None, None
+    # 逐筆配對前先轉成 Python list（以天數整數表示日期），迴圈內不再存取 NumPy 純量
+    date = data['date'].astype(np.int64).tolist()
+    category, code = data['category'].tolist(), data['code'].tolist()
+    is_buy, shares = data['is_buy'].tolist(), data['shares'].tolist()
+    amount, rate = data['amount'].tolist(), data['rate'].tolist()
+    year_start = int(np.datetime64(f'{year}-01-01', 'D').astype(np.int64)) if year else None
+    year_end = int(np.datetime64(f'{int(year) + 1}-01-01', 'D').astype(np.int64)) if year else None
+    for i in range(len(date)):
+        if key != (category[i], code[i]):
+            key = (category[i], code[i])
+            lots = _Lots('FIFO' if method == 'AVERAGE' else method)
+        if shares[i] <= 0:
+            continue
+        if is_buy[i]:
+            lots.add(date[i], shares[i], amount[i] / shares[i], rate[i], i)
+            continue
+
+        taken, unmatched = lots.take(shares[i])
+        if unmatched > 1e-9:
+            taken.append((None, unmatched, 0.0, float('nan')))
+        if pooled is not None:
+            # 全期平均成本最多攤到全期買進的股數（賣超的部分不計成本，與總覽相同）
+            cost_usd, cost_twd, costable = pooled[key]
+            costed = min(shares[i], costable)
+            pooled[key] = (cost_usd, cost_twd, costable - costed)
+        if year and not (year_start <= date[i] < year_end):
+            continue
+        proceeds_per_share = amount[i] / shares[i]
+        for lot_date, lot_shares, cost_per_share, lot_rate in taken:
+            if pooled is not None:
+                used = min(lot_shares, costed)
+                costed -= used
+                lot_cost_usd, lot_cost_twd = cost_usd * used, cost_twd * used
+            else:
+                lot_cost_usd, lot_cost_twd = cost_per_share * lot_shares, cost_per_share * lot_shares * lot_rate
+            rows.append((date[i], lot_date, key[0], key[1], lot_shares, date[i] - lot_date if lot_date is not None else -1,
+                         proceeds_per_share * lot_shares, lot_cost_usd, rate[i], lot_rate, lot_cost_twd,
+                         '' if lot_date is not None else '無對應買入批次'))
+        if len(rows) >= chunk_rows:
+            yield _frame(rows)
+            rows = []
+    if rows:
+        yield _frame(rows)
+
+
+def _days_to_dates(days):
+    """天數整數（1970-01-01 起）轉回日期，None 為 NaT"""
+    values = np.array([d if d is not None else np.iinfo(np.int64).min for d in days], dtype=np.int64)
+    return pd.to_datetime(values.astype('datetime64[D]')).astype('datetime64[ns]')
+
+
+def _frame(rows):
+    sale, bought, category, code, qty, days, proceeds, cost, sale_rate, buy_rate, cost_twd, note = map(list, zip(*rows))
+    out = pd.DataFrame({'賣出日期': _days_to_dates(sale), '買入日期': _days_to_dates(bought),
+                        '所屬分類': category, '股票代碼': code, '股數': qty, '持有天數': days})
+    out['持有天數'] = out['持有天數'].where(out['持有天數'] >= 0)
+    out['期間'] = np.where(out['持有天數'].isna(), '', np.where(out['持有天數'] > LONG_TERM_DAYS, '長期', '短期'))
+    out['賣出收入(USD)'] = proceeds
+    out['成本(USD)'] = cost
+    out['損益(USD)'] = out['賣出收入(USD)'] - out['成本(USD)']
+    out['賣出匯率'] = sale_rate
+    out['買入匯率'] = buy_rate
+    out['賣出收入(TWD)'] = out['賣出收入(USD)'] * out['賣出匯率']
+    out['成本(TWD)'] = cost_twd
+    out['損益(TWD)'] = out['賣出收入(TWD)'] - out['成本(TWD)']
+    out['備註'] = note
+    return out[COLUMNS].astype(DTYPES)
+
+
+def _parquet_schema():
+    types = {'datetime64[ns]': pa.timestamp('ns'), 'Int64': pa.int64(), 'float64': pa.float64(), str: pa.string()}
+    return pa.schema([(column, types[DTYPES[column]]) for column in COLUMNS])
+
+
+def write_report(chunks, path, fmt=None):
+    """逐批寫出（CSV 或 Parquet），回傳 (列數, 彙總 dict)"""
+    fmt = (fmt or os.path.splitext(path)[1].lstrip('.') or 'csv').lower()
+    if fmt == 'parquet' and not PYARROW_AVAILABLE:
+        raise RuntimeError("輸出 Parquet 需要安裝 pyarrow: pip install pyarrow")
+    count = 0
+    totals = {'賣出收入(USD)': 0.0, '成本(USD)': 0.0, '損益(USD)': 0.0, '損益(TWD)': 0.0,
+              '短期損益(USD)': 0.0, '長期損益(USD)': 0.0}
+    writer = None
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                if fmt == 'parquet':
+                    table = pa.Table.from_pandas(chunk, schema=_parquet_schema(), preserve_index=False)
+                    writer = writer or pq.ParquetWriter(f, table.schema)
+                    writer.write_table(table)
+                else:
+                    f.write(chunk.to_csv(index=False, header=count == 0, date_format='%Y-%m-%d').encode(
+                        'utf-8-sig' if count == 0 else 'utf-8'))
+                count += len(chunk)
+                for column in ['賣出收入(USD)', '成本(USD)', '損益(USD)', '損益(TWD)']:
+                    totals[column] += float(chunk[column].sum())
+                totals['短期損益(USD)'] += float(chunk.loc[chunk['期間'] == '短期', '損益(USD)'].sum())
+                totals['長期損益(USD)'] += float(chunk.loc[chunk['期間'] == '長期', '損益(USD)'].sum())
+            if writer is not None:
+                writer.close()
+                writer = None
+            elif fmt == 'parquet':
+                # 沒有任何賣出時仍寫出空表
+                pq.write_table(_parquet_schema().empty_table(), f)
+            elif count == 0:
+                f.write(','.join(COLUMNS).encode('utf-8-sig') + b'\n')
+        os.replace(tmp_path, path)
+    finally:
+        # 寫入失敗時先關閉 writer，避免之後對已關閉的檔案寫入
+        if writer is not None:
+            try:
+                writer.close()
+            except Exception:
+                pass
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return count, totals
+
+
+def reconcile(df_stock, df_actions=None, fx_history=None):
+    """AVERAGE 法的全期已實現損益與總覽頁的計算相比，回傳 (報表, 總覽)"""
+    ledger = corporate_actions.apply_splits(df_stock, df_actions) if df_actions is not None and not df_actions.empty else df_stock
+    report = sum(float(chunk['損益(USD)'].sum())
+                 for chunk in realized_lot_chunks(ledger, fx_history, 'AVERAGE'))
+    held_cost = portfolio_core.holdings_snapshot(ledger, {})['持有成本(USD)'].sum()
+    view = float(overview.sell_proceeds(ledger).sum() - (portfolio_core.buy_cost(ledger).sum() - held_cost))
+    return report, view
+
+
+def export_year(folder_path, year, method='FIFO', fmt='csv', out_path=None):
+    """讀取資料夾並輸出年度報表，回傳 (輸出路徑, 列數, 彙總)"""
+    tables, _ = portfolio_core.read_folder(folder_path)
+    fx_history = fx_service.load_fx_history(folder_path)
+    out_path = out_path or os.path.join(folder_path, f'realized_{year}_{method.upper()}.{fmt}')
+    count, totals = write_report(
+        realized_lot_chunks(tables.get('df_stock'), fx_history, method, year, tables.get('df_actions')), out_path, fmt)
+    return out_path, count, totals
+
+
+def check_chunked_output(folder_path=None, chunk_rows=2):
+    """以小批次寫出同時含有配對與「無對應買入批次」賣出的帳本，確認各批型別一致且 CSV / Parquet 皆可逐批寫入
+
+    回傳問題描述 list（空 list 表示通過）
+    """
+    import tempfile
+    trades = [('2024-01-02', '買進', 'AAA', 10), ('2024-03-01', '賣出', 'AAA', 4), ('2025-02-01', '賣出', 'AAA', 6),
+              ('2024-05-01', '賣出', 'BBB', 5), ('2024-06-01', '買進', 'CCC', 3), ('2024-07-01', '賣出', 'CCC', 5),
+              ('2024-08-01', '買進', 'DDD', 2), ('2025-09-01', '賣出', 'DDD', 2)]
+    ledger = pd.DataFrame({'交易日期': [t[0] for t in trades], '交易類型': [t[1] for t in trades], '所屬分類': '進攻型',
+                           '股票代碼': [t[2] for t in trades], '股數': [float(t[3]) for t in trades],
+                           '成交價格(USD)': 10.0, '手續費(USD)': 0.0, '交易稅(USD)': 0.0})
+    chunks = list(realized_lot_chunks(ledger, method='FIFO', chunk_rows=chunk_rows))
+    problems = []
+    if len({tuple(chunk.dtypes.astype(str)) for chunk in chunks}) > 1:
+        problems.append("各批欄位型別不一致")
+    if not any(chunk['買入日期'].isna().any() for chunk in chunks) or all(chunk['買入日期'].isna().any() for chunk in chunks):
+        problems.append("測試資料未同時包含有/無對應買入批次的批次")
+    expected = sum(len(chunk) for chunk in chunks)
+    with tempfile.TemporaryDirectory(dir=folder_path) as tmp:
+        for fmt in ['csv', 'parquet'] if PYARROW_AVAILABLE else ['csv']:
+            path = os.path.join(tmp, f'check.{fmt}')
+            try:
+                count, _ = write_report(iter(chunks), path, fmt)
+                written = len(pd.read_parquet(path) if fmt == 'parquet' else pd.read_csv(path, encoding='utf-8-sig'))
+            except Exception as e:
+                problems.append(f"{fmt} 寫出失敗: {e}")
+                continue
+            if count != expected or written != expected:
+                problems.append(f"{fmt} 列數不符: 預期 {expected}，寫出 {count}，讀回 {written}")
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='年度已實現損益報表')
+    parser.add_argument('folder', nargs='?', default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument('--year', type=int, default=pd.Timestamp.now().year)
+    parser.add_argument('--method', default='FIFO', choices=METHODS)
+    parser.add_argument('--format', default='csv', choices=['csv', 'parquet'])
+    parser.add_argument('--out', default=None)
+    parser.add_argument('--check', action='store_true', help='檢查分批寫出（含無對應買入批次的賣出）是否正常')
+    args = parser.parse_args()
+
+    if args.check:
+        problems = check_chunked_output()
+        print("\n".join(problems) if problems else "分批寫出檢查通過")
+        raise SystemExit(1 if problems else 0)
+
+    try:
+        path, count, totals = export_year(args.folder, args.year, args.method, args.format, args.out)
+    except (RuntimeError, ValueError) as e:
+        print(e)
+    else:
+        print(f"{path}: {count} 筆")
+        print(f"賣出收入 ${totals['賣出收入(USD)']:,.2f} | 成本 ${totals['成本(USD)']:,.2f} | "
+              f"損益 ${totals['損益(USD)']:,.2f}（短期 ${totals['短期損益(USD)']:,.2f} / 長期 ${totals['長期損益(USD)']:,.2f}）"
+              f" | 損益 NT${totals['損益(TWD)']:,.0f}")
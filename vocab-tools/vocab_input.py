@@ -1,7 +1,14 @@
 import customtkinter as ctk
+import argparse
 import csv
 import datetime
+import json
 import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from tkinter import messagebox
 
@@ -12,6 +19,21 @@ import google.genai as genai
 BASE_DIR = Path(__file__).resolve().parent
 # 注意：在正式環境中，建議使用環境變數管理 API KEY
 GOOGLE_API_KEY = "Your GEMINI KEY"
+# 使用最新穩定版模型
+#GEMINI_MODEL = 'models/gemini-2.5-flash-lite'
+GEMINI_MODEL = 'models/gemini-2.5-flash'
+#GEMINI_MODEL = 'gemini-2.0-flash-lite-preview-02-05'
+POLL_MS = 100  # 主執行緒檢查背景結果的間隔
+# 長筆記依行切塊平行送出：每塊行數、同時請求數、失敗塊的重試次數
+CHUNK_LINES = 25
+MAX_WORKERS = 4
+MAX_RETRIES = 2
+# JSON 結構化輸出較不易斷行出錯，每個請求可放較多單字
+STRUCTURED_CHUNK_LINES = 200
+OUTPUT_MODES = ["串流文字", "一次回傳", "JSON 結構化"]
+# 已整理過的單字快取，命中的單字不再送給 Gemini
+CACHE_FILE = BASE_DIR / "vocab_cache.sqlite3"
+FIELDS = ["Word", "POS", "Chinese_1", "Chinese_2", "Example"]
 
 # 設定外觀與主題
 ctk.set_appearance_mode("System")  # 跟隨系統模式
@@ -25,6 +47,345 @@ try:
 except Exception as e:
     print(f"API Client 初始化錯誤: {e}")
 
+
+def build_prompt(raw_text):
+    """組合單字整理的 prompt"""
+    return f"""
+        You are a vocabulary organizing assistant.
+        I will give you a list of words or messy notes. Your goal is to extract the vocabulary and fill in missing information.
+
+        Input Text:
+        {raw_text}
+
+        Requirements:
+        1. Identify the main English word each line.
+        2. If a line includes definitions or example sentences, CORRECT them if there are errors.
+        3. If definitions (Chinese_1, Chinese_2), POS, or example sentences are MISSING, provide them.
+        4. Ensure the Part of Speech (POS) in Traditional Chinese (e.g., 名詞, 動詞, 形容詞).
+        5. Ensure the (Chinese_1, Chinese_2) in Traditional Chinese.
+        6. Output format MUST be strictly separated by a pipe symbol (|) for each line.
+        7. Format: Word | POS | Chinese_1 | Chinese_2 | Example
+        8. Do not output any header or markdown symbols, just the raw data lines.
+        """
+
+
+# 結構化輸出：每筆對應輸入的第 index 行（同一行可有多個單字）
+ENTRY_KEYS = ["word", "pos", "chinese_1", "chinese_2", "example"]
+ENTRY_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {"index": {"type": "INTEGER"}, **{key: {"type": "STRING"} for key in ENTRY_KEYS}},
+        "required": ["index"] + ENTRY_KEYS,
+        "property_ordering": ["index"] + ENTRY_KEYS,
+    },
+}
+
+
+def build_structured_prompt(numbered_lines):
+    """JSON 模式的 prompt，numbered_lines 為 [(行號, 內容)]"""
+    listing = "\n".join(f"[{index}] {line}" for index, line in numbered_lines)
+    return f"""
+        You are a vocabulary organizing assistant.
+        Each input line below starts with its line number in brackets. Extract the main English word of each line and fill in missing information.
+
+        Input Lines:
+        {listing}
+
+        Requirements:
+        1. Return one JSON object per word, with "index" set to the bracketed line number it came from.
+        2. If a line includes definitions or example sentences, CORRECT them if there are errors.
+        3. "pos" is the Part of Speech in Traditional Chinese (e.g., 名詞, 動詞, 形容詞).
+        4. "chinese_1" and "chinese_2" are two Traditional Chinese definitions.
+        5. "example" is one English example sentence.
+        6. Every field must be non-empty. Do not skip any line.
+        """
+
+
+def clean_response(text):
+    """清除 Markdown 可能帶有的符號 (防呆)"""
+    text = (text or "").strip()
+    if text.startswith("```"):
+        text = "\n".join(text.split("\n")[1:-1])
+    return text
+
+
+def enrich(raw_text):
+    """呼叫 Gemini 整理單字（會阻塞，請在背景執行緒呼叫）"""
+    response = client.models.generate_content(model=GEMINI_MODEL, contents=build_prompt(raw_text))
+    return clean_response(response.text)
+
+
+def enrich_stream(raw_text, on_line):
+    """串流版 enrich：每收到一行完整的 Word | POS | Chinese_1 | Chinese_2 | Example 就呼叫 on_line(line)
+
+    回傳與 enrich 相同的完整結果
+    """
+    lines = []
+    buffer = ""
+
+    def emit(line):
+        line = line.strip()
+        if not line or line.startswith("```"):
+            return
+        lines.append(line)
+        if parse_line(line):
+            on_line(line)
+
+    for chunk in client.models.generate_content_stream(model=GEMINI_MODEL, contents=build_prompt(raw_text)):
+        buffer += chunk.text or ""
+        *complete, buffer = buffer.split("\n")
+        for line in complete:
+            emit(line)
+    emit(buffer)
+    return "\n".join(lines)
+
+
+def normalize_word(word):
+    """快取鍵：去除前後空白、合併空白並轉小寫"""
+    return " ".join(str(word).split()).lower()
+
+
+def parse_line(line):
+    """拆解 Word | POS | Chinese_1 | Chinese_2 | Example，欄位不足時回傳 None"""
+    parts = [p.strip() for p in line.split('|')]
+    if len(parts) < 5 or not parts[0]:
+        return None
+    return parts[:5]
+
+
+def format_entry(entry):
+    # 欄位內的 | 會破壞分隔格式，改為全形
+    return " | ".join(str(value).replace("|", "｜") for value in entry)
+
+
+def cache_key(line):
+    """只有「單純的單字/片語」行才查快取；含定義或例句的行需要 Gemini 校正"""
+    line = line.strip()
+    if not line or '|' in line or len(line.split()) > 4:
+        return None
+    return normalize_word(line)
+
+
+class EnrichCache:
+    """SQLite 單字快取（依正規化單字），並累計命中/未命中次數
+
+    背景執行緒也會寫入，所以共用一個連線並以 lock 保護
+    """
+
+    def __init__(self, path=CACHE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, word TEXT, pos TEXT, "
+                           "chinese_1 TEXT, chinese_2 TEXT, example TEXT, updated TEXT)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def seed_from_csv(self, filename):
+        """把 vocab_list.csv 既有的單字匯入快取（不覆蓋已快取的內容）"""
+        if not os.path.isfile(filename):
+            return 0
+        with open(filename, encoding='utf-8-sig') as f:
+            entries = [[row.get(field, "") or "" for field in FIELDS] for row in csv.DictReader(f)]
+        return self.put_many([entry for entry in entries if entry[0] and all(entry[1:4])], replace=False)
+
+    def get_many(self, keys):
+        """回傳 {鍵: [Word, POS, Chinese_1, Chinese_2, Example]}，並記錄命中/未命中"""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, word, pos, chinese_1, chinese_2, example FROM entries "
+                    f"WHERE key IN ({','.join('?' * len(batch))})", batch).fetchall()
+                found.update({row[0]: list(row[1:]) for row in rows})
+            hits, misses = len(found), len(keys) - len(found)
+            self.hits += hits
+            self.misses += misses
+            self._conn.executemany("INSERT INTO stats (name, value) VALUES (?, ?) "
+                                   "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                                   [("hits", hits), ("misses", misses)])
+            self._conn.commit()
+        return found
+
+    def put_many(self, entries, replace=True):
+        """寫入 [Word, POS, Chinese_1, Chinese_2, Example] 列表，回傳筆數"""
+        now = datetime.datetime.now().isoformat(timespec='seconds')
+        rows = [(normalize_word(entry[0]), *entry[:5], now) for entry in entries if entry and entry[0]]
+        if not rows:
+            return 0
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        with self._lock:
+            self._conn.executemany(f"{verb} INTO entries (key, word, pos, chinese_1, chinese_2, example, updated) "
+                                   "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+        return len(rows)
+
+    def put_text(self, text):
+        """把 Gemini 回傳的整理結果寫入快取"""
+        return self.put_many([entry for entry in map(parse_line, text.splitlines()) if entry])
+
+    def stats(self):
+        """本次執行與累計的命中/未命中次數"""
+        with self._lock:
+            totals = dict(self._conn.execute("SELECT name, value FROM stats").fetchall())
+            size = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "total_hits": totals.get("hits", 0),
+                "total_misses": totals.get("misses", 0), "entries": size}
+
+
+def validate_entries(data, indexes):
+    """單次走訪驗證 JSON 結果，回傳 ({行號: [entry, ...]}, 無效或缺少的行號 set)"""
+    valid = {}
+    invalid = set()
+    for item in data if isinstance(data, list) else []:
+        if not isinstance(item, dict):
+            continue
+        index = item.get("index")
+        if isinstance(index, str) and index.strip().isdigit():
+            index = int(index)
+        if index not in indexes:
+            continue
+        values = [item.get(key) for key in ENTRY_KEYS]
+        if all(isinstance(value, str) and value.strip() for value in values):
+            valid.setdefault(index, []).append([value.strip() for value in values])
+        else:
+            invalid.add(index)
+    invalid |= set(indexes) - set(valid)
+    return valid, invalid - set(valid)
+
+
+def request_structured(numbered_lines):
+    """呼叫 Gemini 的 JSON 模式（會阻塞），回傳解析後的資料；不是合法 JSON 時回傳 None"""
+    response = client.models.generate_content(
+        model=GEMINI_MODEL, contents=build_structured_prompt(numbered_lines),
+        config={"response_mime_type": "application/json", "response_schema": ENTRY_SCHEMA})
+    try:
+        return json.loads(clean_response(response.text))
+    except (TypeError, ValueError):
+        return None
+
+
+def enrich_structured(raw_text, retries=MAX_RETRIES):
+    """JSON 結構化版 enrich：只重新請求無效或缺少的行，重試後仍無效的行保留原文
+
+    回傳與 enrich 相同格式的文字（依輸入行順序）
+    """
+    lines = [line.strip() for line in raw_text.splitlines() if line.strip()]
+    entries = {}
+    pending = list(range(len(lines)))
+    for _ in range(retries + 1):
+        if not pending:
+            break
+        valid, pending = validate_entries(request_structured([(i, lines[i]) for i in pending]), set(pending))
+        entries.update(valid)
+        pending = sorted(pending)
+    output = []
+    for i, line in enumerate(lines):
+        output += [format_entry(entry) for entry in entries[i]] if i in entries else [line]
+    return "\n".join(output)
+
+
+def split_chunks(raw_text, chunk_lines=CHUNK_LINES):
+    """依行切塊（忽略空行），保留原本順序"""
+    lines = [line.strip() for line in raw_text.splitlines() if line.strip()]
+    return ["\n".join(lines[i:i + chunk_lines]) for i in range(0, len(lines), chunk_lines)]
+
+
+def plan_chunks(raw_text, cache=None, chunk_lines=CHUNK_LINES):
+    """先查快取再切塊：回傳 (塊 list, 預先填好的結果 list)
+
+    連續命中的行合成一塊並直接填入快取內容；其餘連續未命中的行依 chunk_lines 切塊送出
+    """
+    lines = [line.strip() for line in raw_text.splitlines() if line.strip()]
+    if cache is None:
+        chunks = split_chunks(raw_text, chunk_lines)
+        return chunks, [None] * len(chunks)
+    found = cache.get_many([key for key in map(cache_key, lines) if key])
+
+    chunks, results = [], []
+    run, run_cached = [], None
+
+    def flush():
+        if not run:
+            return
+        if run_cached:
+            chunks.append("\n".join(run))
+            results.append("\n".join(format_entry(found[cache_key(line)]) for line in run))
+        else:
+            for i in range(0, len(run), chunk_lines):
+                chunks.append("\n".join(run[i:i + chunk_lines]))
+                results.append(None)
+
+    for line in lines:
+        cached = cache_key(line) in found
+        if run and cached != run_cached:
+            flush()
+            run = []
+        run.append(line)
+        run_cached = cached
+    flush()
+    return chunks, results
+
+
+def enrich_chunks(chunks, workers=MAX_WORKERS, retries=MAX_RETRIES, on_progress=None, cancel_event=None, results=None,
+                  on_line=None, on_chunk=None, on_discard=None, enrich_fn=enrich):
+    """以有上限的 thread pool 平行整理各塊，只重試失敗的塊
+
+    results 可預先填入（例如快取命中的塊），只送出其中為 None 的塊。
+    指定 on_line(塊索引, 行) 時改用串流，每收到一行就回呼；on_chunk(塊索引, 結果) 在每塊完成時回呼。
+    串流的塊失敗時回呼 on_discard(塊索引)，該塊已送出的行作廢（重試時會重新串流）。
+    enrich_fn 為非串流時每塊使用的函式（例如 enrich_structured）。
+    回傳 (依原順序的結果 list, {塊索引: 錯誤訊息})；重試後仍失敗的塊結果為 None
+    """
+    results = list(results) if results is not None else [None] * len(chunks)
+    errors = {}
+    pending = [i for i, result in enumerate(results) if result is None]
+    total = len(pending)
+    done = 0
+    for attempt in range(retries + 1):
+        if not pending or (cancel_event is not None and cancel_event.is_set()):
+            break
+        if attempt:
+            time.sleep(attempt)  # 簡單退避，避免立刻撞到同樣的限流
+        failed = []
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pending)))) as pool:
+            if on_line:
+                futures = {pool.submit(enrich_stream, chunks[i], lambda line, i=i: on_line(i, line)): i for i in pending}
+            else:
+                futures = {pool.submit(enrich_fn, chunks[i]): i for i in pending}
+            for future in as_completed(futures):
+                i = futures[future]
+                if cancel_event is not None and cancel_event.is_set():
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    break
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    errors[i] = str(e)
+                    failed.append(i)
+                    if on_line and on_discard:
+                        on_discard(i)
+                    continue
+                errors.pop(i, None)
+                done += 1
+                if on_chunk:
+                    on_chunk(i, results[i])
+                if on_progress:
+                    on_progress(done, total)
+        pending = sorted(failed)
+    return results, errors
+
+
+def merge_results(chunks, results):
+    """依原順序合併；失敗的塊保留原文，內容不會遺失"""
+    parts = [result if result is not None else chunk for chunk, result in zip(chunks, results)]
+    return "\n".join(part for part in parts if part)
+
 class VocabApp(ctk.CTk):
     def __init__(self):
         super().__init__()
@@ -56,6 +417,11 @@ class VocabApp(ctk.CTk):
         self.date_entry.grid(row=0, column=3, padx=15, pady=15)
         self.date_entry.insert(0, datetime.date.today().strftime("%Y-%m-%d"))
 
+        # 輸出模式：串流文字逐行顯示在輸入框；JSON 結構化逐筆驗證，只重新請求無效的單字
+        self.mode_selector = ctk.CTkSegmentedButton(self.header_frame, values=OUTPUT_MODES)
+        self.mode_selector.grid(row=1, column=0, columnspan=4, padx=15, pady=(0, 15), sticky="w")
+        self.mode_selector.set(OUTPUT_MODES[0])
+
         # --- 2. 文字輸入與顯示區 ---
         self.main_frame = ctk.CTkFrame(self)
         self.main_frame.pack(fill="both", expand=True, padx=20, pady=10)
@@ -69,6 +435,10 @@ class VocabApp(ctk.CTk):
 
         self.input_text = ctk.CTkTextbox(self.main_frame, font=("Arial", 15), border_width=1)
         self.input_text.pack(fill="both", expand=True, padx=15, pady=(0, 15))
+
+        # 串流預覽區（唯讀，只在串流時顯示；輸入框在處理中維持可編輯）
+        self.stream_view = ctk.CTkTextbox(self.main_frame, height=160, font=("Arial", 14), border_width=1,
+                                          state="disabled")
         
         # --- 3. 按鈕功能區 ---
         self.action_frame = ctk.CTkFrame(self, fg_color="transparent")
@@ -94,6 +464,18 @@ class VocabApp(ctk.CTk):
         )
         self.btn_gemini.pack(side="left", padx=5, expand=True, fill="x")
 
+        # 取消按鈕（處理中才可按）
+        self.btn_cancel = ctk.CTkButton(
+            self.action_frame, 
+            text="取消", 
+            width=80,
+            fg_color="#B71C1C", 
+            hover_color="#7F0000", 
+            state="disabled",
+            command=self.cancel_gemini_processing
+        )
+        self.btn_cancel.pack(side="left", padx=5)
+
         # 儲存按鈕
         self.btn_save = ctk.CTkButton(
             self.action_frame, 
@@ -108,9 +490,32 @@ class VocabApp(ctk.CTk):
         self.status_bar = ctk.CTkLabel(self, text="系統準備就緒", anchor="w", font=("Arial", 12))
         self.status_bar.pack(fill="x", side="bottom", padx=25, pady=5)
 
+        self.progress_bar = ctk.CTkProgressBar(self)
+        self.progress_bar.set(0)
+        self.progress_bar.pack(fill="x", side="bottom", padx=25, pady=(5, 0))
+
+        # Gemini 背景工作狀態
+        self.result_queue = queue.Queue()
+        self.gemini_job = None
+        self.job_counter = 0
+        self.polling = False
+
+        # 單字快取（無法建立時照常使用，只是每次都送出）
+        self.cache = None
+        try:
+            self.cache = EnrichCache()
+            self.cache.seed_from_csv(BASE_DIR / "vocab_list.csv")
+        except (sqlite3.Error, OSError) as e:
+            print(f"單字快取無法使用: {e}")
+
         # 初始檢查
         if client is None:
             self.update_status("警告：API 連線未建立，請檢查您的 Google API Key", "red")
+        elif self.cache is not None:
+            stats = self.cache.stats()
+            lookups = stats["total_hits"] + stats["total_misses"]
+            rate = f"，累計命中率 {stats['total_hits'] / lookups:.0%}" if lookups else ""
+            self.update_status(f"系統準備就緒（本地快取 {stats['entries']} 個單字{rate}）")
 
     def update_status(self, text, color=None):
         """更新狀態列的文字與視覺反饋"""
@@ -121,7 +526,6 @@ class VocabApp(ctk.CTk):
             # 根據目前主題恢復預設文字顏色
             default_color = "white" if ctk.get_appearance_mode() == "Dark" else "black"
             self.status_bar.configure(text_color=default_color)
-        self.update() # 強制更新 UI
 
     def clear_fields(self):
         """清空輸入框"""
@@ -129,7 +533,7 @@ class VocabApp(ctk.CTk):
         self.update_status("已清除所有內容")
 
     def run_gemini_processing(self):
-        """呼叫 Gemini API 進行單字整理"""
+        """在背景執行緒呼叫 Gemini API 進行單字整理，結果由主執行緒輪詢取回"""
         raw_text = self.input_text.get("1.0", "end").strip()
         
         if not raw_text:
@@ -139,51 +543,180 @@ class VocabApp(ctk.CTk):
         if client is None:
             messagebox.showerror("錯誤", "API Client 尚未初始化，無法執行 AI 功能。")
             return
-        
-        self.update_status("Gemini AI 正在解析單字並生成例句...請稍候", "#FF9800")
-        self.btn_gemini.configure(state="disabled") # 防止重複點擊
-
-        prompt = f"""
-        You are a vocabulary organizing assistant.
-        I will give you a list of words or messy notes. Your goal is to extract the vocabulary and fill in missing information.
 
-        Input Text:
-        {raw_text}
+        if self.gemini_job is not None:
+            return
 
-        Requirements:
-        1. Identify the main English word each line.
-        2. If a line includes definitions or example sentences, CORRECT them if there are errors.
-        3. If definitions (Chinese_1, Chinese_2), POS, or example sentences are MISSING, provide them.
-        4. Ensure the Part of Speech (POS) in Traditional Chinese (e.g., 名詞, 動詞, 形容詞).
-        5. Ensure the (Chinese_1, Chinese_2) in Traditional Chinese.
-        6. Output format MUST be strictly separated by a pipe symbol (|) for each line.
-        7. Format: Word | POS | Chinese_1 | Chinese_2 | Example
-        8. Do not output any header or markdown symbols, just the raw data lines.
-        """
+        # 每次送出都是新的工作編號，已取消工作的結果直接丟棄
+        self.job_counter += 1
+        mode = self.mode_selector.get()
+        structured = mode == "JSON 結構化"
+        chunks, results = plan_chunks(raw_text, self.cache, STRUCTURED_CHUNK_LINES if structured else CHUNK_LINES)
+        cached_lines = sum(len(chunk.splitlines()) for chunk, result in zip(chunks, results) if result is not None)
+        if all(result is not None for result in results):
+            # 全部命中快取，不需呼叫 API
+            self._apply_result(raw_text, merge_results(chunks, results))
+            self.update_status(f"全部 {cached_lines} 個單字取自本地快取！請確認內容無誤後點擊儲存", "#4CAF50")
+            return
 
+        self.gemini_job = {"id": self.job_counter, "raw_text": raw_text, "started": time.perf_counter(),
+                           "cancel": threading.Event(), "done": 0, "cached": cached_lines,
+                           "total": sum(result is None for result in results),
+                           "stream": mode == "串流文字", "chunks": chunks, "results": list(results),
+                           "first_line": None}
+        if self.gemini_job["stream"]:
+            self._begin_stream(results)
+        self.btn_gemini.configure(state="disabled") # 防止重複點擊
+        self.btn_cancel.configure(state="normal")
+        self.progress_bar.configure(mode="indeterminate")
+        self.progress_bar.start()
+        self.update_status("Gemini AI 正在解析單字並生成例句...（可繼續編輯，按「取消」中止）", "#FF9800")
+
+        threading.Thread(target=self._gemini_worker, daemon=True,
+                         args=(self.job_counter, chunks, results, self.gemini_job["cancel"], self.gemini_job["stream"],
+                               enrich_structured if structured else enrich)).start()
+        if not self.polling:
+            self.polling = True
+            self.after(POLL_MS, self._poll_gemini_results)
+
+    def _gemini_worker(self, job_id, chunks, cached_results, cancel_event, stream=False, enrich_fn=enrich):
+        """背景執行緒：不直接碰 UI，只把進度與結果放進 queue"""
+        on_line = (lambda i, line: self.result_queue.put(("line", job_id, (i, line)))) if stream else None
         try:
-            # 使用最新穩定版模型
-            response = client.models.generate_content(
-                #model='models/gemini-2.5-flash-lite',
-                model='models/gemini-2.5-flash',
-                #model='gemini-2.0-flash-lite-preview-02-05',
-                contents=prompt
-            )
-            processed_text = response.text.strip()
-            
-            # 清除 Markdown 可能帶有的符號 (防呆)
-            if processed_text.startswith("```"):
-                processed_text = "\n".join(processed_text.split("\n")[1:-1])
-
-            self.input_text.delete("1.0", "end")
-            self.input_text.insert("1.0", processed_text)
-            self.update_status("Gemini 處理完成！請確認內容無誤後點擊儲存", "#4CAF50")
-            
+            results, errors = enrich_chunks(
+                chunks, on_progress=lambda done, total: self.result_queue.put(("progress", job_id, done)),
+                cancel_event=cancel_event, results=cached_results, on_line=on_line,
+                on_discard=lambda i: self.result_queue.put(("discard", job_id, i)),
+                on_chunk=lambda i, result: self.result_queue.put(("chunk", job_id, (i, result))), enrich_fn=enrich_fn)
+            if self.cache is not None and not cancel_event.is_set():
+                self.cache.put_text("\n".join(result for result, cached in zip(results, cached_results)
+                                              if result is not None and cached is None))
         except Exception as e:
-            self.update_status(f"API 呼叫失敗: {str(e)}", "red")
-            messagebox.showerror("API Error", f"無法連接至 Gemini AI：\n{str(e)}")
-        finally:
-            self.btn_gemini.configure(state="normal")
+            self.result_queue.put(("error", job_id, str(e)))
+            return
+        if len(errors) == sum(result is None for result in cached_results):
+            self.result_queue.put(("error", job_id, next(iter(errors.values()))))
+        else:
+            self.result_queue.put(("done", job_id, (merge_results(chunks, results), errors)))
+
+    def _poll_gemini_results(self):
+        """主執行緒定期取回背景結果並更新畫面"""
+        while True:
+            try:
+                kind, job_id, payload = self.result_queue.get_nowait()
+            except queue.Empty:
+                break
+            if self.gemini_job is None or job_id != self.gemini_job["id"]:
+                continue  # 已取消的工作
+            if kind == "line":
+                if self.gemini_job["first_line"] is None:
+                    self.gemini_job["first_line"] = time.perf_counter() - self.gemini_job["started"]
+                i, line = payload
+                self._append_stream(line + "\n", f"chunk{i}")
+            elif kind == "discard":
+                self._discard_stream(f"chunk{payload}")
+            elif kind == "chunk":
+                i, result = payload
+                self.gemini_job["results"][i] = result
+            elif kind == "progress":
+                self.gemini_job["done"] = payload
+                if self.gemini_job["total"] > 1:
+                    self.progress_bar.stop()
+                    self.progress_bar.configure(mode="determinate")
+                    self.progress_bar.set(payload / self.gemini_job["total"])
+            elif kind == "done":
+                processed_text, errors = payload
+                total, cached = self.gemini_job["total"], self.gemini_job["cached"]
+                first_line = self.gemini_job["first_line"]
+                # 串流時預覽依到達順序附加，完成後依原順序合併回輸入框
+                self._end_stream()
+                self._apply_result(self.gemini_job["raw_text"], processed_text)
+                self._finish_job()
+                if errors:
+                    self.update_status(f"{total - len(errors)}/{total} 段完成，{len(errors)} 段重試後仍失敗（保留原文）: "
+                                       f"{next(iter(errors.values()))}", "red")
+                else:
+                    self.update_status("Gemini 處理完成！" + (f"（{cached} 個單字取自本地快取）" if cached else "")
+                                       + (f"（首筆 {first_line:.1f} 秒）" if first_line is not None else "")
+                                       + "請確認內容無誤後點擊儲存", "#4CAF50")
+            else:
+                self._abort_stream()
+                self._finish_job()
+                self.update_status(f"API 呼叫失敗: {payload}", "red")
+                messagebox.showerror("API Error", f"無法連接至 Gemini AI：\n{payload}")
+
+        if self.gemini_job is not None:
+            job = self.gemini_job
+            elapsed = time.perf_counter() - job["started"]
+            self.update_status(f"Gemini AI 正在解析單字並生成例句...{job['done']}/{job['total']} 段，已等待 {elapsed:.0f} 秒"
+                               "（可繼續編輯，按「取消」中止）", "#FF9800")
+            self.after(POLL_MS, self._poll_gemini_results)
+        else:
+            self.polling = False
+
+    def _apply_result(self, raw_text, processed_text):
+        """以結果取代送出的原文；若原文已被編輯，改為附加在最後，不覆蓋使用者的修改"""
+        content = self.input_text.get("1.0", "end").strip()
+        position = content.find(raw_text)
+        if position >= 0:
+            content = content[:position] + processed_text + content[position + len(raw_text):]
+        else:
+            content = f"{content}\n{processed_text}" if content else processed_text
+        self.input_text.delete("1.0", "end")
+        self.input_text.insert("1.0", content)
+
+    def _begin_stream(self, cached_results):
+        """顯示唯讀的串流預覽區：快取命中的內容先顯示，之後逐行附加；輸入框不動，使用者可繼續編輯"""
+        self.stream_view.configure(state="normal")
+        self.stream_view.delete("1.0", "end")
+        self.stream_view.configure(state="disabled")
+        preview = "\n".join(result for result in cached_results if result)
+        if preview:
+            self._append_stream(preview + "\n")
+        self.stream_view.pack(fill="x", padx=15, pady=(0, 15))
+
+    def _append_stream(self, text, tag=None):
+        self.stream_view.configure(state="normal")
+        self.stream_view.insert("end", text, tag)
+        self.stream_view.configure(state="disabled")
+        self.stream_view.see("end")
+
+    def _discard_stream(self, tag):
+        """移除失敗塊已串流的行，重試時不會重複顯示"""
+        ranges = self.stream_view.tag_ranges(tag)
+        self.stream_view.configure(state="normal")
+        for start, end in reversed(list(zip(ranges[0::2], ranges[1::2]))):
+            self.stream_view.delete(start, end)
+        self.stream_view.configure(state="disabled")
+
+    def _end_stream(self):
+        """收起串流預覽區"""
+        self.stream_view.pack_forget()
+
+    def _abort_stream(self):
+        """取消或失敗時：已完成的段落以結果取代原文（同 _apply_result，不覆蓋使用者的修改），其餘段落保留原文"""
+        job = self.gemini_job
+        if job is not None and job["stream"]:
+            self._end_stream()
+            if any(result is not None for result in job["results"]):
+                self._apply_result(job["raw_text"], merge_results(job["chunks"], job["results"]))
+
+    def _finish_job(self):
+        self.gemini_job = None
+        self.progress_bar.stop()
+        self.progress_bar.configure(mode="determinate")
+        self.progress_bar.set(0)
+        self.btn_gemini.configure(state="normal")
+        self.btn_cancel.configure(state="disabled")
+
+    def cancel_gemini_processing(self):
+        """取消目前的工作（尚未送出的段落不再送出，進行中的請求在背景結束，結果直接丟棄）"""
+        if self.gemini_job is None:
+            return
+        self.gemini_job["cancel"].set()
+        self._abort_stream()
+        self._finish_job()
+        self.update_status("已取消 Gemini 處理", "#FF9800")
 
     def save_to_file(self):
         """將整理好的單字存入 CSV 檔案"""
@@ -210,32 +743,86 @@ class VocabApp(ctk.CTk):
 
                 lines = content.split('\n')
                 saved_count = 0
+                complete = []
+                incomplete = []
                 
                 for line in lines:
                     line = line.strip()
                     if not line: continue
 
                     # 根據 '|' 分隔符號拆解
-                    parts = [p.strip() for p in line.split('|')]
+                    entry = parse_line(line)
                     
-                    if len(parts) >= 5:
+                    if entry:
                         # 完整格式：Word | POS | Ch1 | Ch2 | Ex
-                        row = [course, date_str] + parts[:5] + [0, 0]
+                        row = [course, date_str] + entry + [0, 0]
                         writer.writerow(row)
                         saved_count += 1
+                        complete.append(entry)
                     else:
                         # 格式不足時的備案：將第一個部分當成單字，其餘留空
-                        row = [course, date_str, parts[0], "", "", "", "", 0, 0]
+                        row = [course, date_str, line.split('|')[0].strip(), "", "", "", "", 0, 0]
                         writer.writerow(row)
                         saved_count += 1
-
-            self.update_status(f"儲存成功：已將 {saved_count} 個單字寫入 {filename.name}")
-            messagebox.showinfo("儲存成功", f"已成功儲存 {saved_count} 筆資料至：\n{filename}")
+                        incomplete.append(row[2])
+
+            # 使用者確認（或手動修正）過的內容也更新到快取
+            if self.cache is not None:
+                try:
+                    self.cache.put_many(complete)
+                except sqlite3.Error as e:
+                    print(f"單字快取寫入失敗: {e}")
+
+            if incomplete:
+                # 格式不完整的列不再默默存成空白欄位，提醒使用者補齊
+                self.update_status(f"儲存成功：已將 {saved_count} 個單字寫入 {filename.name}，其中 {len(incomplete)} 筆欄位不完整",
+                                   "#FF9800")
+                messagebox.showinfo("儲存成功", f"已成功儲存 {saved_count} 筆資料至：\n{filename}\n\n"
+                                               f"以下 {len(incomplete)} 筆欄位不完整：\n{', '.join(incomplete[:20])}"
+                                               + (" ..." if len(incomplete) > 20 else ""))
+            else:
+                self.update_status(f"儲存成功：已將 {saved_count} 個單字寫入 {filename.name}")
+                messagebox.showinfo("儲存成功", f"已成功儲存 {saved_count} 筆資料至：\n{filename}")
             
         except Exception as e:
             self.update_status("檔案儲存失敗", "red")
             messagebox.showerror("存檔錯誤", f"無法寫入 CSV 檔案，請檢查檔案是否被其他程式開啟：\n{e}")
 
+def benchmark(sizes=(50, 200, 1000)):
+    """比較整段單一請求、切塊平行請求與 JSON 結構化請求的耗時（單字取自 vocab_list.csv，不足時重複使用）"""
+    with open(BASE_DIR / "vocab_list.csv", encoding='utf-8-sig') as f:
+        words = [row["Word"] for row in csv.DictReader(f) if row.get("Word")]
+    for size in sizes:
+        raw_text = "\n".join(words[i % len(words)] for i in range(size))
+        started = time.perf_counter()
+        try:
+            single_lines = len(enrich(raw_text).splitlines())
+        except Exception as e:
+            single_lines = f"失敗 ({e})"
+        single = time.perf_counter() - started
+
+        chunks = split_chunks(raw_text)
+        started = time.perf_counter()
+        results, errors = enrich_chunks(chunks)
+        chunked = time.perf_counter() - started
+        chunked_lines = len(merge_results(chunks, results).splitlines())
+        chunks = split_chunks(raw_text, STRUCTURED_CHUNK_LINES)
+        started = time.perf_counter()
+        results, structured_errors = enrich_chunks(chunks, enrich_fn=enrich_structured)
+        structured = time.perf_counter() - started
+        structured_lines = sum(parse_line(line) is not None for line in merge_results(chunks, results).splitlines())
+        print(f"{size:>5} 字 | 單一請求 {single:6.1f}s ({single_lines} 行) | "
+              f"切塊 {len(split_chunks(raw_text))} x {MAX_WORKERS} 執行緒 {chunked:6.1f}s ({chunked_lines} 行, {len(errors)} 段失敗) | "
+              f"JSON {len(chunks)} 塊 {structured:6.1f}s ({structured_lines} 筆有效, {len(structured_errors)} 段失敗)")
+
+
 if __name__ == "__main__":
-    app = VocabApp()
-    app.mainloop()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="課程單字記錄小幫手")
+    parser.add_argument("--bench", action="store_true", help="以 50/200/1000 個單字比較單一請求、切塊平行請求與 JSON 結構化請求的耗時")
+    args = parser.parse_args()
+
+    if args.bench:
+        benchmark()
+    else:
+        app = VocabApp()
+        app.mainloop()